@@ -1,51 +1,143 @@
 
-from flask import Flask, request, jsonify
-from models import Room, Player, Game
+from flask import Flask, Response, request, jsonify, stream_with_context
+from models import Room, Player, Game, Profile
 import database as db
 import game_logic as logic
+import scoring
+import events
+from cache import response_cache
+from matchmaking import MatchmakingQueue
+from export import FORMATS, export_chunks
+from repository import GAME_FIELDS, PLAYER_FIELDS
+import metrics
+import workers
+import ratelimit
+import idempotency
+import reaper
 from datetime import datetime
 
 app = Flask(__name__)
+metrics.init_app(app)
+workers.init_app(app)
+ratelimit.init_app(app)
+idempotency.init_app(app)
+# After idempotency, so replays and retries waiting on one hold no slot
+ratelimit.init_admission(app)
 
-@app.route('/room/create', methods=['POST'])
-def create_room():
+# Longest time a long-poll request on /room/events is held open, in seconds
+LONG_POLL_TIMEOUT = 30
 
-    data = request.get_json()
-    
-    if not data or 'player_name' not in data:
-        return jsonify({'error': 'player_name is required'}), 400
-    
-    player_name = data['player_name']
+# Most items accepted by one /rooms/batch or /room/join/batch request
+MAX_BATCH_SIZE = 500
+
+SEAT_ERRORS = {
+    db.RoomNotFound: (404, 'Room not found'),
+    db.RoomFull: (400, 'Room is full'),
+    db.GameAlreadyStarted: (400, 'Game already started')
+}
 
+
+def new_room(player_name, variant=scoring.DEFAULT_VARIANT, user_id=None):
+    """Build a waiting Room and the Player who created it (not yet stored)."""
     room = Room(
-        room_id='',
+        room_id=workers.new_room_id(),
         created_by='',
         status='waiting',
-        player_count=1
+        player_count=1,
+        variant=variant
     )
     
     player = Player(
         player_id='',
         name=player_name,
-        room_id=''
+        room_id='',
+        user_id=user_id
     )
     
-    room = db.create_room(room)
     player.room_id = room.room_id
     room.created_by = player.player_id
-    player = db.add_player(player)
-    
+    return room, player
 
-    room.created_by = player.player_id
-    db.update_room(room)
+
+def unknown_variant(variant):
+    """Error message for a variant name that is not configured, else None."""
+    if variant in scoring.variants:
+        return None
+    return 'variant must be one of: ' + ', '.join(scoring.variants)
+
+
+def unknown_profile(user_id):
+    """Error message unless user_id is absent or names a stored profile."""
+    if user_id is None:
+        return None
+    if not isinstance(user_id, str) or not db.get_profile(user_id):
+        return 'Profile not found'
+    return None
+
+
+def rooms_joined(players):
+    deltas = {}
+    for player in players:
+        if player.user_id:
+            deltas.setdefault(player.user_id, {'rooms_joined': 0})['rooms_joined'] += 1
+    return deltas
+
+
+def room_variant(room_id):
+    room = db.get_room(room_id)
+    return scoring.get_variant(room.variant if room else None)
+
+
+def seat_taken(player, seat, capacity):
+    """Announce a successful join and build its response body."""
+    players_joined = seat + 1
+    events.bus.publish(player.room_id, 'player_joined', {
+        'player_id': player.player_id,
+        'name': player.name,
+        'players_joined': players_joined
+    })
+    response = {
+        'player_id': player.player_id,
+        'player_name': player.name,
+        'room_id': player.room_id,
+        'message': 'Joined room successfully',
+        'players_joined': players_joined,
+        'waiting_for': capacity - players_joined
+    }
+    if players_joined == capacity:
+        response['message'] = 'Joined room successfully. All players ready! Assigning roles...'
+    return response
+
+
+@app.route('/room/create', methods=['POST'])
+def create_room():
+
+    data = request.get_json()
+    
+    if not data or 'player_name' not in data:
+        return jsonify({'error': 'player_name is required'}), 400
+    
+    variant = data.get('variant', scoring.DEFAULT_VARIANT)
+    error = unknown_variant(variant)
+    if error:
+        return jsonify({'error': error}), 400
+    if unknown_profile(data.get('user_id')):
+        return jsonify({'error': 'Profile not found'}), 404
+    
+    room, player = new_room(data['player_name'], variant, data.get('user_id'))
+    with db.transaction():
+        room = db.create_room(room)
+        player = db.add_player(player)
+        db.add_to_profiles(rooms_joined([player]))
     
     return jsonify({
         'room_id': room.room_id,
         'player_id': player.player_id,
         'player_name': player.name,
         'message': 'Room created successfully',
+        'variant': room.variant,
         'players_joined': 1,
-        'waiting_for': 3
+        'waiting_for': scoring.get_variant(variant).capacity - 1
     }), 201
 
 
@@ -56,253 +148,714 @@ def join_room():
     
     if not data or 'room_id' not in data or 'player_name' not in data:
         return jsonify({'error': 'room_id and player_name are required'}), 400
+    if unknown_profile(data.get('user_id')):
+        return jsonify({'error': 'Profile not found'}), 404
     
     room_id = data['room_id']
     player_name = data['player_name']
     
-    room = db.get_room(room_id)
-    if not room:
-        return jsonify({'error': 'Room not found'}), 404
-    current_players = db.get_players_in_room(room_id)
-    if len(current_players) >= 4:
-        return jsonify({'error': 'Room is full'}), 400
-  
-    if room.status != 'waiting':
-        return jsonify({'error': 'Game already started'}), 400
-    
-
     player = Player(
         player_id='',
         name=player_name,
-        room_id=room_id
+        room_id=room_id,
+        user_id=data.get('user_id')
     )
-    player = db.add_player(player)
-    
+    try:
+        seat = db.reserve_seat(player)
+    except tuple(SEAT_ERRORS) as e:
+        status, message = SEAT_ERRORS[type(e)]
+        return jsonify({'error': message}), status
+    db.add_to_profiles(rooms_joined([player]))
 
-    room.player_count = len(current_players) + 1
-    db.update_room(room)
+    capacity = room_variant(room_id).capacity
+    response = seat_taken(player, seat, capacity)
     
-    response = {
-        'player_id': player.player_id,
-        'player_name': player.name,
-        'room_id': room_id,
-        'message': 'Joined room successfully',
-        'players_joined': room.player_count,
-        'waiting_for': 4 - room.player_count
-    }
+    # Only the join that took the last seat starts the game
+    if seat == capacity - 1:
+        with db.room_lock(room_id):
+            assign_roles_internal(room_id)
     
-    if room.player_count == 4:
-        response['message'] = 'Joined room successfully. All players ready! Assigning roles...'
+    return jsonify(response), 200
+
+
+def batch_items(data, key):
+    items = data.get(key) if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return None, (jsonify({'error': '{} must be a non-empty list'.format(key)}), 400)
+    if len(items) > MAX_BATCH_SIZE:
+        return None, (jsonify({'error': 'At most {} items per batch'.format(MAX_BATCH_SIZE)}), 400)
+    return items, None
+
+
+@app.route('/rooms/batch', methods=['POST'])
+def create_rooms_batch():
+    """Create many rooms in one storage write: {"rooms": [{"player_name": ..., "variant": ...}, ...]}"""
+    items, error = batch_items(request.get_json(silent=True), 'rooms')
+    if error:
+        return error
+    
+    rooms, players, results = [], [], []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or 'player_name' not in item:
+            results.append({'index': index, 'status': 400, 'error': 'player_name is required'})
+            continue
+        variant = item.get('variant', scoring.DEFAULT_VARIANT)
+        error = unknown_variant(variant)
+        if error:
+            results.append({'index': index, 'status': 400, 'error': error})
+            continue
+        error = unknown_profile(item.get('user_id'))
+        if error:
+            results.append({'index': index, 'status': 404, 'error': error})
+            continue
+        room, player = new_room(item['player_name'], variant, item.get('user_id'))
+        rooms.append(room)
+        players.append(player)
+        results.append({
+            'index': index,
+            'status': 201,
+            'room_id': room.room_id,
+            'player_id': player.player_id,
+            'player_name': player.name
+        })
     
-        assign_roles_internal(room_id)
+    if rooms:
+        with db.transaction():
+            db.create_rooms(rooms, players)
+            db.add_to_profiles(rooms_joined(players))
     
-    return jsonify(response), 200
+    return jsonify({'created': len(rooms), 'results': results}), 200
+
+
+@app.route('/room/join/batch', methods=['POST'])
+def join_rooms_batch():
+    """Seat many players in one storage write: {"joins": [{"room_id": ..., "player_name": ...}, ...]}"""
+    items, error = batch_items(request.get_json(silent=True), 'joins')
+    if error:
+        return error
+    
+    results = [None] * len(items)
+    players, indexes = [], []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or 'room_id' not in item or 'player_name' not in item:
+            results[index] = {'index': index, 'status': 400,
+                              'error': 'room_id and player_name are required'}
+            continue
+        if not workers.is_local(str(item['room_id'])):
+            # Seats are only handed out by the room's own worker
+            owner = workers.worker_for(str(item['room_id']))
+            results[index] = {'index': index, 'status': 421, 'worker': owner,
+                              'error': 'Room is served by worker {}'.format(owner)}
+            continue
+        error = unknown_profile(item.get('user_id'))
+        if error:
+            results[index] = {'index': index, 'status': 404, 'error': error}
+            continue
+        players.append(Player(player_id='', name=item['player_name'], room_id=item['room_id'],
+                              user_id=item.get('user_id')))
+        indexes.append(index)
+    
+    seats = db.reserve_seats(players) if players else []
+    full_rooms, capacities = [], {}
+    for index, player, seat in zip(indexes, players, seats):
+        if isinstance(seat, Exception):
+            status, message = SEAT_ERRORS[type(seat)]
+            results[index] = {'index': index, 'status': status, 'error': message}
+            continue
+        if player.room_id not in capacities:
+            capacities[player.room_id] = room_variant(player.room_id).capacity
+        capacity = capacities[player.room_id]
+        results[index] = dict(seat_taken(player, seat, capacity), index=index, status=200)
+        if seat == capacity - 1:
+            full_rooms.append(player.room_id)
+    db.add_to_profiles(rooms_joined(
+        [p for p, seat in zip(players, seats) if not isinstance(seat, Exception)]))
+    
+    for room_id in full_rooms:
+        with db.room_lock(room_id):
+            assign_roles_internal(room_id)
+    
+    return jsonify({'joined': len(players) - sum(isinstance(s, Exception) for s in seats),
+                    'results': results}), 200
 
 
 @app.route('/room/players/<room_id>', methods=['GET'])
 def get_room_players(room_id):
 
-    room = db.get_room(room_id)
-    if not room:
+    with db.room_read_lock(room_id):
+        room = db.get_room(room_id)
+        if not room:
+            return jsonify({'error': 'Room not found'}), 404
+    
+        players = db.get_players_in_room(room_id)
+    
+        return jsonify({
+            'room_id': room_id,
+            'status': room.status,
+            'player_count': len(players),
+            'players': [p.to_public_dict() for p in players]
+        }), 200
+
+@app.route('/room/events/<room_id>', methods=['GET'])
+def get_room_events(room_id):
+    """Long-poll for player_joined, roles_assigned and game_completed events.
+
+    Returns as soon as there are events after ?since=<seq>, or an empty list
+    after ?timeout= seconds. Pass the returned last_seq as the next since.
+    """
+    if not db.get_room(room_id):
         return jsonify({'error': 'Room not found'}), 404
     
-    players = db.get_players_in_room(room_id)
+    since = request.args.get('since', 0, type=int)
+    timeout = min(request.args.get('timeout', 25, type=float), LONG_POLL_TIMEOUT)
+    room_events = events.bus.wait(room_id, since, timeout)
     
     return jsonify({
         'room_id': room_id,
-        'status': room.status,
-        'player_count': len(players),
-        'players': [p.to_public_dict() for p in players]
+        'events': room_events,
+        'last_seq': room_events[-1]['seq'] if room_events else since
     }), 200
 
 def assign_roles_internal(room_id):
+    # Caller must hold db.room_lock(room_id)
     room = db.get_room(room_id)
     players = db.get_players_in_room(room_id)
     
-    if len(players) != 4:
+    if room.status != 'waiting' or len(players) != scoring.get_variant(room.variant).capacity:
         return False
-    players = logic.assign_roles(players)
-    db.update_players_batch(players)
+    start_round(room, players)
+    
+    return True
 
-    room.status = 'playing'
-    db.update_room(room)
 
-    mantri = logic.get_mantri_player(players)
-    chor = logic.get_chor_player(players)
+def start_round(room, players):
+    """Deal fresh roles and open the room's next Game.
+
+    Caller must hold db.room_lock(room.room_id). Points carry over, and the
+    room remembers the new game so later lookups need no search.
+    """
+    variant = scoring.get_variant(room.variant)
+    players = logic.assign_roles(players, variant)
+    # Rooms created before round tracking have played exactly one round
+    previous_round = room.current_round or (0 if room.status == 'waiting' else 1)
+
+    # mantri/chor columns hold the variant's guesser and target
+    guesser = logic.get_player_by_role(players, variant.guesser)
+    target = logic.get_player_by_role(players, variant.target)
     
     game = Game(
         game_id='',
-        room_id=room_id,
-        mantri_player_id=mantri.player_id,
-        chor_player_id=chor.player_id,
-        status='in_progress'
+        room_id=room.room_id,
+        mantri_player_id=guesser.player_id,
+        chor_player_id=target.player_id,
+        status='in_progress',
+        round_number=previous_round + 1,
+        role_assignments=logic.encode_role_assignments(players),
+        variant=variant.name
     )
-    db.create_game(game)
-    
-    return True
+    room.status = 'playing'
+    room.current_round = game.round_number
+    room.current_game_id = game.game_id
+    with db.transaction():
+        db.update_players_batch(players)
+        db.update_room(room)
+        db.create_game(game)
+    events.bus.publish(room.room_id, 'roles_assigned', {
+        'game_id': game.game_id,
+        'round_number': game.round_number
+    })
+    
+    return game
+
+
+def get_room_game(room):
+    """The room's current (or last) game; old rooms without a pointer fall back to a lookup."""
+    if room.current_game_id:
+        return db.get_game(room.current_game_id, room.room_id)
+    if room.status == 'finished':
+        return db.get_latest_game(room.room_id)
+    return db.get_current_game(room.room_id)
 
 
 @app.route('/room/assign/<room_id>', methods=['POST'])
 def assign_roles(room_id):
-    room = db.get_room(room_id)
-    if not room:
-        return jsonify({'error': 'Room not found'}), 404
-    
-    players = db.get_players_in_room(room_id)
-    
-    if len(players) != 4:
-        return jsonify({'error': 'Need exactly 4 players to start game'}), 400
-    
-    if room.status != 'waiting':
-        return jsonify({'error': 'Roles already assigned'}), 400
-    
-    success = assign_roles_internal(room_id)
-    
-    if success:
-        return jsonify({
-            'message': 'Roles assigned successfully',
-            'room_id': room_id,
-            'status': 'playing'
-        }), 200
-    else:
-        return jsonify({'error': 'Failed to assign roles'}), 500
+    with db.room_lock(room_id):
+        room = db.get_room(room_id)
+        if not room:
+            return jsonify({'error': 'Room not found'}), 404
+    
+        players = db.get_players_in_room(room_id)
+        capacity = scoring.get_variant(room.variant).capacity
+    
+        if len(players) != capacity:
+            return jsonify({'error': 'Need exactly {} players to start game'.format(capacity)}), 400
+    
+        if room.status != 'waiting':
+            return jsonify({'error': 'Roles already assigned'}), 400
+    
+        success = assign_roles_internal(room_id)
+    
+        if success:
+            return jsonify({
+                'message': 'Roles assigned successfully',
+                'room_id': room_id,
+                'status': 'playing'
+            }), 200
+        else:
+            return jsonify({'error': 'Failed to assign roles'}), 500
 @app.route('/role/me/<room_id>/<player_id>', methods=['GET'])
 def get_my_role(room_id, player_id):
 
-    room = db.get_room(room_id)
-    if not room:
-        return jsonify({'error': 'Room not found'}), 404
+    with db.room_read_lock(room_id):
+        room = db.get_room(room_id)
+        if not room:
+            return jsonify({'error': 'Room not found'}), 404
     
-    player = db.get_player(player_id)
-    if not player:
-        return jsonify({'error': 'Player not found'}), 404
+        player = db.get_player(player_id, room_id)
+        if not player:
+            return jsonify({'error': 'Player not found'}), 404
     
-    if player.room_id != room_id:
-        return jsonify({'error': 'Player not in this room'}), 403
+        if player.room_id != room_id:
+            return jsonify({'error': 'Player not in this room'}), 403
     
-    if not player.role:
-        return jsonify({'error': 'Roles not yet assigned. Waiting for players...'}), 400
+        if not player.role:
+            return jsonify({'error': 'Roles not yet assigned. Waiting for players...'}), 400
     
-    return jsonify({
-        'player_id': player.player_id,
-        'name': player.name,
-        'role': player.role,
-        'description': get_role_description(player.role)
-    }), 200
+        return jsonify({
+            'player_id': player.player_id,
+            'name': player.name,
+            'role': player.role,
+            'description': get_role_description(player.role, room.variant)
+        }), 200
 
 
-def get_role_description(role):
-    descriptions = {
-        'Raja': 'You are the Raja (King). Observe and wait for results. You get 1000 points.',
-        'Mantri': 'You are the Mantri (Minister). You must guess who the Chor is!',
-        'Chor': 'You are the Chor (Thief). Try not to get caught!',
-        'Sipahi': 'You are the Sipahi (Soldier). Wait for Mantri to make their guess.'
-    }
-    return descriptions.get(role, '')
+def get_role_description(role, variant=scoring.DEFAULT_VARIANT):
+    return scoring.get_variant(variant).descriptions.get(role, '')
+
+
+@app.route('/scoring/variants', methods=['GET'])
+def get_scoring_variants():
+    return jsonify({'default': scoring.DEFAULT_VARIANT,
+                    'variants': [v.to_dict() for v in scoring.variants.values()]}), 200
 @app.route('/guess/<room_id>', methods=['POST'])
 def submit_guess(room_id):
 
     data = request.get_json()
     
-    if not data or 'mantri_player_id' not in data or 'guessed_player_id' not in data:
+    # guesser_player_id is accepted too, for variants where the Mantri does not guess
+    mantri_player_id = data.get('mantri_player_id', data.get('guesser_player_id')) if data else None
+    if mantri_player_id is None or 'guessed_player_id' not in data:
         return jsonify({'error': 'mantri_player_id and guessed_player_id are required'}), 400
     
-    mantri_player_id = data['mantri_player_id']
     guessed_player_id = data['guessed_player_id']
     
     # Validate room
-    room = db.get_room(room_id)
-    if not room:
-        return jsonify({'error': 'Room not found'}), 404
+    with db.room_lock(room_id):
+        room = db.get_room(room_id)
+        if not room:
+            return jsonify({'error': 'Room not found'}), 404
     
-    if room.status != 'playing':
-        return jsonify({'error': 'Game not in progress'}), 400
+        if room.status != 'playing':
+            return jsonify({'error': 'Game not in progress'}), 400
     
-    mantri = db.get_player(mantri_player_id)
-    if not mantri or mantri.room_id != room_id:
-        return jsonify({'error': 'Invalid mantri player'}), 403
+        variant = scoring.get_variant(room.variant)
+        mantri = db.get_player(mantri_player_id, room_id)
+        if not mantri or mantri.room_id != room_id:
+            return jsonify({'error': 'Invalid mantri player'}), 403
     
-    if mantri.role != 'Mantri':
-        return jsonify({'error': 'Only Mantri can submit guess'}), 403
+        if mantri.role != variant.guesser:
+            return jsonify({'error': 'Only {} can submit guess'.format(variant.guesser)}), 403
     
 
-    guessed_player = db.get_player(guessed_player_id)
-    if not guessed_player or guessed_player.room_id != room_id:
-        return jsonify({'error': 'Invalid guessed player'}), 400
-    players = db.get_players_in_room(room_id)
-    game = db.get_current_game(room_id)
+        guessed_player = db.get_player(guessed_player_id, room_id)
+        if not guessed_player or guessed_player.room_id != room_id:
+            return jsonify({'error': 'Invalid guessed player'}), 400
+        players = db.get_players_in_room(room_id)
+        game = get_room_game(room)
     
-    if not game:
-        return jsonify({'error': 'No active game found'}), 404
+        if not game or game.status != 'in_progress':
+            return jsonify({'error': 'No active game found'}), 404
     
 
-    chor = logic.get_chor_player(players)
-    scores, guess_correct = logic.calculate_scores(mantri, guessed_player_id, chor)
+        chor = logic.get_player_by_role(players, variant.target)
+        scores, guess_correct = logic.calculate_scores(mantri, guessed_player_id, chor, variant)
     
   
-    game.guessed_player_id = guessed_player_id
-    game.guess_correct = guess_correct
-    game.raja_points = scores['Raja']
-    game.mantri_points = scores['Mantri']
-    game.chor_points = scores['Chor']
-    game.sipahi_points = scores['Sipahi']
-    game.status = 'completed'
-    db.update_game(game)
-    
-    # Update player scores
-    players = logic.update_player_scores(players, scores)
-    db.update_players_batch(players)
-
-    room.status = 'finished'
-    db.update_room(room)
-    result = logic.prepare_game_result(players, game)
+        game.guessed_player_id = guessed_player_id
+        game.guess_correct = guess_correct
+        logic.record_scores(game, scores)
+        game.status = 'completed'
+    
+        # Update player scores
+        players = logic.update_player_scores(players, scores)
+        room.status = 'finished'
+        deltas = logic.profile_deltas(players, scores, variant.target, guess_correct,
+                                      datetime.now().isoformat())
+
+        # One commit for the game, the scores, the room status and profiles
+        with db.transaction():
+            db.update_game(game)
+            db.update_players_batch(players)
+            db.update_room(room)
+            db.add_to_profiles(deltas)
+        result = logic.prepare_game_result(players, game)
+        events.bus.publish(room_id, 'game_completed', {
+            'game_id': game.game_id,
+            'mantri_guess_correct': game.guess_correct
+        })
     
-    return jsonify({
-        'message': 'Guess submitted successfully',
-        'result': result
-    }), 200
+        return jsonify({
+            'message': 'Guess submitted successfully',
+            'result': result
+        }), 200
+
+@app.route('/room/next-round/<room_id>', methods=['POST'])
+def next_round(room_id):
+    with db.room_lock(room_id):
+        room = db.get_room(room_id)
+        if not room:
+            return jsonify({'error': 'Room not found'}), 404
+    
+        if room.status != 'finished':
+            return jsonify({'error': 'Current round not finished'}), 400
+    
+        players = db.get_players_in_room(room_id)
+        capacity = scoring.get_variant(room.variant).capacity
+        if len(players) != capacity:
+            return jsonify({'error': 'Need exactly {} players to start game'.format(capacity)}), 400
+    
+        game = start_round(room, players)
+    
+        return jsonify({
+            'message': 'Next round started',
+            'room_id': room_id,
+            'round_number': game.round_number,
+            'game_id': game.game_id,
+            'status': 'playing'
+        }), 200
+
+
+@app.route('/room/rounds/<room_id>/<int:round_number>', methods=['GET'])
+def get_round(room_id, round_number):
+    with db.room_read_lock(room_id):
+        room = db.get_room(room_id)
+        if not room:
+            return jsonify({'error': 'Room not found'}), 404
+    
+        game = db.get_game_by_round(room_id, round_number)
+        if not game:
+            return jsonify({'error': 'Round not found'}), 404
+    
+        players = db.get_players_in_room(room_id)
+    
+        return jsonify(logic.prepare_round_history(players, game)), 200
+
+
+def start_matched_room(tickets):
+    """Create, seat and start a room for one matchmaking group in one step."""
+    room, creator = new_room(tickets[0]['player_name'])
+    players = [creator] + [
+        Player(player_id='', name=t['player_name'], room_id=room.room_id) for t in tickets[1:]
+    ]
+    room.player_count = len(players)
+    db.create_rooms([room], players)
+    for seat, player in enumerate(players):
+        events.bus.publish(room.room_id, 'player_joined', {
+            'player_id': player.player_id,
+            'name': player.name,
+            'players_joined': seat + 1
+        })
+    with db.room_lock(room.room_id):
+        assign_roles_internal(room.room_id)
+    for ticket in tickets:
+        ticket['room_id'] = room.room_id
+    return [p.player_id for p in players]
+
+
+matchmaking_queue = MatchmakingQueue(start_matched_room)
+
+
+@app.route('/matchmaking/enqueue', methods=['POST'])
+def matchmaking_enqueue():
+    data = request.get_json()
+    
+    if not data or 'player_name' not in data:
+        return jsonify({'error': 'player_name is required'}), 400
+    
+    points = data.get('points', 0)
+    if not isinstance(points, int):
+        return jsonify({'error': 'points must be an integer'}), 400
+    
+    ticket = matchmaking_queue.enqueue(data['player_name'], points)
+    # The enqueue that completes a group returns already matched
+    ticket = matchmaking_queue.get_ticket(ticket['ticket_id']) or ticket
+    
+    return jsonify(ticket), 200 if ticket['status'] == 'matched' else 202
+
+
+@app.route('/matchmaking/ticket/<ticket_id>', methods=['GET'])
+def matchmaking_ticket(ticket_id):
+    ticket = matchmaking_queue.get_ticket(ticket_id)
+    if not ticket:
+        return jsonify({'error': 'Ticket not found'}), 404
+    
+    return jsonify(ticket), 200
+
+
+@app.route('/matchmaking/stats', methods=['GET'])
+def matchmaking_stats():
+    return jsonify(matchmaking_queue.stats()), 200
+
+
+def cached_response(room_id, kind):
+    entry = response_cache.get(room_id, kind)
+    if entry is None:
+        return None
+    body, status = entry
+    return app.response_class(body, status=status, mimetype='application/json')
+
+
+def cache_response(room_id, kind, payload, token, pin):
+    """Serialize payload once, cache it and return it as the response."""
+    body = app.json.dumps(payload) + '\n'
+    response_cache.put(room_id, kind, body, 200, token, pin=pin)
+    return app.response_class(body, status=200, mimetype='application/json')
+
 
 @app.route('/result/<room_id>', methods=['GET'])
 def get_result(room_id):
-    room = db.get_room(room_id)
-    if not room:
-        return jsonify({'error': 'Room not found'}), 404
+    cached = cached_response(room_id, 'result')
+    if cached is not None:
+        return cached
     
-    if room.status != 'finished':
-        return jsonify({'error': 'Game not yet finished'}), 400
+    with db.room_read_lock(room_id):
+        token = response_cache.token()
+        room = db.get_room(room_id)
+        if not room:
+            return get_archived_result(room_id, token)
     
-    players = db.get_players_in_room(room_id)
-    game = db.get_current_game(room_id)
+        if room.status != 'finished':
+            return jsonify({'error': 'Game not yet finished'}), 400
+    
+        players = db.get_players_in_room(room_id)
+        game = get_room_game(room)
+    
+        if not game or game.status != 'completed':
+            return jsonify({'error': 'No completed game found'}), 404
+    
+        result = logic.prepare_game_result(players, game)
+    
+        return cache_response(room_id, 'result', result, token, pin=True)
+
+def get_archived_result(room_id, token):
+    archived = reaper.get_archive().get(room_id)
+    if not archived:
+        return jsonify({'error': 'Room not found'}), 404
     
-    if not game or game.status != 'completed':
+    room, players, games = archived
+    completed = [g for g in games if g.status == 'completed']
+    if not completed:
         return jsonify({'error': 'No completed game found'}), 404
     
-    result = logic.prepare_game_result(players, game)
+    result = logic.prepare_game_result(players, completed[-1])
     
-    return jsonify(result), 200
+    return cache_response(room_id, 'result', result, token, pin=True)
 
 @app.route('/leaderboard/<room_id>', methods=['GET'])
 def get_leaderboard(room_id):
-    room = db.get_room(room_id)
-    if not room:
-        return jsonify({'error': 'Room not found'}), 404
+    cached = cached_response(room_id, 'leaderboard')
+    if cached is not None:
+        return cached
+    
+    with db.room_read_lock(room_id):
+        token = response_cache.token()
+        room = db.get_room(room_id)
+        if not room:
+            return jsonify({'error': 'Room not found'}), 404
+    
+        players = db.get_players_in_room(room_id)
+        players.sort(key=lambda p: p.points, reverse=True)
+    
+        leaderboard = []
+        for rank, player in enumerate(players, 1):
+            leaderboard.append({
+                'rank': rank,
+                'player_id': player.player_id,
+                'name': player.name,
+                'total_points': player.points
+            })
+    
+        return cache_response(room_id, 'leaderboard', {
+            'room_id': room_id,
+            'leaderboard': leaderboard
+        }, token, pin=room.status == 'finished')
+
+
+@app.route('/profile', methods=['POST'])
+def create_profile():
+    """Create a lasting identity; pass its user_id when creating or joining rooms."""
+    data = request.get_json(silent=True)
+    name = data.get('display_name') if isinstance(data, dict) else None
+    if not isinstance(name, str) or not name.strip():
+        return jsonify({'error': 'display_name is required'}), 400
+    
+    profile = db.create_profile(Profile(user_id='', display_name=name.strip()))
+    return jsonify(profile.to_dict()), 201
+
+
+@app.route('/profile/<user_id>', methods=['GET'])
+def get_profile(user_id):
+    profile = db.get_profile(user_id)
+    if not profile:
+        return jsonify({'error': 'Profile not found'}), 404
     
-    players = db.get_players_in_room(room_id)
-    players.sort(key=lambda p: p.points, reverse=True)
+    return jsonify(profile.to_dict()), 200
+
+
+@app.route('/profile/<user_id>/players', methods=['GET'])
+def get_profile_players(user_id):
+    """Every seat this profile has taken, oldest first."""
+    if not db.get_profile(user_id):
+        return jsonify({'error': 'Profile not found'}), 404
     
-    leaderboard = []
-    for rank, player in enumerate(players, 1):
-        leaderboard.append({
-            'rank': rank,
-            'player_id': player.player_id,
-            'name': player.name,
-            'total_points': player.points
-        })
+    return jsonify({
+        'user_id': user_id,
+        'players': [{
+            'player_id': p.player_id,
+            'room_id': p.room_id,
+            'name': p.name,
+            'points': p.points,
+            'joined_at': p.joined_at
+        } for p in db.get_players_by_user(user_id)]
+    }), 200
+
+
+@app.route('/profile/<user_id>/games', methods=['GET'])
+def get_profile_games(user_id):
+    """Completed rounds played by this profile's seats still in storage."""
+    if not db.get_profile(user_id):
+        return jsonify({'error': 'Profile not found'}), 404
+    
+    games = []
+    for player in db.get_players_by_user(user_id):
+        for game in db.get_games_in_room(player.room_id):
+            role = logic.decode_role_assignments(game.role_assignments).get(player.player_id)
+            if game.status != 'completed' or not role:
+                continue
+            games.append({
+                'game_id': game.game_id,
+                'room_id': game.room_id,
+                'player_id': player.player_id,
+                'round_number': game.round_number,
+                'role': role,
+                'round_points': scoring.round_points(game).get(role, 0),
+                'mantri_guess_correct': game.guess_correct,
+                'created_at': game.created_at
+            })
+    
+    return jsonify({'user_id': user_id, 'games': games}), 200
+
+
+@app.route('/leaderboard/global', methods=['GET'])
+def get_global_leaderboard():
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    leaderboard = db.get_global_leaderboard()
     
     return jsonify({
-        'room_id': room_id,
-        'leaderboard': leaderboard
+        'total_players': len(leaderboard),
+        'offset': offset,
+        'leaderboard': leaderboard.top(limit, offset)
     }), 200
+
+
+@app.route('/leaderboard/global/<player_id>', methods=['GET'])
+def get_global_rank(player_id):
+    entry = db.get_global_leaderboard().rank_of(player_id)
+    if not entry:
+        return jsonify({'error': 'Player not found'}), 404
+    
+    return jsonify(entry), 200
+
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(response_cache.stats()), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/metrics/profiling', methods=['GET', 'POST'])
+def profiling():
+    """GET lists the slowest profiled requests; POST {"sample_rate": 0.01} sets sampling (0 = off)."""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            sample_rate = float(data.get('sample_rate'))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'sample_rate must be a number between 0 and 1'}), 400
+        if not 0 <= sample_rate <= 1:
+            return jsonify({'error': 'sample_rate must be a number between 0 and 1'}), 400
+        metrics.profiler.sample_rate = sample_rate
+    
+    return jsonify({
+        'sample_rate': metrics.profiler.sample_rate,
+        'profile_dir': metrics.profiler.directory,
+        'slowest': metrics.profiler.slowest()
+    }), 200
+
+
+def export_filters():
+    """Read format/since/until query args; returns (filters, error response)."""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in FORMATS:
+        return None, (jsonify({'error': 'format must be one of: ' + ', '.join(FORMATS)}), 400)
+    filters = {'format': fmt}
+    for key in ('since', 'until'):
+        value = request.args.get(key)
+        if value:
+            try:
+                datetime.fromisoformat(value)
+            except ValueError:
+                return None, (jsonify({'error': key + ' must be an ISO-8601 date or datetime'}), 400)
+        filters[key] = value or None
+    return filters, None
+
+
+def export_response(records, fields, fmt, name):
+    # Rows are pulled from storage as the client reads, so memory stays flat
+    # and no storage lock is held across the download
+    response = Response(stream_with_context(export_chunks(records, fields, fmt)),
+                        mimetype=FORMATS[fmt])
+    response.headers['Content-Disposition'] = 'attachment; filename={}.{}'.format(name, fmt)
+    return response
+
+
+@app.route('/export/games', methods=['GET'])
+def export_games():
+    filters, error = export_filters()
+    if error:
+        return error
+    status = request.args.get('status')
+    if status and status not in ('in_progress', 'completed'):
+        return jsonify({'error': 'status must be in_progress or completed'}), 400
+
+    games = db.iter_games(status, filters['since'], filters['until'])
+    return export_response(games, GAME_FIELDS, filters['format'], 'games')
+
+
+@app.route('/export/players', methods=['GET'])
+def export_players():
+    filters, error = export_filters()
+    if error:
+        return error
+
+    players = db.iter_players(filters['since'], filters['until'])
+    return export_response(players, PLAYER_FIELDS, filters['format'], 'players')
+
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({
@@ -322,4 +875,6 @@ if __name__ == '__main__':
     print("📝 Database initialized at ./data/")
     print("🚀 Server running on http://localhost:5000")
 
+    reaper.start_reaper()
+
     app.run(debug=True, host='0.0.0.0', port=5000) 
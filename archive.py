@@ -0,0 +1,109 @@
+import csv
+import gzip
+import io
+import json
+import os
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+from models import Room, Player, Game
+from filelock import FileLock
+
+
+class ArchiveStore:
+    """Cold storage for finished rooms: gzip'd daily segments plus an index.
+
+    Each archived room is written as its own gzip member appended to
+    <dir>/<YYYY-MM-DD>.jsonl.gz (concatenated members are still one valid
+    gzip file). index.csv maps room_id to segment, offset and length, so a
+    lookup reads and inflates just that member.
+
+    The segment is written and synced before the index line, and rooms are
+    only deleted from the hot store after archive_room() returns, so a crash
+    can at worst archive a room twice; the last index line wins.
+
+    Every worker's reaper may append to the same directory, so appends hold
+    archive.lock, and a lookup that misses first reads any index lines
+    other workers added since.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.index_file = os.path.join(directory, 'index.csv')
+        self._lock = FileLock(os.path.join(directory, 'archive.lock'))
+        self._index: Dict[str, Tuple[str, int, int]] = {}
+        self._index_read = 0  # bytes of index.csv already loaded
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self._read_index()
+
+    def _read_index(self):
+        """Load index lines appended since the last call. Caller holds _lock."""
+        if not os.path.exists(self.index_file):
+            return
+        with open(self.index_file, 'rb') as f:
+            f.seek(self._index_read)
+            data = f.read()
+        # Lines are only ever appended whole under the lock
+        self._index_read += len(data)
+        for row in csv.reader(data.decode().splitlines()):
+            if len(row) == 4:
+                self._index[row[0]] = (row[1], int(row[2]), int(row[3]))
+
+    def _refresh(self):
+        try:
+            size = os.path.getsize(self.index_file)
+        except OSError:
+            return
+        if size > self._index_read:
+            with self._lock:
+                self._read_index()
+
+    def _locate(self, room_id: str) -> Optional[Tuple[str, int, int]]:
+        location = self._index.get(room_id)
+        if location is None:
+            self._refresh()
+            location = self._index.get(room_id)
+        return location
+
+    def __contains__(self, room_id: str) -> bool:
+        return self._locate(room_id) is not None
+
+    def __len__(self):
+        return len(self._index)
+
+    def archive_room(self, room: Room, players: List[Player], games: List[Game], day: date = None):
+        record = {
+            'room': room.to_dict(),
+            'players': [p.to_dict() for p in players],
+            'games': [g.to_dict() for g in games]
+        }
+        member = gzip.compress(json.dumps(record).encode())
+        segment = (day or date.today()).isoformat() + '.jsonl.gz'
+        with self._lock:
+            self._read_index()
+            with open(os.path.join(self.directory, segment), 'ab') as f:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(member)
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.index_file, 'ab') as f:
+                line = io.StringIO()
+                csv.writer(line).writerow([room.room_id, segment, offset, len(member)])
+                data = line.getvalue().encode()
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self._index_read += len(data)
+            self._index[room.room_id] = (segment, offset, len(member))
+
+    def get(self, room_id: str) -> Optional[Tuple[Room, List[Player], List[Game]]]:
+        location = self._locate(room_id)
+        if location is None:
+            return None
+        segment, offset, length = location
+        with open(os.path.join(self.directory, segment), 'rb') as f:
+            f.seek(offset)
+            record = json.loads(gzip.decompress(f.read(length)))
+        return (Room.from_row(record['room']),
+                [Player.from_row(p) for p in record['players']],
+                [Game.from_row(g) for g in record['games']])
@@ -0,0 +1,160 @@
+"""ASGI entry point.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+All existing routes are served by the Flask app through asgiref's WSGI
+adapter. Two room event streams are handled natively so that waiting
+clients cost a coroutine instead of a worker thread:
+
+    GET /room/events/<room_id>?since=<seq>&timeout=<s>   long-poll (JSON)
+    WS  /ws/room/<room_id>?since=<seq>                   one JSON message per event
+"""
+import asyncio
+import json
+import re
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgiInstance
+
+import database as db
+import events
+import reaper
+import workers
+from app import app as flask_app, LONG_POLL_TIMEOUT
+
+EVENTS_PATH = re.compile(r'^/room/events/([^/]+)$')
+SOCKET_PATH = re.compile(r'^/ws/room/([^/]+)$')
+
+
+class _WsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs every WSGI call on one shared sync thread, so Flask
+    # requests queue behind each other, and a keep-alive request that
+    # arrives while the previous one is still unwinding fails with "would
+    # deadlock". The app is thread-safe, so use the loop's thread pool.
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func,
+                                 thread_sensitive=False)
+
+
+async def wsgi_application(scope, receive, send):
+    await _WsgiInstance(flask_app)(scope, receive, send)
+
+
+def _query(scope) -> dict:
+    params = parse_qs(scope.get('query_string', b'').decode())
+    return {k: v[-1] for k, v in params.items()}
+
+
+def _number(value, default, cast):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return default
+
+
+async def _send_json(send, status: int, payload: dict):
+    body = json.dumps(payload).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _room_exists(room_id: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(None, db.get_room, room_id) is not None
+
+
+def _host(scope) -> str:
+    for name, value in scope.get('headers', []):
+        if name == b'host':
+            return value.decode()
+    server = scope.get('server') or ('localhost', workers.WORKER_BASE_PORT)
+    return '{}:{}'.format(*server)
+
+
+async def long_poll(scope, receive, send, room_id: str):
+    if not workers.is_local(room_id):
+        location = workers.redirect_location(workers.worker_for(room_id), _host(scope),
+                                             scope['path'], scope.get('query_string', b'').decode())
+        await send({'type': 'http.response.start', 'status': 307,
+                    'headers': [(b'location', location.encode()), (b'content-length', b'0')]})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    if not await _room_exists(room_id):
+        await _send_json(send, 404, {'error': 'Room not found'})
+        return
+    query = _query(scope)
+    since = _number(query.get('since'), 0, int)
+    timeout = min(_number(query.get('timeout'), 25.0, float), LONG_POLL_TIMEOUT)
+    room_events = await events.bus.wait_async(room_id, since, timeout)
+    await _send_json(send, 200, {
+        'room_id': room_id,
+        'events': room_events,
+        'last_seq': room_events[-1]['seq'] if room_events else since
+    })
+
+
+async def room_socket(scope, receive, send, room_id: str):
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    if not workers.is_local(room_id):
+        # Events are only published in the room's own worker; the client
+        # should reconnect to worker_for(room_id)
+        await send({'type': 'websocket.close', 'code': 4421})
+        return
+    if not await _room_exists(room_id):
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+    await send({'type': 'websocket.accept'})
+
+    async def wait_disconnect():
+        while (await receive())['type'] != 'websocket.disconnect':
+            pass
+
+    disconnect = asyncio.ensure_future(wait_disconnect())
+    seq = _number(_query(scope).get('since'), 0, int)
+    try:
+        while True:
+            waiter = asyncio.ensure_future(
+                events.bus.wait_async(room_id, seq, LONG_POLL_TIMEOUT))
+            await asyncio.wait({waiter, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnect.done():
+                waiter.cancel()
+                return
+            for event in waiter.result():
+                await send({'type': 'websocket.send', 'text': json.dumps(event)})
+                seq = event['seq']
+    finally:
+        disconnect.cancel()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                db.init_database()
+                reaper.start_reaper()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    path = scope.get('path', '')
+    if scope['type'] == 'websocket':
+        match = SOCKET_PATH.match(path)
+        if match:
+            await room_socket(scope, receive, send, match.group(1))
+        else:
+            await send({'type': 'websocket.close', 'code': 4404})
+        return
+
+    match = EVENTS_PATH.match(path)
+    if match and scope['method'] == 'GET':
+        await long_poll(scope, receive, send, match.group(1))
+        return
+    await wsgi_application(scope, receive, send)
@@ -0,0 +1,144 @@
+"""Construction time and per-object memory of the models.
+
+Compares the slotted models and their from_row() path against the old
+plain dataclasses built with Model(**row), the way rows used to be loaded.
+
+    python benchmarks/bench_models.py --rows 1000000
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Player, Game  # noqa: E402
+
+
+@dataclass
+class LegacyPlayer:
+    player_id: str
+    name: str
+    room_id: str
+    role: Optional[str] = None
+    points: int = 0
+    joined_at: str = None
+
+    def __post_init__(self):
+        if not self.player_id:
+            self.player_id = str(uuid.uuid4())
+        if not self.joined_at:
+            self.joined_at = datetime.now().isoformat()
+
+    def to_dict(self):
+        return asdict(self)
+
+
+@dataclass
+class LegacyGame:
+    game_id: str
+    room_id: str
+    mantri_player_id: str
+    guessed_player_id: Optional[str] = None
+    chor_player_id: Optional[str] = None
+    guess_correct: Optional[bool] = None
+    raja_points: int = 0
+    mantri_points: int = 0
+    chor_points: int = 0
+    sipahi_points: int = 0
+    status: str = 'in_progress'
+    created_at: str = None
+    round_number: int = 1
+    role_assignments: Optional[str] = None
+
+    def __post_init__(self):
+        if not self.game_id:
+            self.game_id = str(uuid.uuid4())
+        if not self.created_at:
+            self.created_at = datetime.now().isoformat()
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def player_rows(n):
+    # Shaped like csv.DictReader output: every value is a string
+    return [{'player_id': 'p%07d' % i, 'name': 'player%d' % i, 'room_id': 'r%06d' % (i // 4),
+             'role': 'Raja', 'points': str(i % 2000), 'joined_at': '2024-01-01T00:00:00'}
+            for i in range(n)]
+
+
+def game_rows(n):
+    return [{'game_id': 'g%07d' % i, 'room_id': 'r%06d' % i, 'mantri_player_id': 'p1',
+             'guessed_player_id': 'p2', 'chor_player_id': 'p2', 'guess_correct': 'True',
+             'raja_points': '1000', 'mantri_points': '800', 'chor_points': '0',
+             'sipahi_points': '500', 'status': 'completed', 'created_at': '2024-01-01T00:00:00',
+             'round_number': '1', 'role_assignments': ''}
+            for i in range(n)]
+
+
+def legacy_player(row):
+    row = dict(row)
+    row['role'] = row['role'] or None
+    row['points'] = int(row['points']) if row['points'] else 0
+    return LegacyPlayer(**row)
+
+
+def legacy_game(row):
+    row = dict(row)
+    for key in ['raja_points', 'mantri_points', 'chor_points', 'sipahi_points', 'round_number']:
+        row[key] = int(row[key]) if row[key] else 0
+    row['guess_correct'] = row['guess_correct'] == 'True' if row['guess_correct'] else None
+    row['role_assignments'] = row['role_assignments'] or None
+    return LegacyGame(**row)
+
+
+def measure(label, build, rows):
+    gc.collect()
+    start = time.perf_counter()
+    objects = [build(row) for row in rows]
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for obj in objects:
+        obj.to_dict()
+    to_dict_elapsed = time.perf_counter() - start
+    del objects
+
+    # Memory is measured separately so tracemalloc does not skew the timings
+    gc.collect()
+    tracemalloc.start()
+    objects = [build(row) for row in rows]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    list_bytes = sys.getsizeof(objects)
+    del objects
+
+    n = len(rows)
+    print('%-22s build %7.3fs (%6.0f ns/obj)  to_dict %7.3fs  %6.1f bytes/obj' % (
+        label, elapsed, elapsed / n * 1e9, to_dict_elapsed, (current - list_bytes) / n))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    print('%d rows, Python %s' % (args.rows, sys.version.split()[0]))
+    rows = player_rows(args.rows)
+    measure('Player (legacy)', legacy_player, rows)
+    measure('Player.from_row', Player.from_row, rows)
+    del rows
+    rows = game_rows(args.rows)
+    measure('Game (legacy)', legacy_game, rows)
+    measure('Game.from_row', Game.from_row, rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Games scored and results built per second.
+
+Compares the compiled scoring tables against the old hardcoded rules,
+which built a fresh points dict per game and per player.
+
+    python benchmarks/bench_scoring.py --games 200000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import game_logic as logic  # noqa: E402
+import scoring  # noqa: E402
+from models import Player, Game  # noqa: E402
+
+DEFAULT_POINTS = {'Raja': 1000, 'Mantri': 800, 'Chor': 0, 'Sipahi': 500}
+
+
+def legacy_calculate_scores(guessed_player_id, chor_player):
+    guess_correct = (guessed_player_id == chor_player.player_id)
+    if guess_correct:
+        scores = {
+            'Raja': DEFAULT_POINTS['Raja'],
+            'Mantri': DEFAULT_POINTS['Mantri'],
+            'Chor': DEFAULT_POINTS['Chor'],
+            'Sipahi': DEFAULT_POINTS['Sipahi']
+        }
+    else:
+        stolen_points = DEFAULT_POINTS['Mantri'] + DEFAULT_POINTS['Sipahi']
+        scores = {'Raja': DEFAULT_POINTS['Raja'], 'Mantri': 0, 'Chor': stolen_points, 'Sipahi': 0}
+    return scores, guess_correct
+
+
+def legacy_prepare_game_result(players, game):
+    roles = logic.decode_role_assignments(game.role_assignments)
+    result = {'game_id': game.game_id, 'round_number': game.round_number,
+              'mantri_guess_correct': game.guess_correct, 'players': []}
+    for player in players:
+        role = roles.get(player.player_id, player.role)
+        result['players'].append({
+            'player_id': player.player_id,
+            'name': player.name,
+            'role': role,
+            'round_points': {
+                'Raja': game.raja_points,
+                'Mantri': game.mantri_points,
+                'Chor': game.chor_points,
+                'Sipahi': game.sipahi_points
+            }[role],
+            'total_points': player.points
+        })
+    return result
+
+
+def make_games(count, variant):
+    rounds = []
+    for i in range(count):
+        players = [Player(player_id='', name=str(n), room_id='r{}'.format(i))
+                   for n in range(variant.capacity)]
+        logic.assign_roles(players, variant)
+        game = Game(game_id='', room_id=players[0].room_id,
+                    mantri_player_id=logic.get_player_by_role(players, variant.guesser).player_id,
+                    role_assignments=logic.encode_role_assignments(players), variant=variant.name)
+        guessed = random.choice(players).player_id
+        rounds.append((players, game, guessed))
+    return rounds
+
+
+def run(label, rounds, score, prepare):
+    start = time.perf_counter()
+    for players, game, guessed in rounds:
+        score(players, game, guessed)
+        prepare(players, game)
+    elapsed = time.perf_counter() - start
+    print('{:<22} {:>10.0f} games/s'.format(label, len(rounds) / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=200000)
+    args = parser.parse_args()
+
+    def legacy_score(players, game, guessed):
+        chor = logic.get_chor_player(players)
+        scores, game.guess_correct = legacy_calculate_scores(guessed, chor)
+        game.raja_points = scores['Raja']
+        game.mantri_points = scores['Mantri']
+        game.chor_points = scores['Chor']
+        game.sipahi_points = scores['Sipahi']
+
+    def compiled_score(players, game, guessed):
+        variant = scoring.get_variant(game.variant)
+        target = logic.get_player_by_role(players, variant.target)
+        scores, game.guess_correct = logic.calculate_scores(None, guessed, target, variant)
+        logic.record_scores(game, scores)
+
+    classic = make_games(args.games, scoring.get_variant('classic'))
+    run('legacy (classic)', classic, legacy_score, legacy_prepare_game_result)
+    run('compiled (classic)', classic, compiled_score, logic.prepare_game_result)
+    five = make_games(args.games, scoring.get_variant('five_roles'))
+    run('compiled (five_roles)', five, compiled_score, logic.prepare_game_result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""Load test for the game API.
+
+Plays full games (create, 3 joins, 4 role fetches, guess, result,
+leaderboard) with a pool of worker threads and reports p50/p95/p99 latency
+and throughput per endpoint. The store is grown to each --sizes value
+(prior rooms, seeded through the batch endpoints) before each run.
+
+In-process through Flask's test client, on a throwaway data directory:
+
+    python benchmarks/load_test.py --sizes 1000,10000,100000 --games 500
+
+Over real HTTP against a server started on an empty DATA_DIR, with the
+per-client rate limit off (all traffic comes from one address):
+
+    RATE_LIMIT_CLIENT_RATE=0 python app.py
+    python benchmarks/load_test.py --url http://localhost:5000 --concurrency 32
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ENDPOINTS = ['create', 'join', 'role', 'guess', 'result', 'leaderboard']
+# Largest batch the batch endpoints accept (app.MAX_BATCH_SIZE)
+SEED_BATCH = 500
+
+
+class TestClientDriver:
+    """Requests through Flask's test client; one client per thread."""
+
+    def __init__(self):
+        import app
+        self.app = app.app
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpDriver:
+    """Requests over keep-alive HTTP/1.1 connections; one per thread."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        payload = json.dumps(body) if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+        try:
+            conn.request(method, path, payload, headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            self._local.conn = None
+            raise
+        try:
+            return response.status, json.loads(data) if data else None
+        except ValueError:
+            return response.status, None
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {name: [] for name in ENDPOINTS}
+        self.errors = {name: 0 for name in ENDPOINTS}
+
+    def call(self, driver, name, method, path, body=None, expect=200):
+        start = time.perf_counter()
+        try:
+            status, data = driver.request(method, path, body)
+        except Exception:
+            status, data = None, None
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.samples[name].append(elapsed)
+            if status != expect:
+                self.errors[name] += 1
+        if status != expect:
+            raise RuntimeError('{} {} -> {}'.format(method, path, status))
+        return data
+
+
+def play_game(driver, recorder, index):
+    """One full lifecycle. Returns True if every step succeeded."""
+    try:
+        created = recorder.call(driver, 'create', 'POST', '/room/create',
+                                {'player_name': 'host%d' % index}, expect=201)
+        room_id = created['room_id']
+        player_ids = [created['player_id']]
+        for seat in range(3):
+            joined = recorder.call(driver, 'join', 'POST', '/room/join',
+                                   {'room_id': room_id, 'player_name': 'p%d_%d' % (index, seat)})
+            player_ids.append(joined['player_id'])
+
+        roles = {}
+        for player_id in player_ids:
+            me = recorder.call(driver, 'role', 'GET', '/role/me/{}/{}'.format(room_id, player_id))
+            roles[me['role']] = player_id
+
+        suspects = [pid for pid in player_ids if pid != roles['Mantri'] and pid != roles['Raja']]
+        recorder.call(driver, 'guess', 'POST', '/guess/' + room_id, {
+            'mantri_player_id': roles['Mantri'],
+            'guessed_player_id': random.choice(suspects)
+        })
+        recorder.call(driver, 'result', 'GET', '/result/' + room_id)
+        recorder.call(driver, 'leaderboard', 'GET', '/leaderboard/' + room_id)
+        return True
+    except (RuntimeError, KeyError, TypeError):
+        return False
+
+
+def seed(driver, rooms):
+    """Add `rooms` started rooms (4 players each) through the batch endpoints."""
+    while rooms > 0:
+        count = min(rooms, SEED_BATCH)
+        status, data = driver.request('POST', '/rooms/batch',
+                                      {'rooms': [{'player_name': 'seed'} for _ in range(count)]})
+        if status != 200:
+            raise RuntimeError('seeding failed: /rooms/batch -> {}'.format(status))
+        room_ids = [r['room_id'] for r in data['results']]
+        for seat in range(3):
+            joins = [{'room_id': room_id, 'player_name': 'seed%d' % seat} for room_id in room_ids]
+            status, _ = driver.request('POST', '/room/join/batch', {'joins': joins})
+            if status != 200:
+                raise RuntimeError('seeding failed: /room/join/batch -> {}'.format(status))
+        rooms -= count
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def summarize(recorder, wall):
+    endpoints = {}
+    for name in ENDPOINTS:
+        ordered = sorted(recorder.samples[name])
+        if not ordered:
+            continue
+        endpoints[name] = {
+            'count': len(ordered),
+            'errors': recorder.errors[name],
+            'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(ordered, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+            'max_ms': round(ordered[-1] * 1000, 3),
+            'throughput_rps': round(len(ordered) / wall, 1)
+        }
+    return endpoints
+
+
+def run(driver, games, concurrency):
+    recorder = Recorder()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(lambda i: play_game(driver, recorder, i), range(games)))
+    wall = time.perf_counter() - start
+    return {
+        'games': games,
+        'games_failed': outcomes.count(False),
+        'wall_seconds': round(wall, 3),
+        'games_per_second': round(games / wall, 1),
+        'endpoints': summarize(recorder, wall)
+    }
+
+
+def print_run(result):
+    print('\n{} prior rooms: {} games in {}s ({} games/s), {} failed'.format(
+        result['prior_rooms'], result['games'], result['wall_seconds'],
+        result['games_per_second'], result['games_failed']))
+    print('  {:<12} {:>7} {:>9} {:>9} {:>9} {:>9}'.format('endpoint', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s'))
+    for name, stats in result['endpoints'].items():
+        print('  {:<12} {:>7} {:>9} {:>9} {:>9} {:>9}'.format(
+            name, stats['count'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['throughput_rps']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='server to test over HTTP; omit for the in-process test client')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma-separated prior room counts to measure at')
+    parser.add_argument('--games', type=int, default=500, help='games played per size')
+    parser.add_argument('--concurrency', type=int, default=8, help='worker threads')
+    parser.add_argument('--backend', choices=['csv', 'sqlite'],
+                        help='storage backend for the test client (default: STORAGE_BACKEND)')
+    parser.add_argument('--output', default='load_test_results.json')
+    args = parser.parse_args()
+
+    sizes = sorted(int(s) for s in args.sizes.split(','))
+    if args.url:
+        driver = HttpDriver(args.url)
+        target = args.url
+    else:
+        # database reads its settings at import, so set them before the app loads
+        os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='load_test_')
+        if args.backend:
+            os.environ['STORAGE_BACKEND'] = args.backend
+        os.environ.setdefault('RATE_LIMIT_CLIENT_RATE', '0')
+        driver = TestClientDriver()
+        target = 'test_client:{}'.format(os.environ.get('STORAGE_BACKEND', 'csv'))
+
+    results = []
+    seeded = 0
+    for size in sizes:
+        start = time.perf_counter()
+        seed(driver, size - seeded)
+        seed_seconds = time.perf_counter() - start
+        seeded = size
+        result = dict(prior_rooms=size, seed_seconds=round(seed_seconds, 3),
+                      **run(driver, args.games, args.concurrency))
+        # The games just played count towards the next size
+        seeded += args.games
+        results.append(result)
+        print_run(result)
+
+    report = {
+        'target': target,
+        'concurrency': args.concurrency,
+        'python': sys.version.split()[0],
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'runs': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('\nwrote ' + args.output)
+
+
+if __name__ == '__main__':
+    main()
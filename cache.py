@@ -0,0 +1,101 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+# Rooms whose responses are kept in the LRU part of the cache
+CACHE_MAX_ROOMS = int(os.environ.get('CACHE_MAX_ROOMS', '1024'))
+
+
+class ResponseCache:
+    """Serialized JSON responses keyed by room_id and response kind.
+
+    Entries for rooms that can still change live in a bounded LRU. Entries
+    stored with pin=True (finished rooms) are never evicted, only dropped
+    by invalidate().
+
+    A reader takes token() before it loads data and passes it to put(). If
+    the room was invalidated in between, the put is ignored, so a slow
+    reader can never cache a response older than the latest write.
+    """
+
+    def __init__(self, maxsize: int = CACHE_MAX_ROOMS):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._lru: Dict[str, Dict[str, Tuple[str, int]]] = OrderedDict()
+        self._pinned: Dict[str, Dict[str, Tuple[str, int]]] = {}
+        self._clock = 0
+        self._invalidated: Dict[str, int] = OrderedDict()
+        self._invalidated_floor = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, room_id: str, kind: str) -> Optional[Tuple[str, int]]:
+        with self._lock:
+            entries = self._pinned.get(room_id)
+            if entries is None:
+                entries = self._lru.get(room_id)
+                if entries is not None:
+                    self._lru.move_to_end(room_id)
+            entry = entries.get(kind) if entries else None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def token(self) -> int:
+        with self._lock:
+            return self._clock
+
+    def put(self, room_id: str, kind: str, body: str, status: int, token: int, pin: bool = False):
+        with self._lock:
+            if self._invalidated.get(room_id, self._invalidated_floor) > token:
+                return
+            if pin:
+                entries = self._lru.pop(room_id, None) or {}
+                entries.update(self._pinned.get(room_id, {}))
+                entries[kind] = (body, status)
+                self._pinned[room_id] = entries
+                return
+            if room_id in self._pinned:
+                self._pinned[room_id][kind] = (body, status)
+                return
+            self._lru.setdefault(room_id, {})[kind] = (body, status)
+            self._lru.move_to_end(room_id)
+            while len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, room_id: str):
+        with self._lock:
+            self._clock += 1
+            self._lru.pop(room_id, None)
+            self._pinned.pop(room_id, None)
+            self._invalidated[room_id] = self._clock
+            self._invalidated.move_to_end(room_id)
+            # Forgetting an old invalidation is safe as long as every token
+            # issued before it is still treated as stale
+            while len(self._invalidated) > self.maxsize * 4:
+                _, clock = self._invalidated.popitem(last=False)
+                self._invalidated_floor = max(self._invalidated_floor, clock)
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'rooms_cached': len(self._lru),
+                'rooms_pinned': len(self._pinned),
+                'max_rooms': self.maxsize
+            }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,743 @@
+import csv
+import os
+import copy
+import gc
+import json
+import logging
+import shutil
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from models import Room, Player, Game, Profile
+from repository import (Repository, ROOM_FIELDS, PLAYER_FIELDS, GAME_FIELDS, PROFILE_FIELDS,
+                        apply_profile_delta, plan_seats, in_time_range)
+from locks import RWLock, StripedLocks
+from filelock import FileLock
+import metrics
+import snapshot
+
+logger = logging.getLogger(__name__)
+
+# Replaced change logs kept in shared mode for followers that fall behind
+LOG_GENERATIONS_KEPT = 8
+
+commit_transactions = metrics.registry.histogram(
+    'csv_log_commit_transactions', 'Transactions written by one change log flush.', metrics.COUNT_BUCKETS)
+
+
+def _read_rows(path: str):
+    with open(path, 'r', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def _write_rows(path: str, fields: List[str], records):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record.to_dict())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _log_generation(f) -> int:
+    """Generation from a change log's header line (0 for logs without one)."""
+    line = f.readline()
+    f.seek(0)
+    try:
+        return json.loads(line).get('generation', 0)
+    except ValueError:
+        return 0
+
+
+def _archive_log(path: str, archive_path: str):
+    if os.path.exists(archive_path):
+        os.remove(archive_path)
+    try:
+        os.link(path, archive_path)
+    except OSError:
+        shutil.copyfile(path, archive_path)
+
+
+class CsvRepository(Repository):
+    """CSV snapshots plus an append-only change log, served from memory.
+
+    rooms.csv, players.csv, games.csv and profiles.csv are loaded once and
+    every change is a single JSON line appended to changes.log. Once compact_every entries
+    have accumulated the tables are written back to the CSV snapshots and
+    the log is truncated. Lookups never touch the files. Compaction also
+    writes snapshot.bin, which loads several times faster than the CSVs
+    (see snapshot.py).
+
+    Callers serialize writes to the same room (see database.room_lock);
+    csv_lock only guards the log file. Every change to memory is made
+    inside transaction(), under the shared side of _memory_lock, and
+    compaction takes the exclusive side, so a snapshot never holds half of
+    a transaction.
+
+    With shared=True several processes can use the same data_dir. Appends
+    and compaction also take a file lock (changes.lock), and each process
+    follows the log in a background thread to pick up the others' changes.
+    Every log starts with a generation header; compaction starts the next
+    generation in a new file and keeps the last LOG_GENERATIONS_KEPT as
+    changes.<n>.log, so a follower can finish the log it was reading and
+    then open the next one. One that falls further behind reloads from the
+    snapshots. Each room must still be written by one process only (see
+    workers.py).
+
+    Appends are group committed: a writer thread takes every transaction
+    queued since its last flush, appends them in one write and fsyncs once,
+    at most once per commit_interval seconds. Each caller waits until its
+    own lines are on disk. commit_interval=0 appends in the caller's thread.
+    """
+
+    reports_external_changes = True
+
+    def __init__(self, data_dir: str, compact_every: int = 1000,
+                 shared: bool = False, sync_interval: float = 0.05,
+                 commit_interval: float = 0.001):
+        self.data_dir = data_dir
+        self.rooms_file = os.path.join(data_dir, 'rooms.csv')
+        self.players_file = os.path.join(data_dir, 'players.csv')
+        self.games_file = os.path.join(data_dir, 'games.csv')
+        self.profiles_file = os.path.join(data_dir, 'profiles.csv')
+        self.log_file = os.path.join(data_dir, 'changes.log')
+        self.snapshot_file = os.path.join(data_dir, snapshot.SNAPSHOT_FILE)
+        self.compact_every = compact_every
+        self.shared = shared
+        self.sync_interval = sync_interval
+        self.commit_interval = commit_interval
+
+        self.csv_lock = threading.RLock()
+        # Shared while a transaction changes memory, exclusive while
+        # compaction copies it. Always taken before csv_lock.
+        self._memory_lock = RWLock(prefer_writers=False)
+        self._rooms: Dict[str, Room] = {}
+        self._players: Dict[str, Player] = {}
+        self._games: Dict[str, Game] = {}
+        self._players_by_room: Dict[str, List[str]] = {}
+        self._games_by_room_status: Dict[Tuple[str, str], List[str]] = {}
+        self._games_by_round: Dict[Tuple[str, int], str] = {}
+        self._games_by_room: Dict[str, List[str]] = {}
+        self._profiles: Dict[str, Profile] = {}
+        self._players_by_user: Dict[str, List[str]] = {}
+
+        self._log_handle = None
+        self._log_entries = 0
+        self._local = threading.local()
+        self._seat_locks = StripedLocks()
+        self._process_lock = FileLock(os.path.join(data_dir, 'changes.lock')) if shared else None
+        self._reader = None
+        self._generation = 0
+        self._closed = threading.Event()
+        # Transactions waiting for the writer thread: (lines, future)
+        self._commit_queue: List[Tuple[List[Union[str, Dict]], Future]] = []
+        self._commit_ready = threading.Condition(threading.Lock())
+        self._writer = None
+        self._load()
+        if shared:
+            threading.Thread(target=self._follow, name='csv-log-follower', daemon=True).start()
+        if commit_interval > 0:
+            self._writer = threading.Thread(target=self._run_writer, name='csv-log-writer', daemon=True)
+            self._writer.start()
+
+    @contextmanager
+    def _exclusive(self):
+        """csv_lock, plus the cross-process file lock in shared mode."""
+        with metrics.timed_lock(self.csv_lock, 'csv_lock'):
+            if self._process_lock is None:
+                yield
+            else:
+                with metrics.timed_lock(self._process_lock, 'changes.lock'):
+                    yield
+
+    def _init_files(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        for path, fields in ((self.rooms_file, ROOM_FIELDS),
+                             (self.players_file, PLAYER_FIELDS),
+                             (self.games_file, GAME_FIELDS),
+                             (self.profiles_file, PROFILE_FIELDS)):
+            if not os.path.exists(path):
+                with open(path, 'w', newline='') as f:
+                    writer = csv.DictWriter(f, fieldnames=fields)
+                    writer.writeheader()
+
+    def _load(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        with self._exclusive():
+            self._init_files()
+            self._load_tables()
+
+    def _table_files(self) -> Dict[str, str]:
+        return {'rooms': self.rooms_file, 'players': self.players_file,
+                'games': self.games_file, 'profiles': self.profiles_file}
+
+    def _load_tables(self):
+        # Millions of new objects would otherwise set off full collections
+        # over and over while nothing can be freed
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            records = snapshot.read_snapshot(self.snapshot_file, self._table_files())
+            if records is None:
+                records = {'rooms': map(Room.from_row, _read_rows(self.rooms_file)),
+                           'players': map(Player.from_row, _read_rows(self.players_file)),
+                           'games': map(Game.from_row, _read_rows(self.games_file)),
+                           'profiles': map(Profile.from_row, _read_rows(self.profiles_file))}
+            for room in records['rooms']:
+                self._rooms[room.room_id] = room
+            for player in records['players']:
+                self._index_player(player)
+            for game in records['games']:
+                self._index_game(game)
+            for profile in records['profiles']:
+                self._profiles[profile.user_id] = profile
+            self._log_entries = self._replay_log()
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def _reload(self, changes: tuple):
+        """Start over from the snapshots. Caller holds _exclusive().
+
+        Readers briefly see an empty store, which only happens when this
+        process missed LOG_GENERATIONS_KEPT compactions in a row.
+        """
+        logger.warning('%s: fell behind the shared log, reloading', self.data_dir)
+        old_rooms, old_players = set(self._rooms), set(self._players)
+        for index in (self._rooms, self._players, self._games, self._players_by_room,
+                      self._games_by_room_status, self._games_by_round, self._games_by_room,
+                      self._profiles, self._players_by_user):
+            index.clear()
+        self._reader.close()
+        self._load_tables()
+        changes[0].update(old_rooms, self._rooms)
+        changes[1].clear()
+        changes[1].update(self._players)
+        changes[2][:] = old_players.difference(self._players)
+
+    def _index_player(self, player: Player):
+        self._players[player.player_id] = player
+        room_players = self._players_by_room.setdefault(player.room_id, [])
+        if player.player_id not in room_players:
+            room_players.append(player.player_id)
+        if player.user_id:
+            user_players = self._players_by_user.setdefault(player.user_id, [])
+            if player.player_id not in user_players:
+                user_players.append(player.player_id)
+
+    def _index_game(self, game: Game):
+        old = self._games.get(game.game_id)
+        if old is not None:
+            key = (old.room_id, old.status)
+            ids = self._games_by_room_status.get(key, [])
+            if game.game_id in ids:
+                ids.remove(game.game_id)
+                if not ids:
+                    del self._games_by_room_status[key]
+        else:
+            self._games_by_room.setdefault(game.room_id, []).append(game.game_id)
+        self._games[game.game_id] = game
+        self._games_by_room_status.setdefault((game.room_id, game.status), []).append(game.game_id)
+        self._games_by_round[(game.room_id, game.round_number)] = game.game_id
+
+    def _unindex_room(self, room_id: str) -> List[str]:
+        self._rooms.pop(room_id, None)
+        player_ids = self._players_by_room.pop(room_id, [])
+        for player_id in player_ids:
+            player = self._players.pop(player_id, None)
+            if player is not None and player.user_id:
+                user_players = self._players_by_user.get(player.user_id, [])
+                if player_id in user_players:
+                    user_players.remove(player_id)
+                if not user_players:
+                    self._players_by_user.pop(player.user_id, None)
+        for game_id in self._games_by_room.pop(room_id, []):
+            game = self._games.pop(game_id, None)
+            if game is not None:
+                self._games_by_room_status.pop((room_id, game.status), None)
+                self._games_by_round.pop((room_id, game.round_number), None)
+        return player_ids
+
+    def _apply(self, entry: dict, changes: Optional[tuple] = None):
+        """Apply one log entry; changes collects (room_ids, players, removed ids)."""
+        row = entry.get('row')
+        if 'delete' in entry:
+            removed = self._unindex_room(entry['delete'])
+            if changes is not None:
+                changes[0].add(entry['delete'])
+                changes[2].extend(removed)
+                for player_id in removed:
+                    changes[1].pop(player_id, None)
+            return
+        if entry['table'] == 'profiles':
+            # Not room data, so nothing to report to on_replay
+            profile = Profile.from_row(row)
+            self._profiles[profile.user_id] = profile
+            return
+        if entry['table'] == 'rooms':
+            record = Room.from_row(row)
+            self._rooms[record.room_id] = record
+        elif entry['table'] == 'players':
+            record = Player.from_row(row)
+            self._index_player(record)
+            if changes is not None:
+                changes[1][record.player_id] = record
+        else:
+            record = Game.from_row(row)
+            self._index_game(record)
+        if changes is not None:
+            changes[0].add(record.room_id)
+
+    def _read_log(self, changes: Optional[tuple] = None) -> int:
+        """Apply complete lines from the reader's position; returns how many."""
+        count = 0
+        while True:
+            start = self._reader.tell()
+            line = self._reader.readline()
+            if not line:
+                break
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError('partial line')
+                entry = json.loads(line)
+            except ValueError:
+                # Torn by a crash, or still being written by another process
+                self._reader.seek(start)
+                break
+            if 'generation' in entry:
+                self._generation = entry['generation']
+                continue
+            self._apply(entry, changes)
+            count += 1
+        return count
+
+    def _open_generation(self, generation: int):
+        """The log of the given generation, current or archived, if it still exists."""
+        for path in (self.log_file, os.path.join(self.data_dir, 'changes.{}.log'.format(generation))):
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                continue
+            if _log_generation(f) == generation:
+                return f
+            f.close()
+        return None
+
+    def _catch_up(self, process_locked: bool = True):
+        """Apply changes other processes logged since the last call. Caller holds csv_lock."""
+        changes = (set(), {}, [])
+        while True:
+            self._log_entries += self._read_log(changes)
+            if os.fstat(self._reader.fileno()).st_ino == os.stat(self.log_file).st_ino:
+                break
+            # Another process compacted. Nothing is appended to a replaced
+            # log, so read what is left of it and move on to the next one.
+            self._read_log(changes)
+            reader = self._open_generation(self._generation + 1)
+            if reader is None:
+                if process_locked:
+                    self._reload(changes)
+                else:
+                    with metrics.timed_lock(self._process_lock, 'changes.lock'):
+                        self._reload(changes)
+                break
+            self._reader.close()
+            self._reader = reader
+            self._log_entries = 0
+        if changes[0] and self.on_replay is not None:
+            self.on_replay(changes[0], list(changes[1].values()), changes[2])
+
+    def _follow(self):
+        while not self._closed.wait(self.sync_interval):
+            try:
+                with metrics.timed_lock(self.csv_lock, 'csv_lock'):
+                    if self._reader is not None:
+                        self._catch_up(process_locked=False)
+            except Exception:
+                logger.exception('following %s failed', self.log_file)
+
+    def _replay_log(self) -> int:
+        """Apply logged changes on top of the loaded snapshots.
+
+        Every entry is a full-row upsert or a room delete, so replaying a log
+        that was already partly folded into the CSVs (crash during
+        compaction) is harmless. A torn final line from a crash mid-append
+        is cut off so later appends start on a clean line.
+        """
+        if not os.path.exists(self.log_file):
+            open(self.log_file, 'a').close()
+        self._reader = open(self.log_file, 'rb')
+        count = self._read_log()
+        good_end = self._reader.tell()
+        if good_end < os.fstat(self._reader.fileno()).st_size:
+            os.truncate(self.log_file, good_end)
+        if not self.shared:
+            self._reader.close()
+            self._reader = None
+        return count
+
+    @contextmanager
+    def transaction(self):
+        """Buffer this thread's log lines and append them in one write.
+
+        Returns once the lines are on disk, which with group commit can
+        include waiting for the writer thread's next flush.
+
+        Isolation between requests comes from the per-room locks taken in
+        app.py; csv_lock is only held for the append itself. The shared
+        side of _memory_lock is held until the lines are queued, so
+        compaction either sees none of the transaction or all of it with
+        its lines ahead in the queue. It is released before waiting for
+        the append, which may itself compact. There is no rollback: changes
+        made before an exception are still written so the log matches
+        memory.
+        """
+        if getattr(self._local, 'pending', None) is not None:
+            yield
+            return
+        self._memory_lock.acquire_read()
+        self._local.pending = []
+        future = None
+        try:
+            yield
+        finally:
+            lines = self._local.pending
+            self._local.pending = None
+            try:
+                if lines:
+                    future = self._enqueue(lines)
+            finally:
+                self._memory_lock.release_read()
+        if future is not None:
+            if self._writer is None or threading.current_thread() is self._writer:
+                self._drain()
+            future.result()
+
+    def _log(self, table: str, record):
+        self._log_line(json.dumps({'table': table, 'row': record.to_dict()}) + '\n')
+
+    def _log_line(self, line: Union[str, Dict]):
+        # Only called inside transaction(). A dict is an add_to_profiles()
+        # delta, resolved in _commit_queued
+        self._local.pending.append(line)
+
+    def _resolve_profile_deltas(self, deltas: Dict[str, Dict]) -> str:
+        """Apply deltas and return the log lines of the new rows. Caller holds _exclusive().
+
+        Increments are applied here rather than when they are made, so with
+        every other process's changes already replayed and the log written
+        in the same order; each line is then a plain full-row upsert.
+        """
+        lines = []
+        for user_id, delta in deltas.items():
+            profile = self._profiles.get(user_id)
+            if profile is None:
+                continue
+            # A new object, so readers copying the old one see consistent totals
+            profile = copy.copy(profile)
+            apply_profile_delta(profile, delta)
+            self._profiles[user_id] = profile
+            lines.append(json.dumps({'table': 'profiles', 'row': profile.to_dict()}) + '\n')
+        return ''.join(lines)
+
+    def _enqueue(self, lines: List[Union[str, Dict]]) -> Future:
+        future = Future()
+        with self._commit_ready:
+            if self._writer is not None and self._closed.is_set():
+                raise RuntimeError('{} is closed'.format(self.data_dir))
+            self._commit_queue.append((lines, future))
+            self._commit_ready.notify()
+        return future
+
+    def _run_writer(self):
+        last_flush = 0.0
+        while True:
+            with self._commit_ready:
+                while not self._commit_queue and not self._closed.is_set():
+                    self._commit_ready.wait()
+                if not self._commit_queue:
+                    return
+            # Let more transactions join this flush
+            delay = last_flush + self.commit_interval - time.monotonic()
+            if delay > 0 and not self._closed.is_set():
+                time.sleep(delay)
+            last_flush = time.monotonic()
+            try:
+                self._drain()
+            except Exception:
+                logger.exception('compacting %s failed', self.log_file)
+
+    def _drain(self):
+        """Append every queued transaction, then compact if it is due."""
+        with self._exclusive():
+            self._commit_queued()
+            due = self._log_entries >= self.compact_every
+        if due:
+            # Let go of csv_lock first; _memory_lock is taken before it
+            with self._memory_lock.write(), self._exclusive():
+                if self._log_entries >= self.compact_every:
+                    self._compact()
+
+    def _commit_queued(self):
+        """Append the queued transactions' lines in order, in one write and fsync.
+
+        Caller holds _exclusive(). Each transaction's future gets the outcome.
+        """
+        with self._commit_ready:
+            batch, self._commit_queue = self._commit_queue, []
+        if not batch:
+            return
+        try:
+            if self.shared:
+                self._catch_up()
+                if (self._log_handle is not None and
+                        os.fstat(self._log_handle.fileno()).st_ino != os.stat(self.log_file).st_ino):
+                    # Still open on a log another process has replaced
+                    self._log_handle.close()
+                    self._log_handle = None
+            lines = [line if isinstance(line, str) else self._resolve_profile_deltas(line)
+                     for transaction, _ in batch for line in transaction]
+            if self._log_handle is None:
+                self._log_handle = open(self.log_file, 'a')
+            self._log_handle.write(''.join(lines))
+            self._log_handle.flush()
+            os.fsync(self._log_handle.fileno())
+            if self._reader is not None:
+                # Our own lines are already in memory; don't replay them
+                self._reader.seek(0, os.SEEK_END)
+            self._log_entries += len(lines)
+        except BaseException as e:
+            logger.exception('appending to %s failed', self.log_file)
+            for _, future in batch:
+                future.set_exception(e)
+        else:
+            for _, future in batch:
+                future.set_result(None)
+        commit_transactions.observe(len(batch))
+
+    def _compact(self):
+        """Fold the change log into the CSV snapshots.
+
+        Caller must hold the exclusive side of _memory_lock, then
+        _exclusive(). No transaction is changing memory, and every one that
+        already has is queued, so its lines are appended first and the
+        tables copied here are a state the log also replays to.
+
+        Each snapshot is replaced atomically and the log is only replaced by
+        an empty one once all four are on disk, so a crash at any point
+        leaves snapshots plus a log that replays to the same state.
+        snapshot.bin is written from the same records after the CSVs; a
+        crash before it replaces the old one leaves that one stale, and the
+        next start reads the CSVs.
+        """
+        self._commit_queued()
+        if self.shared:
+            self._catch_up()
+        if self._log_handle is not None:
+            self._log_handle.close()
+            self._log_handle = None
+        records = {'rooms': list(self._rooms.values()), 'players': list(self._players.values()),
+                   'games': list(self._games.values()), 'profiles': list(self._profiles.values())}
+        _write_rows(self.rooms_file, ROOM_FIELDS, records['rooms'])
+        _write_rows(self.players_file, PLAYER_FIELDS, records['players'])
+        _write_rows(self.games_file, GAME_FIELDS, records['games'])
+        _write_rows(self.profiles_file, PROFILE_FIELDS, records['profiles'])
+        snapshot.write_snapshot(self.snapshot_file, records, self._table_files())
+        generation = self._generation + 1
+        tmp_path = self.log_file + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps({'generation': generation}) + '\n')
+        if self.shared:
+            # Followers still on an older log open this one next
+            _archive_log(self.log_file, os.path.join(self.data_dir, 'changes.{}.log'.format(self._generation)))
+            stale = os.path.join(self.data_dir, 'changes.{}.log'.format(self._generation - LOG_GENERATIONS_KEPT))
+            if os.path.exists(stale):
+                os.remove(stale)
+        os.replace(tmp_path, self.log_file)
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = open(self.log_file, 'rb')
+            self._reader.seek(0, os.SEEK_END)
+        self._generation = generation
+        self._log_entries = 0
+
+    def compact(self):
+        """Force a compaction of the change log into the CSV files."""
+        with self._memory_lock.write(), self._exclusive():
+            self._compact()
+
+    def close(self):
+        with self._commit_ready:
+            self._closed.set()
+            self._commit_ready.notify()
+        if self._writer is not None:
+            # Flushes whatever is still queued first
+            self._writer.join()
+        with metrics.timed_lock(self.csv_lock, 'csv_lock'):
+            if self._log_handle is not None:
+                self._log_handle.close()
+                self._log_handle = None
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+
+    def create_room(self, room: Room) -> Room:
+        with self.transaction():
+            self._rooms[room.room_id] = copy.copy(room)
+            self._log('rooms', room)
+        return room
+
+    def get_room(self, room_id: str) -> Optional[Room]:
+        room = self._rooms.get(room_id)
+        return copy.copy(room) if room else None
+
+    def update_room(self, room: Room):
+        with self.transaction():
+            self._rooms[room.room_id] = copy.copy(room)
+            self._log('rooms', room)
+
+    def iter_rooms(self) -> Iterator[Room]:
+        for room in list(self._rooms.values()):
+            yield copy.copy(room)
+
+    def delete_room(self, room_id: str):
+        # The seat stripe, so a join racing the delete either lands first
+        # and is deleted with the room, or finds no room
+        with self._seat_locks.for_key(room_id).write(), self.transaction():
+            self._unindex_room(room_id)
+            self._log_line(json.dumps({'table': 'rooms', 'delete': room_id}) + '\n')
+
+    def add_player(self, player: Player) -> Player:
+        with self.transaction():
+            self._index_player(copy.copy(player))
+            self._log('players', player)
+        return player
+
+    def create_rooms(self, rooms: List[Room], players: List[Player]):
+        with self.transaction():
+            for room in rooms:
+                self.create_room(room)
+            for player in players:
+                self.add_player(player)
+
+    def reserve_seats(self, players: List[Player],
+                      capacity: int = None) -> List[Union[int, Exception]]:
+        # Lock every affected stripe in a fixed order so two batches that
+        # share rooms cannot deadlock
+        stripes = {id(lock): lock for lock in
+                   (self._seat_locks.for_key(p.room_id) for p in players)}
+        locks = [stripes[key] for key in sorted(stripes)]
+        for lock in locks:
+            lock.acquire_write()
+        try:
+            results, accepted, rooms = plan_seats(
+                players, capacity, self._rooms.get,
+                lambda room_id: len(self._players_by_room.get(room_id, ())))
+            with self.transaction():
+                for player in accepted:
+                    self.add_player(player)
+                for room in rooms:
+                    self.update_room(room)
+        finally:
+            for lock in reversed(locks):
+                lock.release_write()
+        return results
+
+    def get_players_in_room(self, room_id: str) -> List[Player]:
+        return [copy.copy(self._players[pid]) for pid in self._players_by_room.get(room_id, [])]
+
+    def get_player(self, player_id: str, room_id: str = None) -> Optional[Player]:
+        player = self._players.get(player_id)
+        return copy.copy(player) if player else None
+
+    def iter_players(self, since: str = None, until: str = None) -> Iterator[Player]:
+        for player in list(self._players.values()):
+            if in_time_range(player.joined_at, since, until):
+                yield copy.copy(player)
+
+    def update_player(self, player: Player):
+        with self.transaction():
+            self._index_player(copy.copy(player))
+            self._log('players', player)
+
+    def update_players_batch(self, players: List[Player]):
+        with self.transaction():
+            for player in players:
+                self._index_player(copy.copy(player))
+                self._log('players', player)
+
+    def create_game(self, game: Game) -> Game:
+        with self.transaction():
+            self._index_game(copy.copy(game))
+            self._log('games', game)
+        return game
+
+    def get_current_game(self, room_id: str) -> Optional[Game]:
+        ids = self._games_by_room_status.get((room_id, 'in_progress'))
+        return copy.copy(self._games[ids[0]]) if ids else None
+
+    def get_game(self, game_id: str, room_id: str = None) -> Optional[Game]:
+        game = self._games.get(game_id)
+        return copy.copy(game) if game else None
+
+    def get_game_by_round(self, room_id: str, round_number: int) -> Optional[Game]:
+        game_id = self._games_by_round.get((room_id, round_number))
+        return copy.copy(self._games[game_id]) if game_id else None
+
+    def get_games_in_room(self, room_id: str) -> List[Game]:
+        games = [copy.copy(self._games[gid]) for gid in self._games_by_room.get(room_id, [])]
+        return sorted(games, key=lambda g: g.round_number)
+
+    def get_latest_game(self, room_id: str, status: str = 'completed') -> Optional[Game]:
+        ids = self._games_by_room_status.get((room_id, status))
+        return copy.copy(self._games[ids[-1]]) if ids else None
+
+    def update_game(self, game: Game):
+        with self.transaction():
+            self._index_game(copy.copy(game))
+            self._log('games', game)
+
+    def iter_games(self, status: str = None, since: str = None, until: str = None) -> Iterator[Game]:
+        # Only the ids are snapshotted (csv_lock is never taken here); games
+        # deleted by the reaper mid-export are skipped, and each one is
+        # copied only as it is yielded
+        for game_id in list(self._games):
+            game = self._games.get(game_id)
+            if game is None or (status and game.status != status):
+                continue
+            if in_time_range(game.created_at, since, until):
+                yield copy.copy(game)
+
+    def create_profile(self, profile: Profile) -> Profile:
+        with self.transaction():
+            self._profiles[profile.user_id] = copy.copy(profile)
+            self._log('profiles', profile)
+        return profile
+
+    def get_profile(self, user_id: str) -> Optional[Profile]:
+        profile = self._profiles.get(user_id)
+        return copy.copy(profile) if profile else None
+
+    def iter_profiles(self) -> Iterator[Profile]:
+        for profile in list(self._profiles.values()):
+            yield copy.copy(profile)
+
+    def update_profiles(self, profiles: List[Profile]):
+        with self.transaction():
+            for profile in profiles:
+                self._profiles[profile.user_id] = copy.copy(profile)
+                self._log('profiles', profile)
+
+    def add_to_profiles(self, deltas: Dict[str, Dict]):
+        if deltas:
+            with self.transaction():
+                self._log_line(dict(deltas))
+
+    def get_players_by_user(self, user_id: str) -> List[Player]:
+        players = (self._players.get(pid) for pid in list(self._players_by_user.get(user_id, ())))
+        return [copy.copy(p) for p in players if p is not None]
@@ -1,257 +1,342 @@
-
-import csv
 import os
-from typing import List, Optional
-from models import Room, Player, Game
 import threading
-csv_lock = threading.Lock()
+import time
+from typing import Dict, List, Optional, Union
+from models import Room, Player, Game, Profile
+from repository import Repository, RoomNotFound, RoomFull, GameAlreadyStarted
+from locks import StripedLocks
+from cache import response_cache
+from ranking import GlobalLeaderboard
+import metrics
+import workers
+
+DATA_DIR = os.environ.get('DATA_DIR', 'data')
+
+# 'csv' (CSV snapshots + change log, served from memory) or 'sqlite'
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'csv')
+
+# Number of logged changes after which the CSV backend compacts its log
+COMPACT_EVERY = int(os.environ.get('COMPACT_EVERY', '1000'))
+
+# Seconds between the CSV backend's group-committed log flushes (each one
+# fsynced); 0 appends in the request's own thread
+CSV_COMMIT_INTERVAL = float(os.environ.get('CSV_COMMIT_INTERVAL', '0.001'))
+
+# Number of lock stripes shared by all rooms
+ROOM_LOCK_STRIPES = int(os.environ.get('ROOM_LOCK_STRIPES', '64'))
+
+# Whether other processes write to the same DATA_DIR (on by default when
+# running several workers). SQLite is the better choice then: it is safe
+# across processes on its own, while the CSV backend has to follow a shared
+# log and keeps a full copy of the data in every worker.
+SHARED_STORAGE = os.environ.get('STORAGE_SHARED', '1' if workers.WORKER_COUNT > 1 else '0') == '1'
+
+# Number of room-hashed partitions, each in DATA_DIR/shard-NN with its own
+# files or database; 1 keeps everything directly in DATA_DIR. Change it
+# with reshard.py, never by editing the setting alone.
+STORAGE_SHARDS = int(os.environ.get('STORAGE_SHARDS', '1'))
+
+# With shared storage the global leaderboard is rebuilt after this many
+# seconds if the backend cannot report other processes' changes
+LEADERBOARD_REFRESH = float(os.environ.get('LEADERBOARD_REFRESH', '5'))
+
+_repository: Optional[Repository] = None
+_repository_lock = threading.Lock()
+_room_locks = StripedLocks(ROOM_LOCK_STRIPES)
+_leaderboard: Optional[GlobalLeaderboard] = None
+_leaderboard_building: Optional[GlobalLeaderboard] = None
+_leaderboard_lock = threading.Lock()
+_leaderboard_built_at = 0.0
+
+
+def create_repository(backend: str = None, data_dir: str = None, shards: int = None) -> Repository:
+    backend = backend or STORAGE_BACKEND
+    data_dir = data_dir or DATA_DIR
+    shards = shards or STORAGE_SHARDS
+    from sharded_repository import ShardedRepository, check_layout, shard_dirs
+    check_layout(data_dir, shards)
+    if shards > 1:
+        return ShardedRepository([create_repository(backend, path, 1)
+                                  for path in shard_dirs(data_dir, shards)])
+    if backend == 'csv':
+        from csv_repository import CsvRepository
+        return CsvRepository(data_dir, compact_every=COMPACT_EVERY, shared=SHARED_STORAGE,
+                             commit_interval=CSV_COMMIT_INTERVAL)
+    if backend == 'sqlite':
+        from sqlite_repository import SqliteRepository
+        return SqliteRepository(os.path.join(data_dir, 'game.db'))
+    raise ValueError("Unknown storage backend: {}".format(backend))
+
+
+def get_repository() -> Repository:
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                repository = create_repository()
+                repository.on_replay = _external_changes
+                _repository = repository
+    return _repository
+
+
+def set_repository(repository: Repository):
+    """Swap the active backend (used by tools and benchmarks)."""
+    global _repository
+    with _repository_lock:
+        if _repository is not None and _repository is not repository:
+            _repository.close()
+        repository.on_replay = _external_changes
+        _repository = repository
+        _reset_leaderboard()
+
+
+def _reset_leaderboard():
+    global _leaderboard, _leaderboard_building
+    _leaderboard = None
+    _leaderboard_building = None
+
+
+def get_global_leaderboard() -> GlobalLeaderboard:
+    """Ranking of every stored player, built from storage on first use."""
+    global _leaderboard, _leaderboard_building, _leaderboard_built_at
+    if _leaderboard is None:
+        repository = get_repository()
+        with _leaderboard_lock:
+            if _leaderboard is None:
+                # Writes that land while storage is scanned are applied to
+                # the new ranking too; both are full upserts, so the later
+                # one wins either way.
+                leaderboard = _leaderboard_building = GlobalLeaderboard()
+                leaderboard.update_many(repository.iter_players())
+                _leaderboard = leaderboard
+                _leaderboard_built_at = time.time()
+    elif (SHARED_STORAGE and not get_repository().reports_external_changes and
+          time.time() - _leaderboard_built_at > LEADERBOARD_REFRESH and
+          _leaderboard_lock.acquire(blocking=False)):
+        # Other workers' points only show up in storage. One request
+        # rebuilds the ranking while the others keep reading the old one
+        try:
+            leaderboard = _leaderboard_building = GlobalLeaderboard()
+            leaderboard.update_many(get_repository().iter_players())
+            _leaderboard = leaderboard
+            _leaderboard_built_at = time.time()
+        finally:
+            _leaderboard_lock.release()
+    return _leaderboard
+
+
+def _rank_players(players: List[Player]):
+    # Nothing to maintain until somebody asks for the ranking
+    leaderboard = _leaderboard or _leaderboard_building
+    if leaderboard is not None:
+        leaderboard.update_many(players)
+
+
+def _external_changes(room_ids, players: List[Player], removed_player_ids: List[str]):
+    """Keep caches in step with changes another process wrote."""
+    for room_id in room_ids:
+        response_cache.invalidate(room_id)
+    _rank_players(players)
+    leaderboard = _leaderboard or _leaderboard_building
+    if leaderboard is not None:
+        for player_id in removed_player_ids:
+            leaderboard.remove(player_id)
 
-DATA_DIR = 'data'
-ROOMS_FILE = os.path.join(DATA_DIR, 'rooms.csv')
-PLAYERS_FILE = os.path.join(DATA_DIR, 'players.csv')
-GAMES_FILE = os.path.join(DATA_DIR, 'games.csv')
 
 def init_database():
-    os.makedirs(DATA_DIR, exist_ok=True)
-    if not os.path.exists(ROOMS_FILE):
-        with open(ROOMS_FILE, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=['room_id', 'created_by', 'status', 'player_count', 'created_at'])
-            writer.writeheader()
-    if not os.path.exists(PLAYERS_FILE):
-        with open(PLAYERS_FILE, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=['player_id', 'name', 'room_id', 'role', 'points', 'joined_at'])
-            writer.writeheader()
-    if not os.path.exists(GAMES_FILE):
-        with open(GAMES_FILE, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=[
-                'game_id', 'room_id', 'mantri_player_id', 'guessed_player_id', 
-                'chor_player_id', 'guess_correct', 'raja_points', 'mantri_points', 
-                'chor_points', 'sipahi_points', 'status', 'created_at'
-            ])
-            writer.writeheader()
+    get_repository()
+
+
+def room_lock(room_id: str):
+    """Exclusive lock for check-then-write sequences on one room."""
+    return metrics.timed_lock(_room_locks.for_key(room_id).write(), 'room')
+
+
+def room_read_lock(room_id: str):
+    """Shared lock for reads that need a consistent view of one room."""
+    return metrics.timed_lock(_room_locks.for_key(room_id).read(), 'room_read')
+
+
+def transaction():
+    """Group the storage calls of one API request into a single commit."""
+    return get_repository().transaction()
+
+
+# Every write below invalidates the cached responses of the room it touches.
+
+@metrics.storage_call
 def create_room(room: Room) -> Room:
     """Create a new room"""
-    with csv_lock:
-        with open(ROOMS_FILE, 'a', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=room.to_dict().keys())
-            writer.writerow(room.to_dict())
+    room = get_repository().create_room(room)
+    response_cache.invalidate(room.room_id)
     return room
 
 
+@metrics.storage_call
+def create_rooms(rooms: List[Room], players: List[Player]):
+    """Create many rooms and their first players in one storage write."""
+    get_repository().create_rooms(rooms, players)
+    for room in rooms:
+        response_cache.invalidate(room.room_id)
+    _rank_players(players)
+
+
+@metrics.storage_call
 def get_room(room_id: str) -> Optional[Room]:
-    import csv
-    import os
-    from typing import List, Optional
-    from models import Room, Player, Game
-    import threading
-
-    csv_lock = threading.Lock()
-
-    DATA_DIR = 'data'
-    ROOMS_FILE = os.path.join(DATA_DIR, 'rooms.csv')
-    PLAYERS_FILE = os.path.join(DATA_DIR, 'players.csv')
-    GAMES_FILE = os.path.join(DATA_DIR, 'games.csv')
-
-    def init_database():
-        os.makedirs(DATA_DIR, exist_ok=True)
-        if not os.path.exists(ROOMS_FILE):
-            with open(ROOMS_FILE, 'w', newline='') as f:
-                writer = csv.DictWriter(f, fieldnames=['room_id', 'created_by', 'status', 'player_count', 'created_at'])
-                writer.writeheader()
-        if not os.path.exists(PLAYERS_FILE):
-            with open(PLAYERS_FILE, 'w', newline='') as f:
-                writer = csv.DictWriter(f, fieldnames=['player_id', 'name', 'room_id', 'role', 'points', 'joined_at'])
-                writer.writeheader()
-        if not os.path.exists(GAMES_FILE):
-            with open(GAMES_FILE, 'w', newline='') as f:
-                writer = csv.DictWriter(f, fieldnames=[
-                    'game_id', 'room_id', 'mantri_player_id', 'guessed_player_id', 
-                    'chor_player_id', 'guess_correct', 'raja_points', 'mantri_points', 
-                    'chor_points', 'sipahi_points', 'status', 'created_at'
-                ])
-                writer.writeheader()
-
-    def create_room(room: Room) -> Room:
-        with csv_lock:
-            with open(ROOMS_FILE, 'a', newline='') as f:
-                writer = csv.DictWriter(f, fieldnames=room.to_dict().keys())
-                writer.writerow(room.to_dict())
-        return room
-
-    def get_room(room_id: str) -> Optional[Room]:
-        import csv
-        import os
-        from typing import List, Optional
-        from models import Room, Player, Game
-        import threading
-        csv_lock = threading.Lock()
-
-        DATA_DIR = 'data'
-        ROOMS_FILE = os.path.join(DATA_DIR, 'rooms.csv')
-        PLAYERS_FILE = os.path.join(DATA_DIR, 'players.csv')
-        GAMES_FILE = os.path.join(DATA_DIR, 'games.csv')
-
-        def init_database():
-            os.makedirs(DATA_DIR, exist_ok=True)
-            if not os.path.exists(ROOMS_FILE):
-                with open(ROOMS_FILE, 'w', newline='') as f:
-                    writer = csv.DictWriter(f, fieldnames=['room_id', 'created_by', 'status', 'player_count', 'created_at'])
-                    writer.writeheader()
-            if not os.path.exists(PLAYERS_FILE):
-                with open(PLAYERS_FILE, 'w', newline='') as f:
-                    writer = csv.DictWriter(f, fieldnames=['player_id', 'name', 'room_id', 'role', 'points', 'joined_at'])
-                    writer.writeheader()
- 
-            if not os.path.exists(GAMES_FILE):
-                with open(GAMES_FILE, 'w', newline='') as f:
-                    writer = csv.DictWriter(f, fieldnames=[
-                        'game_id', 'room_id', 'mantri_player_id', 'guessed_player_id', 
-                        'chor_player_id', 'guess_correct', 'raja_points', 'mantri_points', 
-                        'chor_points', 'sipahi_points', 'status', 'created_at'
-                    ])
-                    writer.writeheader()
-
-        def create_room(room: Room) -> Room:
-            with csv_lock:
-                with open(ROOMS_FILE, 'a', newline='') as f:
-                    writer = csv.DictWriter(f, fieldnames=room.to_dict().keys())
-                    writer.writerow(room.to_dict())
-            return room
-
-
-        def get_room(room_id: str) -> Optional[Room]:
-            with csv_lock:
-                with open(ROOMS_FILE, 'r') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        if row['room_id'] == room_id:
-                            return Room(**row)
-            return None
-
-
-        def update_room(room: Room):
-            with csv_lock:
-                rows = []
-                with open(ROOMS_FILE, 'r') as f:
-                    reader = csv.DictReader(f)
-                    rows = list(reader)
-        
-                with open(ROOMS_FILE, 'w', newline='') as f:
-                    writer = csv.DictWriter(f, fieldnames=rows[0].keys() if rows else room.to_dict().keys())
-                    writer.writeheader()
-                    for row in rows:
-                        if row['room_id'] == room.room_id:
-                            writer.writerow(room.to_dict())
-                        else:
-                            writer.writerow(row)
-
-        def add_player(player: Player) -> Player:
-            with csv_lock:
-                with open(PLAYERS_FILE, 'a', newline='') as f:
-                    writer = csv.DictWriter(f, fieldnames=player.to_dict().keys())
-                    writer.writerow(player.to_dict())
-            return player
-
-
-        def get_players_in_room(room_id: str) -> List[Player]:
- 
-            players = []
-            with csv_lock:
-                with open(PLAYERS_FILE, 'r') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        if row['room_id'] == room_id:
-                            row['points'] = int(row['points']) if row['points'] else 0
-                            players.append(Player(**row))
-            return players
-
-
-        def get_player(player_id: str) -> Optional[Player]:
-            with csv_lock:
-                with open(PLAYERS_FILE, 'r') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        if row['player_id'] == player_id:
-                            row['points'] = int(row['points']) if row['points'] else 0
-                            return Player(**row)
-            return None
-
-
-        def update_player(player: Player):
-            with csv_lock:
-                rows = []
-                with open(PLAYERS_FILE, 'r') as f:
-                    reader = csv.DictReader(f)
-                    rows = list(reader)
-        
-                with open(PLAYERS_FILE, 'w', newline='') as f:
-                    writer = csv.DictWriter(f, fieldnames=rows[0].keys() if rows else player.to_dict().keys())
-                    writer.writeheader()
-                    for row in rows:
-                        if row['player_id'] == player.player_id:
-                            writer.writerow(player.to_dict())
-                        else:
-                            writer.writerow(row)
-
-
-        def update_players_batch(players: List[Player]):
-            with csv_lock:
-                rows = []
-                player_dict = {p.player_id: p for p in players}
-        
-                with open(PLAYERS_FILE, 'r') as f:
-                    reader = csv.DictReader(f)
-                    rows = list(reader)
-        
-                with open(PLAYERS_FILE, 'w', newline='') as f:
-                    if rows:
-                        writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-                    else:
-                        writer = csv.DictWriter(f, fieldnames=players[0].to_dict().keys())
-                    writer.writeheader()
-                    for row in rows:
-                        if row['player_id'] in player_dict:
-                            writer.writerow(player_dict[row['player_id']].to_dict())
-                        else:
-                            writer.writerow(row)
-
-        def create_game(game: Game) -> Game:
-            with csv_lock:
-                with open(GAMES_FILE, 'a', newline='') as f:
-                    writer = csv.DictWriter(f, fieldnames=game.to_dict().keys())
-                    writer.writerow(game.to_dict())
-            return game
-
-
-        def get_current_game(room_id: str) -> Optional[Game]:
-            
-            with csv_lock:
-                with open(GAMES_FILE, 'r') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        if row['room_id'] == room_id and row['status'] == 'in_progress':
-                            # Convert numeric fields
-                            for key in ['raja_points', 'mantri_points', 'chor_points', 'sipahi_points']:
-                                row[key] = int(row[key]) if row[key] else 0
-                            row['guess_correct'] = row['guess_correct'] == 'True' if row['guess_correct'] else None
-                            return Game(**row)
-            return None
-
-
-        def update_game(game: Game):
-            
-            with csv_lock:
-                rows = []
-                with open(GAMES_FILE, 'r') as f:
-                    reader = csv.DictReader(f)
-                    rows = list(reader)
-        
-                with open(GAMES_FILE, 'w', newline='') as f:
-                    writer = csv.DictWriter(f, fieldnames=rows[0].keys() if rows else game.to_dict().keys())
-                    writer.writeheader()
-                    for row in rows:
-                        if row['game_id'] == game.game_id:
-                            writer.writerow(game.to_dict())
-                        else:
-
-                            writer.writerow(row)
+    return get_repository().get_room(room_id)
+
+
+@metrics.storage_call
+def update_room(room: Room):
+    get_repository().update_room(room)
+    response_cache.invalidate(room.room_id)
+
+
+@metrics.storage_call
+def iter_rooms():
+    return get_repository().iter_rooms()
+
+
+@metrics.storage_call
+def delete_room(room_id: str):
+    """Remove a room with its players and games from the hot store."""
+    players = get_repository().get_players_in_room(room_id)
+    get_repository().delete_room(room_id)
+    response_cache.invalidate(room_id)
+    leaderboard = _leaderboard or _leaderboard_building
+    if leaderboard is not None:
+        for player in players:
+            leaderboard.remove(player.player_id)
+
+
+@metrics.storage_call
+def add_player(player: Player) -> Player:
+    player = get_repository().add_player(player)
+    response_cache.invalidate(player.room_id)
+    _rank_players([player])
+    return player
+
+
+@metrics.storage_call
+def reserve_seat(player: Player) -> int:
+    """Add player to player.room_id if it is waiting and has a free seat.
+
+    Returns the 0-based seat index; raises RoomNotFound, RoomFull or
+    GameAlreadyStarted otherwise.
+    """
+    seat = get_repository().reserve_seat(player)
+    response_cache.invalidate(player.room_id)
+    _rank_players([player])
+    return seat
+
+
+@metrics.storage_call
+def reserve_seats(players: List[Player]) -> List[Union[int, Exception]]:
+    """reserve_seat() for many players, persisted in one storage write.
+
+    Returns a seat index or the exception reserve_seat() would raise, one
+    per player in order.
+    """
+    results = get_repository().reserve_seats(players)
+    seated = [p for p, r in zip(players, results) if not isinstance(r, Exception)]
+    for room_id in {p.room_id for p in seated}:
+        response_cache.invalidate(room_id)
+    _rank_players(seated)
+    return results
+
+
+@metrics.storage_call
+def get_players_in_room(room_id: str) -> List[Player]:
+    return get_repository().get_players_in_room(room_id)
+
+
+@metrics.storage_call
+def get_player(player_id: str, room_id: str = None) -> Optional[Player]:
+    return get_repository().get_player(player_id, room_id)
+
+
+@metrics.storage_call
+def iter_players(since: str = None, until: str = None):
+    return get_repository().iter_players(since, until)
+
+
+@metrics.storage_call
+def update_player(player: Player):
+    get_repository().update_player(player)
+    response_cache.invalidate(player.room_id)
+    _rank_players([player])
+
+
+@metrics.storage_call
+def update_players_batch(players: List[Player]):
+    if not players:
+        return
+    get_repository().update_players_batch(players)
+    for room_id in {p.room_id for p in players}:
+        response_cache.invalidate(room_id)
+    _rank_players(players)
+
+
+@metrics.storage_call
+def create_game(game: Game) -> Game:
+    game = get_repository().create_game(game)
+    response_cache.invalidate(game.room_id)
+    return game
+
+
+@metrics.storage_call
+def get_current_game(room_id: str) -> Optional[Game]:
+    return get_repository().get_current_game(room_id)
+
+
+@metrics.storage_call
+def get_game(game_id: str, room_id: str = None) -> Optional[Game]:
+    return get_repository().get_game(game_id, room_id)
+
+
+@metrics.storage_call
+def get_game_by_round(room_id: str, round_number: int) -> Optional[Game]:
+    return get_repository().get_game_by_round(room_id, round_number)
+
+
+@metrics.storage_call
+def get_games_in_room(room_id: str) -> List[Game]:
+    return get_repository().get_games_in_room(room_id)
+
+
+@metrics.storage_call
+def get_latest_game(room_id: str, status: str = 'completed') -> Optional[Game]:
+    return get_repository().get_latest_game(room_id, status)
+
+
+@metrics.storage_call
+def update_game(game: Game):
+    get_repository().update_game(game)
+    response_cache.invalidate(game.room_id)
+
+
+@metrics.storage_call
+def iter_games(status: str = None, since: str = None, until: str = None):
+    return get_repository().iter_games(status, since, until)
+
+
+@metrics.storage_call
+def create_profile(profile: Profile) -> Profile:
+    return get_repository().create_profile(profile)
+
+
+@metrics.storage_call
+def get_profile(user_id: str) -> Optional[Profile]:
+    return get_repository().get_profile(user_id)
+
+
+@metrics.storage_call
+def add_to_profiles(deltas: Dict[str, Dict]):
+    """Add to profiles' lifetime counters, see Repository.add_to_profiles."""
+    if deltas:
+        get_repository().add_to_profiles(deltas)
+
+
+@metrics.storage_call
+def get_players_by_user(user_id: str) -> List[Player]:
+    return get_repository().get_players_by_user(user_id)
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List
+
+# Events kept per room for clients that reconnect with ?since=<seq>
+EVENTS_PER_ROOM = 50
+# Rooms with retained events; the least recently active are dropped first
+MAX_ROOMS = 10000
+
+
+class _RoomChannel:
+    def __init__(self):
+        self.seq = 0
+        self.events = deque(maxlen=EVENTS_PER_ROOM)
+        self.listeners = []
+
+
+class RoomEventBus:
+    """Per-room event sequence that both threads and asyncio tasks can wait on.
+
+    Every event gets a room-local sequence number starting at 1. Clients ask
+    for everything after the last seq they saw, so nothing is missed between
+    two long-polls. A room whose channel was dropped (see MAX_ROOMS) starts
+    again above the last seq of every dropped room, so clients still holding
+    an older seq see its new events.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._rooms: Dict[str, _RoomChannel] = OrderedDict()
+        self._dropped_seq = 0
+
+    def _channel(self, room_id: str) -> _RoomChannel:
+        channel = self._rooms.get(room_id)
+        if channel is None:
+            channel = self._rooms[room_id] = _RoomChannel()
+            channel.seq = self._dropped_seq
+            while len(self._rooms) > MAX_ROOMS:
+                _, dropped = self._rooms.popitem(last=False)
+                self._dropped_seq = max(self._dropped_seq, dropped.seq)
+        else:
+            self._rooms.move_to_end(room_id)
+        return channel
+
+    def publish(self, room_id: str, event_type: str, data: dict = None) -> dict:
+        with self._cond:
+            channel = self._channel(room_id)
+            channel.seq += 1
+            event = {
+                'seq': channel.seq,
+                'type': event_type,
+                'room_id': room_id,
+                'data': data or {},
+                'timestamp': time.time()
+            }
+            channel.events.append(event)
+            listeners = list(channel.listeners)
+            self._cond.notify_all()
+        for listener in listeners:
+            listener()
+        return event
+
+    def since(self, room_id: str, seq: int) -> List[dict]:
+        with self._cond:
+            channel = self._rooms.get(room_id)
+            if channel is None:
+                return []
+            return [e for e in channel.events if e['seq'] > seq]
+
+    def wait(self, room_id: str, seq: int, timeout: float) -> List[dict]:
+        """Block the calling thread until there are events after seq."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                events = self.since(room_id, seq)
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    return events
+                self._cond.wait(remaining)
+
+    async def wait_async(self, room_id: str, seq: int, timeout: float) -> List[dict]:
+        """Same as wait() without tying up a thread."""
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+
+        def listener():
+            loop.call_soon_threadsafe(wakeup.set)
+
+        with self._cond:
+            self._channel(room_id).listeners.append(listener)
+        try:
+            events = self.since(room_id, seq)
+            if not events:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                events = self.since(room_id, seq)
+            return events
+        finally:
+            with self._cond:
+                channel = self._rooms.get(room_id)
+                if channel is not None and listener in channel.listeners:
+                    channel.listeners.remove(listener)
+
+
+bus = RoomEventBus()
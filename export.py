@@ -0,0 +1,46 @@
+import csv
+import io
+import json
+from typing import Iterable, Iterator, List
+
+# Rows per chunk handed to the WSGI server; keeps writes large without
+# buffering more than this many rows at a time
+ROWS_PER_CHUNK = 500
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+
+def ndjson_chunks(records: Iterable) -> Iterator[str]:
+    lines = []
+    for record in records:
+        lines.append(json.dumps(record.to_dict()))
+        if len(lines) >= ROWS_PER_CHUNK:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def csv_chunks(records: Iterable, fields: List[str]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    rows = 0
+    for record in records:
+        writer.writerow([getattr(record, f) for f in fields])
+        rows += 1
+        if rows >= ROWS_PER_CHUNK:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            rows = 0
+    yield buffer.getvalue()
+
+
+def export_chunks(records: Iterable, fields: List[str], fmt: str) -> Iterator[str]:
+    if fmt == 'csv':
+        return csv_chunks(records, fields)
+    return ndjson_chunks(records)
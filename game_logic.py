@@ -1,58 +1,75 @@
 
 
 import random
-from typing import List, Dict, Tuple
+from typing import List, Dict, Mapping, Tuple
 from models import Player, Game
+import scoring
+from scoring import Variant
 
-ROLES = ['Raja', 'Mantri', 'Chor', 'Sipahi']
+CLASSIC = scoring.get_variant('classic')
+ROLES = list(CLASSIC.roles)
+DEFAULT_POINTS = dict(CLASSIC.hit)
 
-DEFAULT_POINTS = {
-    'Raja': 1000,
-    'Mantri': 800,
-    'Chor': 0,
-    'Sipahi': 500
-}
 
-
-def assign_roles(players: List[Player]) -> List[Player]:
-    if len(players) != 4:
-        raise ValueError("Exactly 4 players required for role assignment")
+def assign_roles(players: List[Player], variant: Variant = CLASSIC) -> List[Player]:
+    if len(players) != variant.capacity:
+        raise ValueError("Exactly {} players required for role assignment".format(variant.capacity))
     
   
-    shuffled_roles = random.sample(ROLES, len(ROLES))
+    shuffled_roles = random.sample(variant.roles, variant.capacity)
     
+    # Points are kept: they are the running total across rounds
     for i, player in enumerate(players):
         player.role = shuffled_roles[i]
-        player.points = 0 
     
     return players
 
 
+def encode_role_assignments(players: List[Player]) -> str:
+    return ';'.join('{}:{}'.format(p.player_id, p.role) for p in players)
+
+
+def decode_role_assignments(value: str) -> Dict[str, str]:
+    if not value:
+        return {}
+    return dict(item.split(':', 1) for item in value.split(';'))
+
+
 def calculate_scores(mantri_player: Player, guessed_player_id: str, 
-                     chor_player: Player) -> Tuple[Dict[str, int], bool]:
+                     chor_player: Player, variant: Variant = CLASSIC) -> Tuple[Mapping[str, int], bool]:
+    # mantri_player is the variant's guesser and chor_player its target;
+    # the returned table is shared and read-only
     guess_correct = (guessed_player_id == chor_player.player_id)
-    
-    if guess_correct:
-        scores = {
-            'Raja': DEFAULT_POINTS['Raja'],
-            'Mantri': DEFAULT_POINTS['Mantri'],
-            'Chor': DEFAULT_POINTS['Chor'],
-            'Sipahi': DEFAULT_POINTS['Sipahi']
-        }
-    else:
-        
-        stolen_points = DEFAULT_POINTS['Mantri'] + DEFAULT_POINTS['Sipahi']
-        scores = {
-            'Raja': DEFAULT_POINTS['Raja'],
-            'Mantri': 0,
-            'Chor': stolen_points,
-            'Sipahi': 0
-        }
-    
-    return scores, guess_correct
+    return variant.scores(guess_correct), guess_correct
+
 
+def record_scores(game: Game, scores: Mapping[str, int]) -> Game:
+    game.round_points = scoring.encode_points(scores)
+    # Kept filled for readers of the original four columns
+    game.raja_points = scores.get('Raja', 0)
+    game.mantri_points = scores.get('Mantri', 0)
+    game.chor_points = scores.get('Chor', 0)
+    game.sipahi_points = scores.get('Sipahi', 0)
+    return game
 
-def update_player_scores(players: List[Player], scores: Dict[str, int]) -> List[Player]:
+
+def profile_deltas(players: List[Player], scores: Mapping[str, int], target: str,
+                   guess_correct: bool, played_at: str) -> Dict[str, Dict]:
+    """What one scored round adds to the profiles of its players."""
+    deltas = {}
+    for player in players:
+        if not player.user_id:
+            continue
+        delta = deltas.setdefault(player.user_id, {
+            'games_played': 0, 'total_points': 0, 'times_caught': 0, 'last_played_at': played_at})
+        delta['games_played'] += 1
+        delta['total_points'] += scores.get(player.role, 0)
+        if guess_correct and player.role == target:
+            delta['times_caught'] += 1
+    return deltas
+
+
+def update_player_scores(players: List[Player], scores: Mapping[str, int]) -> List[Player]:
 
     for player in players:
         if player.role in scores:
@@ -83,25 +100,45 @@ def get_player_by_role(players: List[Player], role: str) -> Player:
     return None
 
 
+def prepare_round_history(players: List[Player], game: Game) -> Dict:
+    roles = decode_role_assignments(game.role_assignments)
+    points = scoring.round_points(game)
+    completed = game.status == 'completed'
+    
+    return {
+        'game_id': game.game_id,
+        'room_id': game.room_id,
+        'round_number': game.round_number,
+        'status': game.status,
+        'guessed_player_id': game.guessed_player_id,
+        'mantri_guess_correct': game.guess_correct,
+        'players': [{
+            'player_id': player.player_id,
+            'name': player.name,
+            'role': roles.get(player.player_id) if completed else None,
+            'round_points': points.get(roles.get(player.player_id), 0) if completed else None
+        } for player in players]
+    }
+
+
 def prepare_game_result(players: List[Player], game: Game) -> Dict:
-   
+    # Roles as they were in this game's round; players only carry the latest
+    roles = decode_role_assignments(game.role_assignments)
+    points = scoring.round_points(game)
     result = {
         'game_id': game.game_id,
+        'round_number': game.round_number,
         'mantri_guess_correct': game.guess_correct,
         'players': []
     }
     
     for player in players:
+        role = roles.get(player.player_id, player.role)
         result['players'].append({
             'player_id': player.player_id,
             'name': player.name,
-            'role': player.role,
-            'round_points': {
-                'Raja': game.raja_points,
-                'Mantri': game.mantri_points,
-                'Chor': game.chor_points,
-                'Sipahi': game.sipahi_points
-            }[player.role],
+            'role': role,
+            'round_points': points.get(role, 0),
             'total_points': player.points
         })
     
@@ -0,0 +1,167 @@
+"""Replay of POST responses for retried requests that carry an Idempotency-Key.
+
+A client that may retry a POST sends a unique Idempotency-Key header. The
+first request with a key runs normally and its response is kept for
+IDEMPOTENCY_TTL seconds. A retry from the same client (see
+ratelimit.client_of) with the same key, path and body gets the stored
+response back, marked Idempotent-Replayed: true, without running the view,
+so it never reaches database.py. A retry that arrives while the first
+request is still running waits for it, without holding an admission slot. Reusing a key for a
+different body gets 422. 5xx responses are not kept, so retrying those
+runs the request again.
+
+Keys live in process memory. With several workers a room's requests, and
+so their retries, always reach the room's own worker (see workers.py).
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import metrics
+import ratelimit
+
+# How long a finished response can be replayed, in seconds
+IDEMPOTENCY_TTL = float(os.environ.get('IDEMPOTENCY_TTL', '3600'))
+# Most keys remembered; the oldest finished ones are dropped first
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get('IDEMPOTENCY_MAX_KEYS', '10000'))
+# How long a retry waits for the original request before giving up with 409
+IDEMPOTENCY_WAIT = float(os.environ.get('IDEMPOTENCY_WAIT', '10'))
+
+MAX_KEY_LENGTH = 255
+
+requests_total = metrics.registry.counter(
+    'idempotent_requests_total', 'POSTs with an Idempotency-Key, by outcome.')
+
+
+class _Entry:
+    __slots__ = ('fingerprint', 'expires', 'done', 'response')
+
+    def __init__(self, fingerprint: str, expires: float):
+        self.fingerprint = fingerprint
+        self.expires = expires
+        self.done = threading.Event()
+        # (status, body, content type) once the first request has finished
+        self.response: Optional[Tuple[int, bytes, str]] = None
+
+
+class IdempotencyStore:
+    """Bounded TTL map from key to the response of the request that first used it."""
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, maxsize: int = IDEMPOTENCY_MAX_KEYS):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        # Oldest first; an entry moves to the end when its response is stored
+        self._entries: Dict[str, _Entry] = OrderedDict()
+        self.evictions = 0
+
+    def begin(self, key: str, fingerprint: str) -> Tuple[str, _Entry]:
+        """Claim key for a new request, or find the request that already has it.
+
+        Returns ('new', entry) if the caller must run the request and then
+        call finish(), ('duplicate', entry) for a finished or still running
+        request with the same fingerprint, and ('conflict', entry) if the
+        key was used for a different request.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                return ('duplicate' if entry.fingerprint == fingerprint else 'conflict'), entry
+            entry = _Entry(fingerprint, now + self.ttl)
+            self._entries[key] = entry
+            self._evict()
+            return 'new', entry
+
+    def finish(self, key: str, entry: _Entry, response: Optional[Tuple[int, bytes, str]]):
+        """Store the response of a claimed key, or forget the key if response is None."""
+        with self._lock:
+            if self._entries.get(key) is entry:
+                if response is None:
+                    del self._entries[key]
+                else:
+                    entry.response = response
+                    entry.expires = time.monotonic() + self.ttl
+                    self._entries.move_to_end(key)
+        entry.done.set()
+
+    def _expire(self, now: float):
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            # Requests still running stay until they finish
+            if entry.expires > now or not entry.done.is_set():
+                break
+            del self._entries[key]
+
+    def _evict(self):
+        if len(self._entries) <= self.maxsize:
+            return
+        for key, entry in self._entries.items():
+            if entry.done.is_set():
+                del self._entries[key]
+                self.evictions += 1
+                return
+
+    def __len__(self):
+        return len(self._entries)
+
+
+store = IdempotencyStore()
+
+
+def init_app(app):
+    """Honour Idempotency-Key on every POST route of a Flask app."""
+    from flask import g, jsonify, request
+
+    def replayed(response):
+        status, body, mimetype = response
+        result = app.response_class(body, status=status, mimetype=mimetype)
+        result.headers['Idempotent-Replayed'] = 'true'
+        return result
+
+    @app.before_request
+    def _replay_or_claim():
+        key = request.headers.get('Idempotency-Key')
+        if key is None or request.method != 'POST':
+            return None
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': 'Idempotency-Key must be 1-{} characters'.format(MAX_KEY_LENGTH)}), 400
+        scoped = ' '.join((ratelimit.client_of(request), request.path, key))
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT
+        while True:
+            outcome, entry = store.begin(scoped, fingerprint)
+            if outcome == 'new':
+                g.idempotency = (scoped, entry)
+                return None
+            if outcome == 'conflict':
+                requests_total.inc(outcome='conflict')
+                return jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422
+            if not entry.done.wait(max(deadline - time.monotonic(), 0)):
+                requests_total.inc(outcome='timeout')
+                return jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409
+            if entry.response is not None:
+                requests_total.inc(outcome='replayed')
+                return replayed(entry.response)
+            # The first request failed and gave the key up; run this one
+
+    @app.after_request
+    def _remember(response):
+        claim = g.pop('idempotency', None)
+        if claim is not None:
+            keep = response.status_code < 500 and not response.is_streamed
+            store.finish(*claim, (response.status_code, response.get_data(), response.mimetype)
+                         if keep else None)
+            requests_total.inc(outcome='stored' if keep else 'not_stored')
+        return response
+
+    @app.teardown_request
+    def _release(error):
+        # Only still claimed if the view raised and after_request never ran
+        claim = g.pop('idempotency', None)
+        if claim is not None:
+            store.finish(*claim, None)
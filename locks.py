@@ -0,0 +1,77 @@
+import threading
+import zlib
+from contextlib import contextmanager
+
+
+class RWLock:
+    """Readers-writer lock. Readers share the lock; a writer gets it alone.
+
+    Waiting writers block new readers so a steady stream of polls cannot
+    starve a join or a guess. With prefer_writers=False a reader only waits
+    for a writer that holds the lock, for readers that may block on other
+    locks while they hold this one. Not reentrant.
+    """
+
+    def __init__(self, prefer_writers: bool = True):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+        self._prefer_writers = prefer_writers
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or (self._prefer_writers and self._writers_waiting):
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class StripedLocks:
+    """Fixed pool of RWLocks picked by a stable hash of the key.
+
+    Keys that share a stripe also share a lock, which is harmless as long
+    as no caller holds two stripes at once.
+    """
+
+    def __init__(self, stripes: int = 64):
+        self._locks = [RWLock() for _ in range(stripes)]
+
+    def for_key(self, key: str) -> RWLock:
+        return self._locks[zlib.crc32(key.encode()) % len(self._locks)]
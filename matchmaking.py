@@ -0,0 +1,112 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional
+
+# Players per formed room
+GROUP_SIZE = 4
+# Width of a skill bucket in points; 0 puts everyone in one queue
+BUCKET_POINTS = int(os.environ.get('MATCHMAKING_BUCKET_POINTS', '0'))
+# Matched tickets kept for status lookups before the oldest are forgotten
+MAX_FINISHED_TICKETS = 100000
+# Recent wait times kept for percentile reporting
+WAIT_SAMPLES = 1000
+
+
+class MatchmakingQueue:
+    """FIFO queues of waiting players, optionally bucketed by points.
+
+    Every GROUP_SIZE-th enqueue in a bucket pops the oldest GROUP_SIZE
+    tickets under the lock and hands them to on_match, which must create
+    and start the room and return one player_id per ticket. Popped tickets
+    are out of the queue, so no two matches can claim the same player; if
+    on_match fails they go back to the front.
+    """
+
+    def __init__(self, on_match: Callable[[List[dict]], List[str]],
+                 bucket_points: int = BUCKET_POINTS):
+        self.on_match = on_match
+        self.bucket_points = bucket_points
+        self._lock = threading.Lock()
+        self._buckets: Dict[int, deque] = {}
+        self._waiting: Dict[str, dict] = {}
+        self._finished: Dict[str, dict] = OrderedDict()
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self.enqueued = 0
+        self.matched = 0
+        self.rooms_formed = 0
+
+    def bucket_for(self, points: int) -> int:
+        return points // self.bucket_points if self.bucket_points > 0 else 0
+
+    def enqueue(self, player_name: str, points: int = 0) -> dict:
+        ticket = {
+            'ticket_id': str(uuid.uuid4()),
+            'player_name': player_name,
+            'points': points,
+            'bucket': self.bucket_for(points),
+            'status': 'waiting',
+            'enqueued_at': time.time()
+        }
+        with self._lock:
+            queue = self._buckets.setdefault(ticket['bucket'], deque())
+            queue.append(ticket)
+            self._waiting[ticket['ticket_id']] = ticket
+            self.enqueued += 1
+            group = None
+            if len(queue) >= GROUP_SIZE:
+                group = [queue.popleft() for _ in range(GROUP_SIZE)]
+        if group:
+            self._form_room(group)
+        return dict(ticket)
+
+    def _form_room(self, group: List[dict]):
+        try:
+            player_ids = self.on_match(group)
+        except Exception:
+            with self._lock:
+                self._buckets[group[0]['bucket']].extendleft(reversed(group))
+            raise
+        matched_at = time.time()
+        with self._lock:
+            for ticket, player_id in zip(group, player_ids):
+                ticket.update(status='matched', player_id=player_id, matched_at=matched_at)
+                self._waiting.pop(ticket['ticket_id'], None)
+                self._finished[ticket['ticket_id']] = ticket
+                self._waits.append(matched_at - ticket['enqueued_at'])
+            while len(self._finished) > MAX_FINISHED_TICKETS:
+                self._finished.popitem(last=False)
+            self.matched += len(group)
+            self.rooms_formed += 1
+
+    def get_ticket(self, ticket_id: str) -> Optional[dict]:
+        with self._lock:
+            ticket = self._waiting.get(ticket_id) or self._finished.get(ticket_id)
+            return dict(ticket) if ticket else None
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            depth = {str(bucket): len(queue) for bucket, queue in self._buckets.items() if queue}
+            oldest = min((q[0]['enqueued_at'] for q in self._buckets.values() if q), default=None)
+            waits = sorted(self._waits)
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))], 4) if waits else None
+
+        return {
+            'queue_depth': sum(depth.values()),
+            'depth_by_bucket': depth,
+            'bucket_points': self.bucket_points,
+            'enqueued': self.enqueued,
+            'matched': self.matched,
+            'rooms_formed': self.rooms_formed,
+            'oldest_wait_seconds': round(now - oldest, 4) if oldest else 0.0,
+            'wait_seconds': {
+                'p50': percentile(0.50),
+                'p95': percentile(0.95),
+                'max': round(waits[-1], 4) if waits else None
+            }
+        }
@@ -0,0 +1,288 @@
+import cProfile
+import functools
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the per-request storage call and row histograms
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 1000, 10000)
+
+# Fraction of requests run under cProfile; 0 turns profiling off
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+# How many of the slowest profiled requests are kept as .pstats files
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '20'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.environ.get('DATA_DIR', 'data'), 'profiles'))
+
+PREFIX = 'rmcs_'
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...], extra: str = '') -> str:
+    parts = ['{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = PREFIX + name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} counter'.format(self.name)]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append('{}{} {}'.format(self.name, _labels(key), value))
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            else:
+                row[len(self.buckets)] += 1
+            row[-1] += value
+
+    def render(self) -> List[str]:
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            items = sorted((key, list(row)) for key, row in self._values.items())
+        for key, row in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(self.name, _labels(key, 'le="{}"'.format(bound)), cumulative))
+            cumulative += row[len(self.buckets)]
+            lines.append('{}_bucket{} {}'.format(self.name, _labels(key, 'le="+Inf"'), cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, _labels(key), round(row[-1], 6)))
+            lines.append('{}_count{} {}'.format(self.name, _labels(key), cumulative))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        metric = Counter(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+requests_total = registry.counter('http_requests_total', 'Requests handled, by route, method and status.')
+request_seconds = registry.histogram('http_request_duration_seconds', 'Request latency, by route.')
+request_storage_calls = registry.histogram(
+    'request_storage_calls', 'Storage calls made by one request, by route.', COUNT_BUCKETS)
+request_storage_rows = registry.histogram(
+    'request_storage_rows', 'Rows returned by storage to one request, by route.', COUNT_BUCKETS)
+request_lock_wait_seconds = registry.histogram(
+    'request_lock_wait_seconds', 'Time one request spent waiting for locks, by route.')
+storage_calls_total = registry.counter('storage_calls_total', 'Storage calls, by operation.')
+storage_rows_total = registry.counter('storage_rows_total', 'Rows returned by storage, by operation.')
+lock_wait_seconds = registry.histogram('lock_wait_seconds', 'Time spent waiting to acquire a lock, by lock.')
+
+
+# Per-request tallies; storage and lock hooks add to whatever request is
+# running on the current thread
+_local = threading.local()
+
+
+def _tally():
+    tally = getattr(_local, 'tally', None)
+    if tally is None:
+        tally = _local.tally = [0, 0, 0.0]  # storage calls, rows, lock wait
+    return tally
+
+
+def _count_rows(result) -> int:
+    if isinstance(result, list):
+        return sum(1 for r in result if hasattr(r, 'to_dict'))
+    return 1 if hasattr(result, 'to_dict') else 0
+
+
+def _counted_iter(operation: str, rows):
+    count = 0
+    try:
+        for row in rows:
+            count += 1
+            yield row
+    finally:
+        storage_rows_total.inc(count, operation=operation)
+        _tally()[1] += count
+
+
+def storage_call(func):
+    """Count calls to a storage function and the rows it returns.
+
+    Generators are wrapped so rows are counted as they are consumed.
+    """
+    operation = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        result = func(*args, **kwargs)
+        storage_calls_total.inc(operation=operation)
+        tally = _tally()
+        tally[0] += 1
+        if hasattr(result, '__next__'):
+            return _counted_iter(operation, result)
+        rows = _count_rows(result)
+        if rows:
+            storage_rows_total.inc(rows, operation=operation)
+            tally[1] += rows
+        return result
+    return wrapper
+
+
+@contextmanager
+def timed_lock(lock, name: str):
+    """Enter `lock` (a lock or lock context manager), recording the wait."""
+    start = time.perf_counter()
+    with lock:
+        waited = time.perf_counter() - start
+        lock_wait_seconds.observe(waited, lock=name)
+        _tally()[2] += waited
+        yield
+
+
+class SlowRequestProfiler:
+    """Runs a sample of requests under cProfile and keeps the slowest.
+
+    cProfile cannot profile two threads at once, so a request is only
+    sampled when no other request is being profiled.
+    """
+
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE, keep: int = PROFILE_KEEP,
+                 directory: str = PROFILE_DIR):
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self.directory = directory
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+        self._slowest: List[Tuple[float, int, dict]] = []
+        self._sequence = itertools.count()
+
+    def start(self):
+        """Returns a running profiler for this request, or None."""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def finish(self, profiler, route: str, method: str, seconds: float):
+        profiler.disable()
+        self._busy.release()
+        with self._lock:
+            if len(self._slowest) >= self.keep and seconds <= self._slowest[0][0]:
+                return
+            sequence = next(self._sequence)
+            entry = {
+                'file': os.path.join(self.directory, 'request-{}.pstats'.format(sequence)),
+                'route': route,
+                'method': method,
+                'seconds': round(seconds, 6),
+                'profiled_at': time.strftime('%Y-%m-%dT%H:%M:%S')
+            }
+            os.makedirs(self.directory, exist_ok=True)
+            profiler.dump_stats(entry['file'])
+            heapq.heappush(self._slowest, (seconds, sequence, entry))
+            while len(self._slowest) > self.keep:
+                _, _, evicted = heapq.heappop(self._slowest)
+                try:
+                    os.remove(evicted['file'])
+                except OSError:
+                    pass
+
+    def slowest(self) -> List[dict]:
+        with self._lock:
+            return [entry for _, _, entry in sorted(self._slowest, reverse=True)]
+
+
+profiler = SlowRequestProfiler()
+
+
+def init_app(app):
+    """Instrument every route of a Flask app."""
+    from flask import g, request
+
+    def route_of():
+        return request.url_rule.rule if request.url_rule else 'unmatched'
+
+    @app.before_request
+    def _start_request():
+        _local.tally = [0, 0, 0.0]
+        g.metrics_start = time.perf_counter()
+        g.metrics_profiler = profiler.start()
+
+    def finish(status):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return
+        seconds = time.perf_counter() - start
+        route, method = route_of(), request.method
+        calls, rows, lock_wait = _tally()
+        requests_total.inc(route=route, method=method, status=status)
+        request_seconds.observe(seconds, route=route)
+        request_storage_calls.observe(calls, route=route)
+        request_storage_rows.observe(rows, route=route)
+        request_lock_wait_seconds.observe(lock_wait, route=route)
+        running = g.pop('metrics_profiler', None)
+        if running is not None:
+            profiler.finish(running, route, method, seconds)
+
+    @app.after_request
+    def _finish_request(response):
+        # Streamed bodies are timed up to the first byte, not the last
+        finish(response.status_code)
+        return response
+
+    @app.teardown_request
+    def _teardown_request(error):
+        # Only still pending if the view raised and after_request never ran
+        finish(500)
@@ -1,28 +1,90 @@
 
 
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 from typing import Optional, List
 from datetime import datetime
 import uuid
 
-@dataclass
+
+# Rows arrive as CSV strings, JSON values or SQLite values; these accept all three.
+
+def _to_int(value) -> int:
+    if value.__class__ is int:
+        return value
+    return int(value) if value else 0
+
+
+def _to_bool(value) -> Optional[bool]:
+    if value is None or value == '':
+        return None
+    if value.__class__ is bool:
+        return value
+    if value.__class__ is int:
+        return bool(value)
+    return value == 'True'
+
+
+@dataclass(slots=True)
 class Player:
     player_id: str
     name: str
     room_id: str
-    role: Optional[str] = None 
+    role: Optional[str] = None
     points: int = 0
     joined_at: str = None
-    
+    user_id: Optional[str] = None  # Profile this seat belongs to, if any
+
     def __post_init__(self):
+        # Only new objects get here without an id; rows from storage go
+        # through from_row() and never pay for uuid4() or now()
         if not self.player_id:
             self.player_id = str(uuid.uuid4())
         if not self.joined_at:
             self.joined_at = datetime.now().isoformat()
-    
+
+    @classmethod
+    def from_row(cls, row) -> 'Player':
+        """Build from a stored row without running __post_init__."""
+        player = cls.__new__(cls)
+        player.player_id = row['player_id']
+        player.name = row['name']
+        player.room_id = row['room_id']
+        player.role = row.get('role') or None
+        player.points = _to_int(row.get('points'))
+        player.joined_at = row.get('joined_at')
+        player.user_id = row.get('user_id') or None
+        return player
+
+    @classmethod
+    def from_values(cls, values) -> 'Player':
+        """Build from a tuple of field values in declaration order (see snapshot.py)."""
+        player = cls.__new__(cls)
+        (player.player_id, player.name, player.room_id, player.role, player.points,
+         player.joined_at, player.user_id) = values
+        return player
+
+    def __copy__(self):
+        player = Player.__new__(Player)
+        player.player_id = self.player_id
+        player.name = self.name
+        player.room_id = self.room_id
+        player.role = self.role
+        player.points = self.points
+        player.joined_at = self.joined_at
+        player.user_id = self.user_id
+        return player
+
     def to_dict(self):
-        return asdict(self)
-    
+        return {
+            'player_id': self.player_id,
+            'name': self.name,
+            'room_id': self.room_id,
+            'role': self.role,
+            'points': self.points,
+            'joined_at': self.joined_at,
+            'user_id': self.user_id
+        }
+
     def to_public_dict(self):
         """Returns player info without sensitive data (role)"""
         return {
@@ -32,25 +94,74 @@ class Player:
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class Room:
     room_id: str
     created_by: str
-    status: str = 'waiting' 
+    status: str = 'waiting'
     player_count: int = 0
     created_at: str = None
-    
+    current_round: int = 0
+    current_game_id: Optional[str] = None
+    variant: str = 'classic'  # scoring variant, see scoring.py
+
     def __post_init__(self):
         if not self.room_id:
-            self.room_id = str(uuid.uuid4())[:8] 
+            self.room_id = str(uuid.uuid4())[:8]
         if not self.created_at:
             self.created_at = datetime.now().isoformat()
-    
+
+    @classmethod
+    def from_row(cls, row) -> 'Room':
+        """Build from a stored row without running __post_init__.
+
+        Rows written before multi-round rooms or variants lack those columns.
+        """
+        room = cls.__new__(cls)
+        room.room_id = row['room_id']
+        room.created_by = row.get('created_by')
+        room.status = row.get('status') or 'waiting'
+        room.player_count = _to_int(row.get('player_count'))
+        room.created_at = row.get('created_at')
+        room.current_round = _to_int(row.get('current_round'))
+        room.current_game_id = row.get('current_game_id') or None
+        room.variant = row.get('variant') or 'classic'
+        return room
+
+    @classmethod
+    def from_values(cls, values) -> 'Room':
+        """Build from a tuple of field values in declaration order (see snapshot.py)."""
+        room = cls.__new__(cls)
+        (room.room_id, room.created_by, room.status, room.player_count, room.created_at,
+         room.current_round, room.current_game_id, room.variant) = values
+        return room
+
+    def __copy__(self):
+        room = Room.__new__(Room)
+        room.room_id = self.room_id
+        room.created_by = self.created_by
+        room.status = self.status
+        room.player_count = self.player_count
+        room.created_at = self.created_at
+        room.current_round = self.current_round
+        room.current_game_id = self.current_game_id
+        room.variant = self.variant
+        return room
+
     def to_dict(self):
-        return asdict(self)
+        return {
+            'room_id': self.room_id,
+            'created_by': self.created_by,
+            'status': self.status,
+            'player_count': self.player_count,
+            'created_at': self.created_at,
+            'current_round': self.current_round,
+            'current_game_id': self.current_game_id,
+            'variant': self.variant
+        }
 
 
-@dataclass
+@dataclass(slots=True)
 class Game:
     game_id: str
     room_id: str
@@ -62,15 +173,134 @@ class Game:
     mantri_points: int = 0
     chor_points: int = 0
     sipahi_points: int = 0
-    status: str = 'in_progress'  
+    status: str = 'in_progress'
     created_at: str = None
-    
+    round_number: int = 1
+    role_assignments: Optional[str] = None  # "player_id:Role;..." for this round
+    variant: str = 'classic'
+    round_points: Optional[str] = None  # "Role:points;..." once scored
+
     def __post_init__(self):
         if not self.game_id:
             self.game_id = str(uuid.uuid4())
         if not self.created_at:
             self.created_at = datetime.now().isoformat()
-    
+
+    @classmethod
+    def from_row(cls, row) -> 'Game':
+        """Build from a stored row without running __post_init__."""
+        get = row.get
+        game = cls.__new__(cls)
+        game.game_id = row['game_id']
+        game.room_id = row['room_id']
+        game.mantri_player_id = get('mantri_player_id') or None
+        game.guessed_player_id = get('guessed_player_id') or None
+        game.chor_player_id = get('chor_player_id') or None
+        game.guess_correct = _to_bool(get('guess_correct'))
+        game.raja_points = _to_int(get('raja_points'))
+        game.mantri_points = _to_int(get('mantri_points'))
+        game.chor_points = _to_int(get('chor_points'))
+        game.sipahi_points = _to_int(get('sipahi_points'))
+        game.status = get('status') or 'in_progress'
+        game.created_at = get('created_at')
+        game.round_number = _to_int(get('round_number')) or 1
+        game.role_assignments = get('role_assignments') or None
+        game.variant = get('variant') or 'classic'
+        game.round_points = get('round_points') or None
+        return game
+
+    @classmethod
+    def from_values(cls, values) -> 'Game':
+        """Build from a tuple of field values in declaration order (see snapshot.py)."""
+        game = cls.__new__(cls)
+        (game.game_id, game.room_id, game.mantri_player_id, game.guessed_player_id,
+         game.chor_player_id, game.guess_correct, game.raja_points, game.mantri_points,
+         game.chor_points, game.sipahi_points, game.status, game.created_at,
+         game.round_number, game.role_assignments, game.variant, game.round_points) = values
+        return game
+
+    def __copy__(self):
+        game = Game.__new__(Game)
+        for name in Game.__slots__:
+            setattr(game, name, getattr(self, name))
+        return game
+
     def to_dict(self):
+        return {
+            'game_id': self.game_id,
+            'room_id': self.room_id,
+            'mantri_player_id': self.mantri_player_id,
+            'guessed_player_id': self.guessed_player_id,
+            'chor_player_id': self.chor_player_id,
+            'guess_correct': self.guess_correct,
+            'raja_points': self.raja_points,
+            'mantri_points': self.mantri_points,
+            'chor_points': self.chor_points,
+            'sipahi_points': self.sipahi_points,
+            'status': self.status,
+            'created_at': self.created_at,
+            'round_number': self.round_number,
+            'role_assignments': self.role_assignments,
+            'variant': self.variant,
+            'round_points': self.round_points
+        }
+
+
+@dataclass(slots=True)
+class Profile:
+    """A person across rooms, with lifetime totals kept up to date as games end."""
+    user_id: str
+    display_name: str
+    created_at: str = None
+    rooms_joined: int = 0
+    games_played: int = 0
+    total_points: int = 0
+    times_caught: int = 0  # rounds lost as the target (the Chor)
+    last_played_at: Optional[str] = None
+
+    def __post_init__(self):
+        if not self.user_id:
+            self.user_id = str(uuid.uuid4())
+        if not self.created_at:
+            self.created_at = datetime.now().isoformat()
+
+    @classmethod
+    def from_row(cls, row) -> 'Profile':
+        """Build from a stored row without running __post_init__."""
+        profile = cls.__new__(cls)
+        profile.user_id = row['user_id']
+        profile.display_name = row.get('display_name')
+        profile.created_at = row.get('created_at')
+        profile.rooms_joined = _to_int(row.get('rooms_joined'))
+        profile.games_played = _to_int(row.get('games_played'))
+        profile.total_points = _to_int(row.get('total_points'))
+        profile.times_caught = _to_int(row.get('times_caught'))
+        profile.last_played_at = row.get('last_played_at') or None
+        return profile
 
-        return asdict(self)
+    @classmethod
+    def from_values(cls, values) -> 'Profile':
+        """Build from a tuple of field values in declaration order (see snapshot.py)."""
+        profile = cls.__new__(cls)
+        (profile.user_id, profile.display_name, profile.created_at, profile.rooms_joined,
+         profile.games_played, profile.total_points, profile.times_caught,
+         profile.last_played_at) = values
+        return profile
+
+    def __copy__(self):
+        profile = Profile.__new__(Profile)
+        for name in Profile.__slots__:
+            setattr(profile, name, getattr(self, name))
+        return profile
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'display_name': self.display_name,
+            'created_at': self.created_at,
+            'rooms_joined': self.rooms_joined,
+            'games_played': self.games_played,
+            'total_points': self.total_points,
+            'times_caught': self.times_caught,
+            'last_played_at': self.last_played_at
+        }
@@ -0,0 +1,173 @@
+import math
+import random
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from models import Player
+
+MAX_LEVELS = 32
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels: int):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+class IndexableSkipList:
+    """Sorted collection with O(log n) insert, remove, rank and index lookup.
+
+    Each forward link also stores how many elements it skips, so the
+    position of a key is the sum of the widths walked to reach it.
+    """
+
+    def __init__(self):
+        self._head = _Node(None, MAX_LEVELS)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _path(self, key, chain: list, steps: Optional[list] = None):
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            nxt = node.next[level]
+            while nxt is not None and nxt.key < key:
+                if steps is not None:
+                    steps[level] += node.width[level]
+                node = nxt
+                nxt = node.next[level]
+            chain[level] = node
+
+    def insert(self, key):
+        chain = [None] * MAX_LEVELS
+        steps_at_level = [0] * MAX_LEVELS
+        self._path(key, chain, steps_at_level)
+        levels = min(MAX_LEVELS, 1 - int(math.log(1.0 - random.random(), 2.0)))
+        node = _Node(key, levels)
+        steps = 0
+        for level in range(levels):
+            prev = chain[level]
+            node.next[level] = prev.next[level]
+            prev.next[level] = node
+            node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain = [None] * MAX_LEVELS
+        self._path(key, chain)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for level in range(len(node.next)):
+            prev = chain[level]
+            prev.width[level] += node.width[level] - 1
+            prev.next[level] = node.next[level]
+        for level in range(len(node.next), MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def rank(self, key) -> int:
+        """0-based position of key."""
+        node = self._head
+        position = 0
+        for level in reversed(range(MAX_LEVELS)):
+            nxt = node.next[level]
+            while nxt is not None and nxt.key < key:
+                position += node.width[level]
+                node = nxt
+                nxt = node.next[level]
+        nxt = node.next[0]
+        if nxt is None or nxt.key != key:
+            raise KeyError(key)
+        return position
+
+    def _node_at(self, index: int) -> _Node:
+        node = self._head
+        index += 1
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not None and node.width[level] <= index:
+                index -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def __getitem__(self, index: int):
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        return self._node_at(index).key
+
+    def slice(self, start: int, count: int) -> Iterable:
+        if start >= self.size or count <= 0:
+            return
+        node = self._node_at(start)
+        while node is not None and count:
+            yield node.key
+            node = node.next[0]
+            count -= 1
+
+
+class GlobalLeaderboard:
+    """Every player ranked by total points, kept up to date incrementally.
+
+    Ties are broken by player_id so ranks are stable between calls.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ranking = IndexableSkipList()
+        self._entries: Dict[str, Tuple[int, str, str]] = {}
+
+    def __len__(self):
+        return len(self._ranking)
+
+    def update(self, player: Player):
+        with self._lock:
+            self._update(player)
+
+    def update_many(self, players: Iterable[Player]):
+        with self._lock:
+            for player in players:
+                self._update(player)
+
+    def _update(self, player: Player):
+        old = self._entries.get(player.player_id)
+        if old is not None:
+            if old == (player.points, player.name, player.room_id):
+                return
+            self._ranking.remove((-old[0], player.player_id))
+        self._entries[player.player_id] = (player.points, player.name, player.room_id)
+        self._ranking.insert((-player.points, player.player_id))
+
+    def remove(self, player_id: str):
+        with self._lock:
+            old = self._entries.pop(player_id, None)
+            if old is not None:
+                self._ranking.remove((-old[0], player_id))
+
+    def _entry(self, rank: int, player_id: str) -> dict:
+        points, name, room_id = self._entries[player_id]
+        return {
+            'rank': rank,
+            'player_id': player_id,
+            'name': name,
+            'room_id': room_id,
+            'total_points': points
+        }
+
+    def top(self, limit: int, offset: int = 0) -> List[dict]:
+        with self._lock:
+            return [self._entry(offset + i + 1, player_id)
+                    for i, (_, player_id) in enumerate(self._ranking.slice(offset, limit))]
+
+    def rank_of(self, player_id: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(player_id)
+            if entry is None:
+                return None
+            return self._entry(self._ranking.rank((-entry[0], player_id)) + 1, player_id)
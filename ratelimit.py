@@ -0,0 +1,160 @@
+"""Rate limits and admission control.
+
+Every request takes a token from its client's bucket and, for routes with
+a room, from the room's bucket; an empty bucket answers 429 with
+Retry-After. Routes that reach storage also need one of
+MAX_CONCURRENT_REQUESTS slots, waiting at most ADMISSION_TIMEOUT seconds
+for one before answering 503, so a burst is shed instead of queueing on
+the storage locks. Setting a rate or MAX_CONCURRENT_REQUESTS to 0 turns
+that check off.
+
+Clients are told apart by address (behind a proxy set
+RATE_LIMIT_TRUST_PROXY=1 to use the address it adds to X-Forwarded-For).
+Buckets live in process memory in bounded LRUs, so each worker limits the
+traffic it sees.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+import metrics
+
+# Sustained requests per second and burst size, per client address
+RATE_LIMIT_CLIENT_RATE = float(os.environ.get('RATE_LIMIT_CLIENT_RATE', '20'))
+RATE_LIMIT_CLIENT_BURST = int(os.environ.get('RATE_LIMIT_CLIENT_BURST', '40'))
+# Sustained requests per second and burst size, per room, from all clients
+RATE_LIMIT_ROOM_RATE = float(os.environ.get('RATE_LIMIT_ROOM_RATE', '50'))
+RATE_LIMIT_ROOM_BURST = int(os.environ.get('RATE_LIMIT_ROOM_BURST', '100'))
+# Buckets kept per limiter; the least recently used one is dropped first
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000'))
+RATE_LIMIT_TRUST_PROXY = os.environ.get('RATE_LIMIT_TRUST_PROXY', '0') == '1'
+
+# Requests on storage routes served at once, and how long one waits for a slot
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('MAX_CONCURRENT_REQUESTS', '64'))
+ADMISSION_TIMEOUT = float(os.environ.get('ADMISSION_TIMEOUT', '0.05'))
+
+# Routes that never touch storage, or hold a connection open for long
+# (event streams), skip admission control
+UNLIMITED_ROUTES = {'/health', '/metrics', '/metrics/profiling', '/cache/stats',
+                    '/scoring/variants', '/matchmaking/stats', '/room/events/<room_id>'}
+
+decisions_total = metrics.registry.counter(
+    'rate_limit_decisions_total', 'Rate limit and admission decisions, by limiter and decision.')
+admission_wait_seconds = metrics.registry.histogram(
+    'admission_wait_seconds', 'Time spent waiting for a concurrency slot.')
+
+
+class TokenBuckets:
+    """One token bucket per key, refilled at rate tokens/s up to burst."""
+
+    def __init__(self, rate: float, burst: int, maxsize: int = RATE_LIMIT_MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        # key -> [tokens, last refill]
+        self._buckets: Dict[str, List[float]] = OrderedDict()
+
+    def take(self, key: str) -> float:
+        """Take a token for key; returns 0, or seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now]
+                if len(self._buckets) > self.maxsize:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            return (1 - bucket[0]) / self.rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+client_buckets = TokenBuckets(RATE_LIMIT_CLIENT_RATE, RATE_LIMIT_CLIENT_BURST)
+room_buckets = TokenBuckets(RATE_LIMIT_ROOM_RATE, RATE_LIMIT_ROOM_BURST)
+admission = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS) if MAX_CONCURRENT_REQUESTS > 0 else None
+
+
+def client_of(request) -> str:
+    """Address identifying the client that sent a Flask request."""
+    if RATE_LIMIT_TRUST_PROXY and request.access_route:
+        # The last hop is the one our proxy added
+        return request.access_route[-1]
+    return request.remote_addr or 'unknown'
+
+
+def init_app(app):
+    """Apply the per-client and per-room rate limits to every route of a Flask app."""
+    from flask import jsonify, request
+
+    def room_of():
+        room_id = (request.view_args or {}).get('room_id')
+        if room_id is None and request.method == 'POST' and request.path == '/room/join':
+            data = request.get_json(silent=True)
+            room_id = data.get('room_id') if isinstance(data, dict) else None
+        return room_id if isinstance(room_id, str) else None
+
+    def too_many(limiter, retry_after):
+        decisions_total.inc(limiter=limiter, decision='limited')
+        response = jsonify({'error': 'Too many requests, retry later'})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
+
+    @app.before_request
+    def _limit():
+        if RATE_LIMIT_CLIENT_RATE > 0:
+            retry_after = client_buckets.take(client_of(request))
+            if retry_after:
+                return too_many('client', retry_after)
+            decisions_total.inc(limiter='client', decision='allowed')
+        room_id = room_of() if RATE_LIMIT_ROOM_RATE > 0 else None
+        if room_id is not None:
+            retry_after = room_buckets.take(room_id)
+            if retry_after:
+                return too_many('room', retry_after)
+            decisions_total.inc(limiter='room', decision='allowed')
+        return None
+
+
+def init_admission(app):
+    """Cap concurrent requests on the storage routes of a Flask app.
+
+    Registered after the hooks that answer without storage (see app.py), so
+    those never hold a slot.
+    """
+    if admission is None:
+        return
+    from flask import g, jsonify, request
+
+    @app.before_request
+    def _admit():
+        rule = request.url_rule.rule if request.url_rule else None
+        if rule is None or rule in UNLIMITED_ROUTES:
+            return None
+        start = time.perf_counter()
+        if not admission.acquire(timeout=ADMISSION_TIMEOUT):
+            decisions_total.inc(limiter='concurrency', decision='shed')
+            response = jsonify({'error': 'Server busy, retry shortly'})
+            response.status_code = 503
+            response.headers['Retry-After'] = '1'
+            return response
+        admission_wait_seconds.observe(time.perf_counter() - start)
+        decisions_total.inc(limiter='concurrency', decision='allowed')
+        g.admitted = True
+        return None
+
+    @app.teardown_request
+    def _release(error):
+        if g.pop('admitted', False):
+            admission.release()
@@ -0,0 +1,114 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+import database as db
+import events
+import workers
+from archive import ArchiveStore
+
+# Waiting rooms with no join for this long are deleted
+WAITING_ROOM_TTL = float(os.environ.get('WAITING_ROOM_TTL', 3600))
+# Finished rooms with no activity for this long move to the archive
+FINISHED_ROOM_TTL = float(os.environ.get('FINISHED_ROOM_TTL', 86400))
+# Seconds between reaper passes
+REAPER_INTERVAL = float(os.environ.get('REAPER_INTERVAL', 60))
+
+ARCHIVE_DIR = os.path.join(db.DATA_DIR, 'archive')
+
+logger = logging.getLogger(__name__)
+
+_archive: Optional[ArchiveStore] = None
+_archive_lock = threading.Lock()
+
+
+def get_archive() -> ArchiveStore:
+    global _archive
+    if _archive is None:
+        with _archive_lock:
+            if _archive is None:
+                _archive = ArchiveStore(ARCHIVE_DIR)
+    return _archive
+
+
+def _timestamp(value: str) -> float:
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def last_activity(room, players, games) -> float:
+    stamps = [room.created_at] + [p.joined_at for p in players] + [g.created_at for g in games]
+    return max(_timestamp(s) for s in stamps)
+
+
+def reap_room(room_id: str, now: float) -> Optional[str]:
+    """Expire or archive one room if it is due. Returns what was done."""
+    with db.room_lock(room_id):
+        room = db.get_room(room_id)
+        if room is None or room.status not in ('waiting', 'finished'):
+            return None
+        players = db.get_players_in_room(room_id)
+        games = db.get_games_in_room(room_id)
+        idle = now - last_activity(room, players, games)
+
+        if room.status == 'waiting' and idle > WAITING_ROOM_TTL:
+            db.delete_room(room_id)
+            events.bus.publish(room_id, 'room_expired', {})
+            return 'expired'
+
+        if room.status == 'finished' and idle > FINISHED_ROOM_TTL:
+            get_archive().archive_room(room, players, games)
+            db.delete_room(room_id)
+            return 'archived'
+    return None
+
+
+def reap_once(now: float = None) -> dict:
+    """One pass over the hot store."""
+    now = now or time.time()
+    counts = {'expired': 0, 'archived': 0}
+    # Each worker only reaps the rooms it owns
+    candidates = [r.room_id for r in db.iter_rooms()
+                  if r.status in ('waiting', 'finished') and workers.is_local(r.room_id)]
+    for room_id in candidates:
+        outcome = reap_room(room_id, now)
+        if outcome:
+            counts[outcome] += 1
+    return counts
+
+
+class Reaper(threading.Thread):
+    """Daemon thread that runs reap_once() every REAPER_INTERVAL seconds."""
+
+    def __init__(self, interval: float = REAPER_INTERVAL):
+        super().__init__(name='room-reaper', daemon=True)
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                counts = reap_once()
+                if counts['expired'] or counts['archived']:
+                    logger.info('reaper: %(expired)d expired, %(archived)d archived', counts)
+            except Exception:
+                logger.exception('reaper pass failed')
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_reaper: Optional[Reaper] = None
+
+
+def start_reaper() -> Reaper:
+    global _reaper
+    if _reaper is None:
+        _reaper = Reaper()
+        _reaper.start()
+    return _reaper
@@ -0,0 +1,219 @@
+"""Recompute every player's total from game history with the current rules.
+
+    python recompute_scores.py --dry-run --output stats.json
+    python recompute_scores.py --backend sqlite --data-dir data
+
+Run it with the server stopped, after changing point values in scoring.py
+or SCORING_RULES. Completed games are loaded into columnar NumPy arrays,
+one entry per seat, and the points, totals, per-role win rates and the
+guesser's accuracy are computed in a few vectorized passes. Totals and
+the games' stored round points are then written back in one transaction.
+
+A role "wins" a round when it gets the better of its two possible
+outcomes; roles that score the same either way have no win rate. Games
+from before role_assignments was stored take the roles their players
+hold now, which is right for rooms that only ever played one round.
+Profile totals are left alone: they also count rooms the reaper has
+since removed from storage.
+"""
+import argparse
+import json
+import sys
+import time
+from array import array
+
+import numpy as np
+
+import database as db
+import game_logic as logic
+import scoring
+
+
+class History:
+    """Completed games flattened into parallel arrays."""
+
+    def __init__(self, players, games, variant_names, role_names):
+        self.players = players
+        self.games = games
+        self.variant_names = variant_names
+        self.role_names = role_names
+        # One entry per seat in a completed game
+        self.seat_player = array('i')
+        self.seat_role = array('i')
+        self.seat_game = array('i')
+        # One entry per completed game
+        self.game_variant = array('i')
+        self.game_correct = array('b')
+        self.game_guesser = array('i')
+        self.skipped = 0
+
+
+def load_history(repository) -> History:
+    players = list(repository.iter_players())
+    player_index = {p.player_id: i for i, p in enumerate(players)}
+    current_roles = {}
+    for player in players:
+        current_roles.setdefault(player.room_id, {})[player.player_id] = player.role
+
+    variant_names = list(scoring.variants)
+    variant_index = {name: i for i, name in enumerate(variant_names)}
+    role_names = sorted({role for v in scoring.variants.values() for role in v.roles})
+    role_index = {role: i for i, role in enumerate(role_names)}
+
+    games = [g for g in repository.iter_games('completed') if g.guess_correct is not None]
+    history = History(players, [], variant_names, role_names)
+    for game in games:
+        if game.variant not in variant_index:
+            raise ValueError('game {} uses unknown scoring variant {}'.format(game.game_id, game.variant))
+        roles = (logic.decode_role_assignments(game.role_assignments)
+                 or current_roles.get(game.room_id, {}))
+        seats = [(player_index[pid], role_index[role]) for pid, role in roles.items()
+                 if pid in player_index and role in role_index]
+        if not seats or game.mantri_player_id not in player_index:
+            history.skipped += 1
+            continue
+        number = len(history.games)
+        history.games.append(game)
+        for player, role in seats:
+            history.seat_player.append(player)
+            history.seat_role.append(role)
+            history.seat_game.append(number)
+        history.game_variant.append(variant_index[game.variant])
+        history.game_correct.append(bool(game.guess_correct))
+        history.game_guesser.append(player_index[game.mantri_player_id])
+    return history
+
+
+def point_tables(history: History) -> np.ndarray:
+    """points[variant, guess_correct, role]"""
+    points = np.zeros((len(history.variant_names), 2, len(history.role_names)), dtype=np.int64)
+    for v, name in enumerate(history.variant_names):
+        variant = scoring.variants[name]
+        for role in variant.roles:
+            r = history.role_names.index(role)
+            points[v, 0, r] = variant.miss[role]
+            points[v, 1, r] = variant.hit[role]
+    return points
+
+
+def _rate(numerator, denominator):
+    return round(float(numerator) / denominator, 4) if denominator else None
+
+
+def compute(history: History) -> dict:
+    points = point_tables(history)
+    seat_player = np.frombuffer(history.seat_player, dtype=np.int32)
+    seat_role = np.frombuffer(history.seat_role, dtype=np.int32)
+    seat_game = np.frombuffer(history.seat_game, dtype=np.int32)
+    game_variant = np.frombuffer(history.game_variant, dtype=np.int32)
+    game_correct = np.frombuffer(history.game_correct, dtype=np.int8).astype(np.intp)
+    game_guesser = np.frombuffer(history.game_guesser, dtype=np.int32)
+
+    seat_variant = game_variant[seat_game]
+    seat_correct = game_correct[seat_game]
+    seat_points = points[seat_variant, seat_correct, seat_role]
+    totals = np.bincount(seat_player, weights=seat_points,
+                         minlength=len(history.players)).astype(np.int64)
+
+    # Per (variant, role): rounds played, points and wins
+    best = points.max(axis=1)
+    decisive = points[:, 0, :] != points[:, 1, :]
+    key = seat_variant * len(history.role_names) + seat_role
+    slots = len(history.variant_names) * len(history.role_names)
+    rounds = np.bincount(key, minlength=slots)
+    role_points = np.bincount(key, weights=seat_points, minlength=slots)
+    wins = np.bincount(key, weights=seat_points == best[seat_variant, seat_role], minlength=slots)
+    roles = []
+    for v, variant_name in enumerate(history.variant_names):
+        for r, role in enumerate(history.role_names):
+            k = v * len(history.role_names) + r
+            if rounds[k]:
+                roles.append({
+                    'variant': variant_name,
+                    'role': role,
+                    'rounds': int(rounds[k]),
+                    'avg_points': round(float(role_points[k]) / rounds[k], 2),
+                    'win_rate': _rate(wins[k], rounds[k]) if decisive[v, r] else None
+                })
+
+    guesses = np.bincount(game_guesser, minlength=len(history.players))
+    correct = np.bincount(game_guesser, weights=game_correct, minlength=len(history.players))
+    by_variant = {}
+    for v, variant_name in enumerate(history.variant_names):
+        played = game_variant == v
+        if played.any():
+            by_variant[variant_name] = _rate(game_correct[played].sum(), played.sum())
+    return {
+        'totals': totals,
+        'stats': {
+            'games': len(history.games),
+            'games_skipped': history.skipped,
+            'players': len(history.players),
+            'guess_accuracy': _rate(game_correct.sum(), len(history.games)),
+            'guess_accuracy_by_variant': by_variant,
+            'roles': roles,
+            'guessers': [{
+                'player_id': history.players[i].player_id,
+                'name': history.players[i].name,
+                'guesses': int(guesses[i]),
+                'accuracy': _rate(correct[i], guesses[i])
+            } for i in np.flatnonzero(guesses)]
+        }
+    }
+
+
+def changed_records(history: History, result: dict):
+    players = []
+    for player, total in zip(history.players, result['totals'].tolist()):
+        if player.points != total:
+            player.points = total
+            players.append(player)
+    games = []
+    for game in history.games:
+        scores = scoring.variants[game.variant].scores(bool(game.guess_correct))
+        if game.round_points != scores.encoded:
+            logic.record_scores(game, scores)
+            games.append(game)
+    return players, games
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=['csv', 'sqlite'], default=db.STORAGE_BACKEND)
+    parser.add_argument('--data-dir', default=db.DATA_DIR)
+    parser.add_argument('--dry-run', action='store_true', help='compute and report, write nothing')
+    parser.add_argument('--output', help='write the statistics to this JSON file')
+    args = parser.parse_args()
+
+    repository = db.create_repository(args.backend, args.data_dir)
+    start = time.time()
+    history = load_history(repository)
+    loaded = time.time()
+    result = compute(history)
+    computed = time.time()
+    players, games = changed_records(history, result)
+    if not args.dry_run and (players or games):
+        with repository.transaction():
+            repository.update_players_batch(players)
+            for game in games:
+                repository.update_game(game)
+        if hasattr(repository, 'compact'):
+            repository.compact()
+    repository.close()
+
+    stats = result['stats']
+    print('{} games, {} players: loaded in {:.2f}s, computed in {:.3f}s'.format(
+        stats['games'], stats['players'], loaded - start, computed - loaded))
+    print('guess accuracy: {}'.format(stats['guess_accuracy']))
+    for row in stats['roles']:
+        print('  {variant:<16} {role:<8} {rounds:>8} rounds  avg {avg_points:>8}  win rate {win_rate}'.format(**row))
+    print('{} {} player totals and {} games'.format(
+        'would update' if args.dry_run else 'updated', len(players), len(games)))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(stats, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
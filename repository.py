@@ -0,0 +1,231 @@
+import copy
+import zlib
+from dataclasses import fields
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+from models import Room, Player, Game, Profile
+import scoring
+
+ROOM_FIELDS = [f.name for f in fields(Room)]
+PLAYER_FIELDS = [f.name for f in fields(Player)]
+GAME_FIELDS = [f.name for f in fields(Game)]
+PROFILE_FIELDS = [f.name for f in fields(Profile)]
+
+# Profile fields that add_to_profiles() increments
+PROFILE_COUNTERS = ('rooms_joined', 'games_played', 'total_points', 'times_caught')
+
+
+def room_capacity(room: Room) -> int:
+    """Seats in a room: one per role of its scoring variant."""
+    return scoring.get_variant(room.variant).capacity
+
+
+def shard_index(room_id: str, shards: int) -> int:
+    """Stable room-to-partition mapping shared by storage shards and workers."""
+    return zlib.crc32(room_id.encode()) % shards
+
+
+def in_time_range(stamp: Optional[str], since: Optional[str], until: Optional[str]) -> bool:
+    """since <= stamp < until on ISO-8601 strings; either bound may be None."""
+    if since and (not stamp or stamp < since):
+        return False
+    if until and (not stamp or stamp >= until):
+        return False
+    return True
+
+
+def apply_profile_delta(profile: Profile, delta: Dict):
+    """Add one add_to_profiles() delta to profile in place."""
+    for counter in PROFILE_COUNTERS:
+        setattr(profile, counter, getattr(profile, counter) + delta.get(counter, 0))
+    played_at = delta.get('last_played_at')
+    if played_at and (not profile.last_played_at or played_at > profile.last_played_at):
+        profile.last_played_at = played_at
+
+
+class RoomNotFound(Exception):
+    pass
+
+
+class RoomFull(Exception):
+    pass
+
+
+class GameAlreadyStarted(Exception):
+    pass
+
+
+def plan_seats(players: List[Player], capacity: Optional[int],
+               load_room: Callable[[str], Optional[Room]],
+               count_players: Callable[[str], int]
+               ) -> Tuple[List[Union[int, Exception]], List[Player], List[Room]]:
+    """Decide which of players get a seat, in order.
+
+    Returns one seat index or exception per player, the players to insert
+    and the rooms whose player_count changed. capacity None means each
+    room's own room_capacity(). Backends call this while they hold whatever
+    makes the affected rooms stable.
+    """
+    rooms: Dict[str, Optional[Room]] = {}
+    seats: Dict[str, int] = {}
+    results: List[Union[int, Exception]] = []
+    accepted: List[Player] = []
+    for player in players:
+        room_id = player.room_id
+        if room_id not in rooms:
+            room = load_room(room_id)
+            rooms[room_id] = copy.copy(room) if room else None
+            seats[room_id] = count_players(room_id)
+        room = rooms[room_id]
+        if room is None:
+            results.append(RoomNotFound(room_id))
+        elif seats[room_id] >= (capacity or room_capacity(room)):
+            results.append(RoomFull(room_id))
+        elif room.status != 'waiting':
+            results.append(GameAlreadyStarted(room_id))
+        else:
+            results.append(seats[room_id])
+            seats[room_id] += 1
+            room.player_count = seats[room_id]
+            accepted.append(player)
+    touched = {p.room_id for p in accepted}
+    return results, accepted, [room for room_id, room in rooms.items() if room_id in touched]
+
+
+class Repository:
+    """Storage interface used by database.py.
+
+    Backends implement every method below. transaction() groups the writes
+    of one API call so they are applied (and persisted) together; calls made
+    outside a transaction run in their own.
+    """
+
+    # Set by database.py and called with (room_ids, players, removed player
+    # ids) when a backend applies changes written by another process.
+    on_replay = None
+    # False if other processes' changes can appear without on_replay
+    reports_external_changes = False
+
+    def transaction(self):
+        raise NotImplementedError
+
+    def create_room(self, room: Room) -> Room:
+        raise NotImplementedError
+
+    def get_room(self, room_id: str) -> Optional[Room]:
+        raise NotImplementedError
+
+    def update_room(self, room: Room):
+        raise NotImplementedError
+
+    def iter_rooms(self) -> Iterator[Room]:
+        """Every stored room, in no particular order."""
+        raise NotImplementedError
+
+    def delete_room(self, room_id: str):
+        """Remove a room together with its players and games."""
+        raise NotImplementedError
+
+    def add_player(self, player: Player) -> Player:
+        raise NotImplementedError
+
+    def create_rooms(self, rooms: List[Room], players: List[Player]):
+        """Insert many rooms and their first players in one write."""
+        raise NotImplementedError
+
+    def reserve_seat(self, player: Player, capacity: int = None) -> int:
+        """Atomically check the room and add player to it.
+
+        Returns the 0-based seat index and bumps the room's player_count.
+        capacity defaults to the room's own, see room_capacity().
+        Raises RoomNotFound, GameAlreadyStarted or RoomFull instead of
+        adding the player.
+        """
+        result = self.reserve_seats([player], capacity)[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def reserve_seats(self, players: List[Player],
+                      capacity: int = None) -> List[Union[int, Exception]]:
+        """reserve_seat() for many players at once, persisted in one write.
+
+        Returns a seat index or the exception reserve_seat() would have
+        raised, one per player in order.
+        """
+        raise NotImplementedError
+
+    def get_players_in_room(self, room_id: str) -> List[Player]:
+        raise NotImplementedError
+
+    def get_player(self, player_id: str, room_id: str = None) -> Optional[Player]:
+        """room_id, if known, lets sharded storage skip probing every shard."""
+        raise NotImplementedError
+
+    def iter_players(self, since: str = None, until: str = None) -> Iterator[Player]:
+        """Every stored player, in no particular order, optionally by joined_at."""
+        raise NotImplementedError
+
+    def update_player(self, player: Player):
+        raise NotImplementedError
+
+    def update_players_batch(self, players: List[Player]):
+        raise NotImplementedError
+
+    def create_game(self, game: Game) -> Game:
+        raise NotImplementedError
+
+    def get_current_game(self, room_id: str) -> Optional[Game]:
+        raise NotImplementedError
+
+    def get_game(self, game_id: str, room_id: str = None) -> Optional[Game]:
+        raise NotImplementedError
+
+    def get_game_by_round(self, room_id: str, round_number: int) -> Optional[Game]:
+        raise NotImplementedError
+
+    def get_games_in_room(self, room_id: str) -> List[Game]:
+        """All games of a room, oldest first."""
+        raise NotImplementedError
+
+    def get_latest_game(self, room_id: str, status: str = 'completed') -> Optional[Game]:
+        raise NotImplementedError
+
+    def update_game(self, game: Game):
+        raise NotImplementedError
+
+    def iter_games(self, status: str = None, since: str = None, until: str = None) -> Iterator[Game]:
+        """Stored games one at a time, optionally by status and created_at.
+
+        Must not hold any store-wide lock between yields: callers stream
+        the results to slow clients.
+        """
+        raise NotImplementedError
+
+    def create_profile(self, profile: Profile) -> Profile:
+        raise NotImplementedError
+
+    def get_profile(self, user_id: str) -> Optional[Profile]:
+        raise NotImplementedError
+
+    def iter_profiles(self) -> Iterator[Profile]:
+        raise NotImplementedError
+
+    def update_profiles(self, profiles: List[Profile]):
+        """Overwrite whole profiles; only for offline jobs."""
+        raise NotImplementedError
+
+    def add_to_profiles(self, deltas: Dict[str, Dict]):
+        """Atomically add {user_id: {counter: n, 'last_played_at': iso}} to profiles.
+
+        Counters are those in PROFILE_COUNTERS; last_played_at only moves
+        forward. Deltas for unknown users are ignored. Increments from
+        concurrent requests (or processes) for the same user are never lost.
+        """
+        raise NotImplementedError
+
+    def get_players_by_user(self, user_id: str) -> List[Player]:
+        """Every stored seat of one profile, oldest first."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
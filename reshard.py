@@ -0,0 +1,106 @@
+"""Move stored rooms to a different number of shards.
+
+    python reshard.py --to 8                # from STORAGE_SHARDS (default 1)
+    python reshard.py --from 8 --to 16 --backend sqlite --data-dir data
+
+Run it with the server stopped. Every room, player, game and profile is
+copied into a staging directory laid out for the new shard count, then the
+old files are moved to DATA_DIR/pre-reshard-<timestamp>-*/ and the new ones put in
+their place. Start the server again with STORAGE_SHARDS set to the new
+count (and WORKER_COUNT to match, if running several workers).
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import database as db
+
+# Everything a backend keeps directly in its data directory
+STORAGE_PATTERNS = ['rooms.csv', 'players.csv', 'games.csv', 'profiles.csv', 'changes.log', 'changes.*.log',
+                    'changes.lock', 'snapshot.bin', 'game.db', 'game.db-wal', 'game.db-shm', 'shard-*']
+BATCH_SIZE = 1000
+
+
+def storage_paths(directory: str):
+    paths = []
+    for pattern in STORAGE_PATTERNS:
+        paths.extend(glob.glob(os.path.join(directory, pattern)))
+    return sorted(set(paths))
+
+
+def batches(records, size: int = BATCH_SIZE):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def copy_all(source, target) -> dict:
+    counts = {'rooms': 0, 'players': 0, 'games': 0, 'profiles': 0}
+    for rooms in batches(source.iter_rooms()):
+        target.create_rooms(rooms, [])
+        counts['rooms'] += len(rooms)
+    for players in batches(source.iter_players()):
+        target.create_rooms([], players)
+        counts['players'] += len(players)
+    for games in batches(source.iter_games()):
+        with target.transaction():
+            for game in games:
+                target.create_game(game)
+        counts['games'] += len(games)
+    for profiles in batches(source.iter_profiles()):
+        with target.transaction():
+            for profile in profiles:
+                target.create_profile(profile)
+        counts['profiles'] += len(profiles)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--to', type=int, required=True, dest='to_shards')
+    parser.add_argument('--from', type=int, default=db.STORAGE_SHARDS, dest='from_shards')
+    parser.add_argument('--backend', choices=['csv', 'sqlite'], default=db.STORAGE_BACKEND)
+    parser.add_argument('--data-dir', default=db.DATA_DIR)
+    args = parser.parse_args()
+    if args.to_shards < 1 or args.to_shards == args.from_shards:
+        parser.error('--to must be a positive shard count different from --from')
+
+    staging = os.path.join(args.data_dir, 'reshard-tmp')
+    if os.path.exists(staging):
+        parser.error('{} exists; remove it (left by an interrupted run) first'.format(staging))
+
+    source = db.create_repository(args.backend, args.data_dir, args.from_shards)
+    target = db.create_repository(args.backend, staging, args.to_shards)
+    start = time.time()
+    counts = copy_all(source, target)
+    if hasattr(target, 'compact'):
+        target.compact()
+    target.close()
+    source.close()
+
+    backup = tempfile.mkdtemp(prefix='pre-reshard-{}-'.format(time.strftime('%Y%m%d-%H%M%S')),
+                              dir=args.data_dir)
+    for path in storage_paths(args.data_dir):
+        shutil.move(path, os.path.join(backup, os.path.basename(path)))
+    for path in storage_paths(staging):
+        shutil.move(path, os.path.join(args.data_dir, os.path.basename(path)))
+    shutil.rmtree(staging)
+
+    print('{rooms} rooms, {players} players, {games} games, {profiles} profiles: '
+          '{0} -> {1} shards in {2:.1f}s'.format(
+        args.from_shards, args.to_shards, time.time() - start, **counts))
+    print('old files kept in ' + backup)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""Run one uvicorn process per core, each owning a share of the rooms.
+
+    python run_workers.py --workers 8 --base-port 5000 --backend sqlite
+
+Worker i listens on base-port + i and serves the rooms that workers.py
+assigns to it, redirecting the rest. All workers share DATA_DIR. Prefer
+--backend sqlite: SQLite coordinates writers across processes itself,
+while the CSV backend follows a shared change log and keeps every row in
+memory in every worker. With STORAGE_SHARDS equal to --workers (see
+reshard.py) each worker is the only writer of its own shard.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--base-port', type=int, default=5000)
+    parser.add_argument('--backend', choices=['csv', 'sqlite'],
+                        default=os.environ.get('STORAGE_BACKEND', 'sqlite'))
+    args = parser.parse_args()
+
+    processes = []
+    for worker in range(args.workers):
+        env = dict(os.environ,
+                   WORKER_ID=str(worker),
+                   WORKER_COUNT=str(args.workers),
+                   WORKER_BASE_PORT=str(args.base_port),
+                   STORAGE_BACKEND=args.backend)
+        processes.append(subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'asgi:application',
+             '--host', args.host, '--port', str(args.base_port + worker)],
+            env=env, cwd=os.path.dirname(os.path.abspath(__file__))))
+    print('{} workers on ports {}-{} ({} storage)'.format(
+        args.workers, args.base_port, args.base_port + args.workers - 1, args.backend))
+
+    stopping = []
+
+    def stop(*_):
+        stopping.append(True)
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        # A worker that dies takes its rooms with it, so stop them all
+        while all(p.poll() is None for p in processes):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        stopping.append(True)
+    # Non-zero only if a worker died on its own
+    status = 1 if not stopping and any(p.returncode for p in processes) else 0
+    stop()
+    for process in processes:
+        process.wait()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
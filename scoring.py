@@ -0,0 +1,207 @@
+"""Scoring variants: which roles are dealt and what each role scores.
+
+Each variant is a dict of rules:
+
+    {
+        "roles": ["Raja", "Mantri", "Chor", "Sipahi"],  # one player per role
+        "guesser": "Mantri",                            # who names the target
+        "target": "Chor",                               # who must be found
+        "points": {"Raja": 1000, "Mantri": 800, ...},   # after a correct guess
+        "on_miss": {"Mantri": 0, "Chor": {"steal": ["Mantri", "Sipahi"]}},
+        "descriptions": {"Raja": "..."}                 # optional
+    }
+
+on_miss overrides points after a wrong guess: a number, or {"steal": [...]}
+for the sum of those roles' points. Variants in the JSON file named by
+SCORING_RULES are added to (or replace) the built-in ones. Rules are
+compiled once into read-only tables, so scoring a game is a lookup.
+"""
+import json
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Tuple
+
+SCORING_RULES = os.environ.get('SCORING_RULES')
+DEFAULT_VARIANT = 'classic'
+
+ROLE_TITLES = {
+    'Raja': 'King',
+    'Rani': 'Queen',
+    'Mantri': 'Minister',
+    'Chor': 'Thief',
+    'Sipahi': 'Soldier'
+}
+
+VARIANTS = {
+    'classic': {
+        'roles': ['Raja', 'Mantri', 'Chor', 'Sipahi'],
+        'guesser': 'Mantri',
+        'target': 'Chor',
+        'points': {'Raja': 1000, 'Mantri': 800, 'Chor': 0, 'Sipahi': 500},
+        # The Chor walks off with the Mantri's and Sipahi's points
+        'on_miss': {'Mantri': 0, 'Sipahi': 0, 'Chor': {'steal': ['Mantri', 'Sipahi']}},
+        'descriptions': {
+            'Raja': 'You are the Raja (King). Observe and wait for results. You get 1000 points.',
+            'Mantri': 'You are the Mantri (Minister). You must guess who the Chor is!',
+            'Chor': 'You are the Chor (Thief). Try not to get caught!',
+            'Sipahi': 'You are the Sipahi (Soldier). Wait for Mantri to make their guess.'
+        }
+    },
+    'sipahi_guesses': {
+        'roles': ['Raja', 'Mantri', 'Chor', 'Sipahi'],
+        'guesser': 'Sipahi',
+        'target': 'Chor',
+        'points': {'Raja': 1000, 'Mantri': 800, 'Chor': 0, 'Sipahi': 500},
+        'on_miss': {'Sipahi': 0, 'Chor': {'steal': ['Sipahi']}}
+    },
+    'five_roles': {
+        'roles': ['Raja', 'Rani', 'Mantri', 'Chor', 'Sipahi'],
+        'guesser': 'Mantri',
+        'target': 'Chor',
+        'points': {'Raja': 1000, 'Rani': 900, 'Mantri': 800, 'Chor': 0, 'Sipahi': 500},
+        'on_miss': {'Mantri': 0, 'Sipahi': 0, 'Chor': {'steal': ['Mantri', 'Sipahi']}}
+    }
+}
+
+
+class PointTable(dict):
+    """Read-only role -> points table that knows its stored encoding."""
+
+    __slots__ = ('encoded',)
+
+    def __init__(self, points):
+        super().__init__(points)
+        self.encoded = ';'.join('{}:{}'.format(role, value) for role, value in self.items())
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('point tables are read-only')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+
+@dataclass(frozen=True, slots=True)
+class Variant:
+    name: str
+    roles: Tuple[str, ...]
+    guesser: str
+    target: str
+    hit: PointTable   # points per role after a correct guess
+    miss: PointTable  # points per role after a wrong guess
+    descriptions: Mapping[str, str]
+
+    @property
+    def capacity(self) -> int:
+        return len(self.roles)
+
+    def scores(self, guess_correct: bool) -> PointTable:
+        return self.hit if guess_correct else self.miss
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'roles': list(self.roles),
+            'capacity': self.capacity,
+            'guesser': self.guesser,
+            'target': self.target,
+            'points': dict(self.hit),
+            'points_on_miss': dict(self.miss)
+        }
+
+
+def _describe(role: str, guesser: str, target: str, points: int) -> str:
+    title = ROLE_TITLES.get(role)
+    text = 'You are the {}{}. '.format(role, ' ({})'.format(title) if title else '')
+    if role == guesser:
+        return text + 'You must guess who the {} is!'.format(target)
+    if role == target:
+        return text + 'Try not to get caught!'
+    return text + 'Wait for {} to make their guess. You get {} points.'.format(guesser, points)
+
+
+def compile_variant(name: str, rules: dict) -> Variant:
+    """Check a variant's rules and turn them into lookup tables."""
+    roles = tuple(rules.get('roles') or ())
+    if len(roles) < 2 or len(set(roles)) != len(roles):
+        raise ValueError('{}: roles must list at least two distinct roles'.format(name))
+    for key in ('guesser', 'target'):
+        if rules.get(key) not in roles:
+            raise ValueError('{}: {} must be one of the roles'.format(name, key))
+    if rules['guesser'] == rules['target']:
+        raise ValueError('{}: guesser and target must differ'.format(name))
+    points = rules.get('points') or {}
+    if set(points) != set(roles) or not all(isinstance(p, int) for p in points.values()):
+        raise ValueError('{}: points must give a whole number for every role'.format(name))
+
+    miss = dict(points)
+    for role, rule in (rules.get('on_miss') or {}).items():
+        if role not in roles:
+            raise ValueError('{}: on_miss names unknown role {}'.format(name, role))
+        if isinstance(rule, dict):
+            stolen = rule.get('steal') or []
+            if not set(stolen) <= set(roles):
+                raise ValueError('{}: {} steals from an unknown role'.format(name, role))
+            miss[role] = sum(points[r] for r in stolen)
+        elif isinstance(rule, int):
+            miss[role] = rule
+        else:
+            raise ValueError('{}: on_miss for {} must be a number or a steal rule'.format(name, role))
+
+    descriptions = {role: _describe(role, rules['guesser'], rules['target'], points[role])
+                    for role in roles}
+    descriptions.update(rules.get('descriptions') or {})
+    return Variant(
+        name=name,
+        roles=roles,
+        guesser=rules['guesser'],
+        target=rules['target'],
+        hit=PointTable((role, points[role]) for role in roles),
+        miss=PointTable((role, miss[role]) for role in roles),
+        descriptions=MappingProxyType(descriptions)
+    )
+
+
+def load_variants(path: str = None) -> Dict[str, Variant]:
+    rules = dict(VARIANTS)
+    if path:
+        with open(path) as f:
+            rules.update(json.load(f))
+    return {name: compile_variant(name, variant_rules) for name, variant_rules in rules.items()}
+
+
+variants = load_variants(SCORING_RULES)
+
+
+def get_variant(name: Optional[str] = None) -> Variant:
+    try:
+        return variants[name or DEFAULT_VARIANT]
+    except KeyError:
+        raise ValueError('Unknown scoring variant: {}'.format(name)) from None
+
+
+def encode_points(points: Mapping[str, int]) -> str:
+    if isinstance(points, PointTable):
+        return points.encoded
+    return PointTable(points).encoded
+
+
+@lru_cache(maxsize=1024)
+def decode_points(value: str) -> PointTable:
+    # Only a couple of distinct values exist per variant, so this is
+    # nearly always a cache hit
+    return PointTable((role, int(points)) for role, points in
+                      (item.split(':', 1) for item in value.split(';')))
+
+
+def round_points(game) -> Mapping[str, int]:
+    """Points each role scored in a completed game."""
+    if game.round_points:
+        return decode_points(game.round_points)
+    # Games scored before variants only have the four classic columns
+    return {
+        'Raja': game.raja_points,
+        'Mantri': game.mantri_points,
+        'Chor': game.chor_points,
+        'Sipahi': game.sipahi_points
+    }
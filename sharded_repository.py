@@ -0,0 +1,221 @@
+import glob
+import os
+import threading
+from contextlib import ExitStack, contextmanager
+from itertools import chain
+from typing import Dict, Iterator, List, Optional, Union
+from models import Room, Player, Game, Profile
+from repository import Repository, shard_index
+
+
+def shard_dirs(data_dir: str, shards: int) -> List[str]:
+    return [os.path.join(data_dir, 'shard-{:02d}'.format(i)) for i in range(shards)]
+
+
+def check_layout(data_dir: str, shards: int):
+    """Refuse to open data written with a different shard count.
+
+    Rooms would silently be looked up in the wrong shard otherwise.
+    """
+    found = len(glob.glob(os.path.join(data_dir, 'shard-*')))
+    if not found and any(os.path.exists(os.path.join(data_dir, name))
+                         for name in ('rooms.csv', 'game.db')):
+        found = 1
+    if found and found != shards:
+        raise ValueError('{} holds {} shard(s) but STORAGE_SHARDS is {}; run reshard.py'.format(
+            data_dir, found, shards))
+
+
+class ShardedRepository(Repository):
+    """Rooms partitioned by shard_index(room_id) over independent backends.
+
+    A room's players and games live in the room's shard, so requests for
+    different rooms usually touch different files or databases. With
+    WORKER_COUNT equal to the shard count, worker i is the only writer of
+    shard i. Lookups by player or game id without a room_id hint probe
+    every shard. Profiles are partitioned the same way by user_id; a
+    profile's seats can be in any shard.
+    """
+
+    def __init__(self, shards: List[Repository]):
+        self.shards = shards
+        self._local = threading.local()
+
+    def _shard_at(self, index: int) -> Repository:
+        shard = self.shards[index]
+        stack = getattr(self._local, 'stack', None)
+        if stack is not None and index not in self._local.entered:
+            # Join the shard to the open transaction on first use
+            self._local.entered.add(index)
+            stack.enter_context(shard.transaction())
+        return shard
+
+    def _shard(self, room_id: str) -> Repository:
+        return self._shard_at(shard_index(room_id, len(self.shards)))
+
+    def _group(self, records, key) -> Dict[int, list]:
+        groups: Dict[int, list] = {}
+        for record in records:
+            groups.setdefault(shard_index(key(record), len(self.shards)), []).append(record)
+        return groups
+
+    @property
+    def on_replay(self):
+        return self.shards[0].on_replay
+
+    @on_replay.setter
+    def on_replay(self, callback):
+        for shard in self.shards:
+            shard.on_replay = callback
+
+    @property
+    def reports_external_changes(self):
+        return all(shard.reports_external_changes for shard in self.shards)
+
+    @contextmanager
+    def transaction(self):
+        """One transaction per shard touched, committed in order on exit.
+
+        Shards are committed one after another, so a crash between two
+        commits can leave a multi-shard batch half applied.
+        """
+        if getattr(self._local, 'stack', None) is not None:
+            yield
+            return
+        with ExitStack() as stack:
+            self._local.stack = stack
+            self._local.entered = set()
+            try:
+                yield
+            finally:
+                self._local.stack = None
+
+    def create_room(self, room: Room) -> Room:
+        return self._shard(room.room_id).create_room(room)
+
+    def get_room(self, room_id: str) -> Optional[Room]:
+        return self._shard(room_id).get_room(room_id)
+
+    def update_room(self, room: Room):
+        self._shard(room.room_id).update_room(room)
+
+    def iter_rooms(self) -> Iterator[Room]:
+        return chain.from_iterable(shard.iter_rooms() for shard in self.shards)
+
+    def delete_room(self, room_id: str):
+        self._shard(room_id).delete_room(room_id)
+
+    def add_player(self, player: Player) -> Player:
+        return self._shard(player.room_id).add_player(player)
+
+    def create_rooms(self, rooms: List[Room], players: List[Player]):
+        room_groups = self._group(rooms, lambda r: r.room_id)
+        player_groups = self._group(players, lambda p: p.room_id)
+        with self.transaction():
+            for index in sorted(set(room_groups) | set(player_groups)):
+                shard = self._shard_at(index)
+                shard.create_rooms(room_groups.get(index, []), player_groups.get(index, []))
+
+    def reserve_seats(self, players: List[Player],
+                      capacity: int = None) -> List[Union[int, Exception]]:
+        results: List[Union[int, Exception]] = [None] * len(players)
+        positions = self._group(range(len(players)), lambda i: players[i].room_id)
+        with self.transaction():
+            for index in sorted(positions):
+                shard_results = self._shard_at(index).reserve_seats(
+                    [players[i] for i in positions[index]], capacity)
+                for i, result in zip(positions[index], shard_results):
+                    results[i] = result
+        return results
+
+    def get_players_in_room(self, room_id: str) -> List[Player]:
+        return self._shard(room_id).get_players_in_room(room_id)
+
+    def get_player(self, player_id: str, room_id: str = None) -> Optional[Player]:
+        if room_id:
+            player = self._shard(room_id).get_player(player_id)
+            if player is not None:
+                return player
+        for shard in self.shards:
+            player = shard.get_player(player_id)
+            if player is not None:
+                return player
+        return None
+
+    def iter_players(self, since: str = None, until: str = None) -> Iterator[Player]:
+        return chain.from_iterable(shard.iter_players(since, until) for shard in self.shards)
+
+    def update_player(self, player: Player):
+        self._shard(player.room_id).update_player(player)
+
+    def update_players_batch(self, players: List[Player]):
+        groups = self._group(players, lambda p: p.room_id)
+        with self.transaction():
+            for index in sorted(groups):
+                self._shard_at(index).update_players_batch(groups[index])
+
+    def create_game(self, game: Game) -> Game:
+        return self._shard(game.room_id).create_game(game)
+
+    def get_current_game(self, room_id: str) -> Optional[Game]:
+        return self._shard(room_id).get_current_game(room_id)
+
+    def get_game(self, game_id: str, room_id: str = None) -> Optional[Game]:
+        if room_id:
+            game = self._shard(room_id).get_game(game_id)
+            if game is not None:
+                return game
+        for shard in self.shards:
+            game = shard.get_game(game_id)
+            if game is not None:
+                return game
+        return None
+
+    def get_game_by_round(self, room_id: str, round_number: int) -> Optional[Game]:
+        return self._shard(room_id).get_game_by_round(room_id, round_number)
+
+    def get_games_in_room(self, room_id: str) -> List[Game]:
+        return self._shard(room_id).get_games_in_room(room_id)
+
+    def get_latest_game(self, room_id: str, status: str = 'completed') -> Optional[Game]:
+        return self._shard(room_id).get_latest_game(room_id, status)
+
+    def update_game(self, game: Game):
+        self._shard(game.room_id).update_game(game)
+
+    def iter_games(self, status: str = None, since: str = None, until: str = None) -> Iterator[Game]:
+        return chain.from_iterable(shard.iter_games(status, since, until) for shard in self.shards)
+
+    def create_profile(self, profile: Profile) -> Profile:
+        return self._shard(profile.user_id).create_profile(profile)
+
+    def get_profile(self, user_id: str) -> Optional[Profile]:
+        return self._shard(user_id).get_profile(user_id)
+
+    def iter_profiles(self) -> Iterator[Profile]:
+        return chain.from_iterable(shard.iter_profiles() for shard in self.shards)
+
+    def update_profiles(self, profiles: List[Profile]):
+        groups = self._group(profiles, lambda p: p.user_id)
+        with self.transaction():
+            for index in sorted(groups):
+                self._shard_at(index).update_profiles(groups[index])
+
+    def add_to_profiles(self, deltas: Dict[str, Dict]):
+        groups = self._group(deltas, lambda user_id: user_id)
+        with self.transaction():
+            for index in sorted(groups):
+                self._shard_at(index).add_to_profiles({u: deltas[u] for u in groups[index]})
+
+    def get_players_by_user(self, user_id: str) -> List[Player]:
+        players = [p for shard in self.shards for p in shard.get_players_by_user(user_id)]
+        return sorted(players, key=lambda p: p.joined_at or '')
+
+    def compact(self):
+        for shard in self.shards:
+            if hasattr(shard, 'compact'):
+                shard.compact()
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
@@ -0,0 +1,159 @@
+"""Binary snapshot of the CSV tables for fast cold starts.
+
+    python snapshot.py                      # write one for DATA_DIR now, server stopped
+    python snapshot.py --data-dir data --shards 4
+
+The CSV backend writes snapshot.bin next to the CSVs every time it
+compacts, and loads from it instead of parsing the CSVs when it is
+current. Layout:
+
+    MAGIC
+    one marshal section per table: a list of row tuples in field order
+    index: JSON with each table's fields, offset, length and row count,
+           the Python and marshal versions, and the fingerprint of the CSVs
+    8-byte offset of the index, MAGIC
+
+The fingerprint is each CSV's size, mtime and inode when the snapshot was
+written. Compaction replaces every CSV, so a snapshot that does not match
+the CSVs on disk (a crash between the two, a CSV edited or restored by
+hand), was written by another Python version or for different model fields
+is stale and the CSVs are read instead. Changes since the last compaction
+are in changes.log either way and replay on top.
+"""
+import argparse
+import json
+import logging
+import marshal
+import os
+import struct
+import sys
+import time
+from operator import attrgetter
+from typing import Dict, Optional
+
+from models import Room, Player, Game, Profile
+from repository import ROOM_FIELDS, PLAYER_FIELDS, GAME_FIELDS, PROFILE_FIELDS
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = 'snapshot.bin'
+MAGIC = b'RMCSNAP1'
+TRAILER = struct.Struct('<Q8s')
+
+TABLES = {
+    'rooms': (Room, ROOM_FIELDS),
+    'players': (Player, PLAYER_FIELDS),
+    'games': (Game, GAME_FIELDS),
+    'profiles': (Profile, PROFILE_FIELDS)
+}
+
+
+def fingerprint(sources: Dict[str, str]) -> Dict[str, list]:
+    """size, mtime and inode of each table's CSV file."""
+    result = {}
+    for table, path in sources.items():
+        st = os.stat(path)
+        result[table] = [st.st_size, st.st_mtime_ns, st.st_ino]
+    return result
+
+
+def _versions() -> dict:
+    return {'python': list(sys.version_info[:2]), 'marshal': marshal.version}
+
+
+def write_snapshot(path: str, records: Dict[str, list], sources: Dict[str, str]):
+    """Write records (table -> model objects) as a snapshot of the CSVs in sources.
+
+    The CSVs must already hold the same records.
+    """
+    index = dict(_versions(), sources=fingerprint(sources), tables={})
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        for table, (cls, fields) in TABLES.items():
+            rows = records.get(table, [])
+            data = marshal.dumps(list(map(attrgetter(*fields), rows)))
+            index['tables'][table] = {'fields': fields, 'offset': f.tell(),
+                                      'length': len(data), 'rows': len(rows)}
+            f.write(data)
+        index_offset = f.tell()
+        f.write(json.dumps(index).encode())
+        f.write(TRAILER.pack(index_offset, MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_index(f) -> Optional[dict]:
+    if f.read(len(MAGIC)) != MAGIC:
+        return None
+    f.seek(-TRAILER.size, os.SEEK_END)
+    end = f.tell()
+    index_offset, magic = TRAILER.unpack(f.read(TRAILER.size))
+    if magic != MAGIC or not len(MAGIC) <= index_offset < end:
+        return None
+    f.seek(index_offset)
+    return json.loads(f.read(end - index_offset))
+
+
+def read_snapshot(path: str, sources: Dict[str, str]) -> Optional[Dict[str, list]]:
+    """table -> model objects, or None if there is no current snapshot."""
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    with f:
+        try:
+            index = _read_index(f)
+        except (OSError, ValueError, struct.error):
+            index = None
+        if index is None:
+            logger.warning('%s is not a snapshot, reading the CSVs', path)
+            return None
+        reason = None
+        if {k: index.get(k) for k in ('python', 'marshal')} != _versions():
+            reason = 'written by another Python version'
+        elif index.get('sources') != fingerprint(sources):
+            reason = 'older or newer than the CSVs'
+        elif any(index['tables'].get(table, {}).get('fields') != fields
+                 for table, (cls, fields) in TABLES.items()):
+            reason = 'for different fields'
+        if reason:
+            logger.info('%s is %s, reading the CSVs', path, reason)
+            return None
+
+        try:
+            records = {}
+            for table, (cls, fields) in TABLES.items():
+                section = index['tables'][table]
+                f.seek(section['offset'])
+                rows = marshal.loads(f.read(section['length']))
+                if len(rows) != section['rows']:
+                    raise ValueError('{} rows in {}, expected {}'.format(len(rows), table, section['rows']))
+                records[table] = list(map(cls.from_values, rows))
+            return records
+        except (EOFError, ValueError, TypeError) as e:
+            logger.warning('%s is damaged (%s), reading the CSVs', path, e)
+            return None
+
+
+def main():
+    import database as db
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data-dir', default=db.DATA_DIR)
+    parser.add_argument('--shards', type=int, default=db.STORAGE_SHARDS)
+    args = parser.parse_args()
+
+    start = time.time()
+    repository = db.create_repository('csv', args.data_dir, args.shards)
+    loaded = time.time()
+    # Compaction writes the snapshot
+    repository.compact()
+    repository.close()
+    print('loaded in {:.2f}s, snapshot written in {:.2f}s'.format(loaded - start, time.time() - loaded))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
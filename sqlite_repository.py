@@ -0,0 +1,354 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from models import Room, Player, Game, Profile
+from repository import (Repository, ROOM_FIELDS, PLAYER_FIELDS, GAME_FIELDS, PROFILE_FIELDS,
+                        PROFILE_COUNTERS, plan_seats)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rooms (
+    room_id TEXT PRIMARY KEY,
+    created_by TEXT,
+    status TEXT NOT NULL,
+    player_count INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT,
+    current_round INTEGER NOT NULL DEFAULT 0,
+    current_game_id TEXT,
+    variant TEXT NOT NULL DEFAULT 'classic'
+);
+CREATE INDEX IF NOT EXISTS idx_rooms_status ON rooms(status);
+
+CREATE TABLE IF NOT EXISTS players (
+    player_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    room_id TEXT NOT NULL,
+    role TEXT,
+    points INTEGER NOT NULL DEFAULT 0,
+    joined_at TEXT,
+    user_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_players_room ON players(room_id);
+
+CREATE TABLE IF NOT EXISTS games (
+    game_id TEXT PRIMARY KEY,
+    room_id TEXT NOT NULL,
+    mantri_player_id TEXT,
+    guessed_player_id TEXT,
+    chor_player_id TEXT,
+    guess_correct INTEGER,
+    raja_points INTEGER NOT NULL DEFAULT 0,
+    mantri_points INTEGER NOT NULL DEFAULT 0,
+    chor_points INTEGER NOT NULL DEFAULT 0,
+    sipahi_points INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    created_at TEXT,
+    round_number INTEGER NOT NULL DEFAULT 1,
+    role_assignments TEXT,
+    variant TEXT NOT NULL DEFAULT 'classic',
+    round_points TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_games_room_status ON games(room_id, status);
+
+CREATE TABLE IF NOT EXISTS profiles (
+    user_id TEXT PRIMARY KEY,
+    display_name TEXT,
+    created_at TEXT,
+    rooms_joined INTEGER NOT NULL DEFAULT 0,
+    games_played INTEGER NOT NULL DEFAULT 0,
+    total_points INTEGER NOT NULL DEFAULT 0,
+    times_caught INTEGER NOT NULL DEFAULT 0,
+    last_played_at TEXT
+);
+"""
+
+# Columns added after the first release; older databases get them on open
+MIGRATIONS = [
+    ('rooms', 'current_round', 'INTEGER NOT NULL DEFAULT 0'),
+    ('rooms', 'current_game_id', 'TEXT'),
+    ('games', 'round_number', 'INTEGER NOT NULL DEFAULT 1'),
+    ('games', 'role_assignments', 'TEXT'),
+    ('rooms', 'variant', "TEXT NOT NULL DEFAULT 'classic'"),
+    ('games', 'variant', "TEXT NOT NULL DEFAULT 'classic'"),
+    ('games', 'round_points', 'TEXT'),
+    ('players', 'user_id', 'TEXT'),
+]
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_games_room_round ON games(room_id, round_number);
+CREATE INDEX IF NOT EXISTS idx_games_created_at ON games(created_at);
+CREATE INDEX IF NOT EXISTS idx_players_user ON players(user_id);
+"""
+
+# Counters are added in SQL, so concurrent writers never lose an increment
+ADD_TO_PROFILE_SQL = (
+    'UPDATE profiles SET {}, last_played_at = COALESCE(MAX(last_played_at, ?), ?, last_played_at) '
+    'WHERE user_id = ?'.format(', '.join('{0} = {0} + ?'.format(c) for c in PROFILE_COUNTERS)))
+
+
+def _insert_sql(table: str, fields: List[str]) -> str:
+    return 'INSERT INTO {} ({}) VALUES ({})'.format(
+        table, ', '.join(fields), ', '.join('?' for _ in fields))
+
+
+def _update_sql(table: str, fields: List[str]) -> str:
+    return 'UPDATE {} SET {} WHERE {} = ?'.format(
+        table, ', '.join(f + ' = ?' for f in fields[1:]), fields[0])
+
+
+def _values(record, fields: List[str]) -> tuple:
+    return tuple(getattr(record, f) for f in fields)
+
+
+def _update_values(record, fields: List[str]) -> tuple:
+    return tuple(getattr(record, f) for f in fields[1:]) + (getattr(record, fields[0]),)
+
+
+def _time_range(column: str, since: Optional[str], until: Optional[str]) -> Tuple[str, tuple]:
+    clauses, params = [], ()
+    if since:
+        clauses.append(column + ' >= ?')
+        params += (since,)
+    if until:
+        clauses.append(column + ' < ?')
+        params += (until,)
+    return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+
+def _game_from_row(row: sqlite3.Row) -> Game:
+    return Game.from_row(dict(row))
+
+
+class SqliteRepository(Repository):
+    """SQLite storage in WAL mode.
+
+    Each thread gets its own connection; close() closes all of them. Every
+    public call runs in a transaction; wrapping several calls in
+    transaction() makes them commit (or roll back) together. BEGIN IMMEDIATE takes the write lock up front,
+    so reads made inside a transaction cannot be invalidated by another
+    writer before it commits.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        self._migrate(conn)
+        conn.executescript(INDEXES)
+
+    def _migrate(self, conn: sqlite3.Connection):
+        for table, column, definition in MIGRATIONS:
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info({})'.format(table))}
+            if column not in columns:
+                conn.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(table, column, definition))
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Only ever used by this thread, but close() may run on another
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30,
+                                   check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.depth = 0
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self._connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        self._local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+        finally:
+            self._local.depth = 0
+
+    def close(self):
+        """Checkpoint the WAL into the database and close every thread's connection."""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        if connections:
+            try:
+                connections[0].execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            except sqlite3.Error:
+                pass  # closing the last connection checkpoints too
+        for conn in connections:
+            conn.close()
+        self._local.conn = None
+
+    def create_room(self, room: Room) -> Room:
+        with self.transaction() as conn:
+            conn.execute(_insert_sql('rooms', ROOM_FIELDS), _values(room, ROOM_FIELDS))
+        return room
+
+    def get_room(self, room_id: str) -> Optional[Room]:
+        row = self._connection().execute(
+            'SELECT * FROM rooms WHERE room_id = ?', (room_id,)).fetchone()
+        return Room.from_row(dict(row)) if row else None
+
+    def update_room(self, room: Room):
+        with self.transaction() as conn:
+            conn.execute(_update_sql('rooms', ROOM_FIELDS), _update_values(room, ROOM_FIELDS))
+
+    def iter_rooms(self) -> Iterator[Room]:
+        cursor = self._connection().execute('SELECT * FROM rooms')
+        for row in cursor:
+            yield Room.from_row(dict(row))
+
+    def delete_room(self, room_id: str):
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM games WHERE room_id = ?', (room_id,))
+            conn.execute('DELETE FROM players WHERE room_id = ?', (room_id,))
+            conn.execute('DELETE FROM rooms WHERE room_id = ?', (room_id,))
+
+    def add_player(self, player: Player) -> Player:
+        with self.transaction() as conn:
+            conn.execute(_insert_sql('players', PLAYER_FIELDS), _values(player, PLAYER_FIELDS))
+        return player
+
+    def create_rooms(self, rooms: List[Room], players: List[Player]):
+        with self.transaction() as conn:
+            conn.executemany(_insert_sql('rooms', ROOM_FIELDS),
+                             [_values(r, ROOM_FIELDS) for r in rooms])
+            conn.executemany(_insert_sql('players', PLAYER_FIELDS),
+                             [_values(p, PLAYER_FIELDS) for p in players])
+
+    def reserve_seats(self, players: List[Player],
+                      capacity: int = None) -> List[Union[int, Exception]]:
+        with self.transaction() as conn:
+            results, accepted, rooms = plan_seats(
+                players, capacity, self.get_room,
+                lambda room_id: conn.execute(
+                    'SELECT COUNT(*) FROM players WHERE room_id = ?', (room_id,)).fetchone()[0])
+            conn.executemany(_insert_sql('players', PLAYER_FIELDS),
+                             [_values(p, PLAYER_FIELDS) for p in accepted])
+            conn.executemany('UPDATE rooms SET player_count = ? WHERE room_id = ?',
+                             [(r.player_count, r.room_id) for r in rooms])
+        return results
+
+    def get_players_in_room(self, room_id: str) -> List[Player]:
+        rows = self._connection().execute(
+            'SELECT * FROM players WHERE room_id = ? ORDER BY rowid', (room_id,)).fetchall()
+        return [Player.from_row(dict(row)) for row in rows]
+
+    def get_player(self, player_id: str, room_id: str = None) -> Optional[Player]:
+        row = self._connection().execute(
+            'SELECT * FROM players WHERE player_id = ?', (player_id,)).fetchone()
+        return Player.from_row(dict(row)) if row else None
+
+    def iter_players(self, since: str = None, until: str = None) -> Iterator[Player]:
+        where, params = _time_range('joined_at', since, until)
+        cursor = self._connection().execute('SELECT * FROM players' + where, params)
+        for row in cursor:
+            yield Player.from_row(dict(row))
+
+    def update_player(self, player: Player):
+        self.update_players_batch([player])
+
+    def update_players_batch(self, players: List[Player]):
+        with self.transaction() as conn:
+            conn.executemany(_update_sql('players', PLAYER_FIELDS),
+                             [_update_values(p, PLAYER_FIELDS) for p in players])
+
+    def create_game(self, game: Game) -> Game:
+        with self.transaction() as conn:
+            conn.execute(_insert_sql('games', GAME_FIELDS), _values(game, GAME_FIELDS))
+        return game
+
+    def get_current_game(self, room_id: str) -> Optional[Game]:
+        row = self._connection().execute(
+            "SELECT * FROM games WHERE room_id = ? AND status = 'in_progress' ORDER BY rowid LIMIT 1",
+            (room_id,)).fetchone()
+        return _game_from_row(row) if row else None
+
+    def get_game(self, game_id: str, room_id: str = None) -> Optional[Game]:
+        row = self._connection().execute(
+            'SELECT * FROM games WHERE game_id = ?', (game_id,)).fetchone()
+        return _game_from_row(row) if row else None
+
+    def get_game_by_round(self, room_id: str, round_number: int) -> Optional[Game]:
+        row = self._connection().execute(
+            'SELECT * FROM games WHERE room_id = ? AND round_number = ?',
+            (room_id, round_number)).fetchone()
+        return _game_from_row(row) if row else None
+
+    def get_games_in_room(self, room_id: str) -> List[Game]:
+        rows = self._connection().execute(
+            'SELECT * FROM games WHERE room_id = ? ORDER BY round_number, rowid', (room_id,)).fetchall()
+        return [_game_from_row(row) for row in rows]
+
+    def get_latest_game(self, room_id: str, status: str = 'completed') -> Optional[Game]:
+        row = self._connection().execute(
+            'SELECT * FROM games WHERE room_id = ? AND status = ? ORDER BY rowid DESC LIMIT 1',
+            (room_id, status)).fetchone()
+        return _game_from_row(row) if row else None
+
+    def update_game(self, game: Game):
+        with self.transaction() as conn:
+            conn.execute(_update_sql('games', GAME_FIELDS), _update_values(game, GAME_FIELDS))
+
+    def iter_games(self, status: str = None, since: str = None, until: str = None) -> Iterator[Game]:
+        # A plain read cursor: in WAL mode it sees one snapshot and never
+        # blocks writers, and rows are fetched as the caller consumes them
+        where, params = _time_range('created_at', since, until)
+        if status:
+            where += (' AND' if where else ' WHERE') + ' status = ?'
+            params += (status,)
+        cursor = self._connection().execute('SELECT * FROM games' + where, params)
+        for row in cursor:
+            yield _game_from_row(row)
+
+    def create_profile(self, profile: Profile) -> Profile:
+        with self.transaction() as conn:
+            conn.execute(_insert_sql('profiles', PROFILE_FIELDS), _values(profile, PROFILE_FIELDS))
+        return profile
+
+    def get_profile(self, user_id: str) -> Optional[Profile]:
+        row = self._connection().execute(
+            'SELECT * FROM profiles WHERE user_id = ?', (user_id,)).fetchone()
+        return Profile.from_row(dict(row)) if row else None
+
+    def iter_profiles(self) -> Iterator[Profile]:
+        cursor = self._connection().execute('SELECT * FROM profiles')
+        for row in cursor:
+            yield Profile.from_row(dict(row))
+
+    def update_profiles(self, profiles: List[Profile]):
+        with self.transaction() as conn:
+            conn.executemany(_update_sql('profiles', PROFILE_FIELDS),
+                             [_update_values(p, PROFILE_FIELDS) for p in profiles])
+
+    def add_to_profiles(self, deltas: Dict[str, Dict]):
+        with self.transaction() as conn:
+            conn.executemany(ADD_TO_PROFILE_SQL, [
+                tuple(delta.get(c, 0) for c in PROFILE_COUNTERS)
+                + (delta.get('last_played_at'),) * 2 + (user_id,)
+                for user_id, delta in deltas.items()])
+
+    def get_players_by_user(self, user_id: str) -> List[Player]:
+        rows = self._connection().execute(
+            'SELECT * FROM players WHERE user_id = ? ORDER BY joined_at', (user_id,)).fetchall()
+        return [Player.from_row(dict(row)) for row in rows]
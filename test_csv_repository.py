@@ -0,0 +1,72 @@
+import shutil
+import threading
+
+import pytest
+
+from csv_repository import CsvRepository
+from models import Room, Player
+from sharded_repository import ShardedRepository, shard_dirs
+
+SHARDS = 2
+
+
+def open_repository(data_dir, shards, commit_interval):
+    if shards == 1:
+        return CsvRepository(str(data_dir), compact_every=5, commit_interval=commit_interval)
+    return ShardedRepository([CsvRepository(path, compact_every=5, commit_interval=commit_interval)
+                              for path in shard_dirs(str(data_dir), shards)])
+
+
+def reopen(data_dir, shards):
+    repository = open_repository(data_dir, shards, 0)
+    try:
+        return repository.get_room('room1'), repository.get_players_in_room('room1')
+    finally:
+        repository.close()
+
+
+@pytest.mark.parametrize('shards', [1, SHARDS])
+@pytest.mark.parametrize('commit_interval', [0, 0.001])
+def test_compaction_never_snapshots_half_a_transaction(tmp_path, shards, commit_interval):
+    data_dir = tmp_path / 'data'
+    repository = open_repository(data_dir, shards, commit_interval)
+    repository.create_room(Room('room1', 'p1'))
+    paused, resume = threading.Event(), threading.Event()
+
+    def finish_room():
+        with repository.transaction():
+            room = repository.get_room('room1')
+            room.status = 'finished'
+            repository.update_room(room)
+            paused.set()
+            resume.wait(10)
+            repository.add_player(Player('p1', 'A', 'room1'))
+
+    def write_others():
+        # Enough writes on every shard to make each one compact
+        for i in range(20 * shards):
+            repository.create_room(Room('other{}'.format(i), 'x'))
+
+    transaction = threading.Thread(target=finish_room)
+    transaction.start()
+    assert paused.wait(10)
+    writes = threading.Thread(target=write_others)
+    writes.start()
+    # Compaction has to wait for the paused transaction
+    writes.join(0.5)
+    assert writes.is_alive()
+
+    # What a crash right now would leave on disk
+    shutil.copytree(data_dir, tmp_path / 'crashed')
+    room, players = reopen(tmp_path / 'crashed', shards)
+    assert room.status == 'waiting'
+    assert players == []
+
+    resume.set()
+    transaction.join(10)
+    writes.join(10)
+    assert not transaction.is_alive() and not writes.is_alive()
+    repository.close()
+    room, players = reopen(data_dir, shards)
+    assert room.status == 'finished'
+    assert [p.player_id for p in players] == ['p1']
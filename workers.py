@@ -0,0 +1,80 @@
+"""Room-to-worker pinning for multi-process deployments.
+
+Each worker process runs with WORKER_ID (0..WORKER_COUNT-1) and listens on
+WORKER_BASE_PORT + WORKER_ID (see run_workers.py). A room belongs to worker
+crc32(room_id) % WORKER_COUNT, so every write to a room, its response cache,
+its event stream and its room lock live in one process. Requests for a
+room that reach the wrong worker get a 307 to its owner; a proxy that
+hashes on the room id the same way avoids the extra hop.
+"""
+import os
+import uuid
+from repository import shard_index
+
+WORKER_COUNT = int(os.environ.get('WORKER_COUNT', '1'))
+WORKER_ID = int(os.environ.get('WORKER_ID', '0'))
+WORKER_BASE_PORT = int(os.environ.get('WORKER_BASE_PORT', '5000'))
+# Optional comma-separated base URL of each worker, e.g. when they run on
+# different hosts; by default the request's host with the worker's port
+WORKER_URLS = [u.rstrip('/') for u in os.environ.get('WORKER_URLS', '').split(',') if u]
+
+# Routes with process-local state that is not tied to one room are served
+# by a single worker
+SINGLE_WORKER_PREFIXES = ('/matchmaking/',)
+
+
+def worker_for(room_id: str) -> int:
+    # Same mapping as storage shards, so with STORAGE_SHARDS == WORKER_COUNT
+    # each worker writes exactly one shard
+    return shard_index(room_id, WORKER_COUNT)
+
+
+def is_local(room_id: str) -> bool:
+    return WORKER_COUNT <= 1 or worker_for(room_id) == WORKER_ID
+
+
+def new_room_id() -> str:
+    """A fresh room id owned by this worker."""
+    while True:
+        room_id = str(uuid.uuid4())[:8]
+        if is_local(room_id):
+            return room_id
+
+
+def worker_url(worker: int, host: str) -> str:
+    if WORKER_URLS:
+        return WORKER_URLS[worker]
+    hostname = host.rsplit(':', 1)[0] if not host.endswith(']') else host
+    return 'http://{}:{}'.format(hostname, WORKER_BASE_PORT + worker)
+
+
+def redirect_location(worker: int, host: str, path: str, query: str) -> str:
+    return worker_url(worker, host) + path + ('?' + query if query else '')
+
+
+def owner_of_request(path: str, room_id: str = None) -> int:
+    """Worker that must serve this request, or None if any worker can."""
+    if path.startswith(SINGLE_WORKER_PREFIXES):
+        return 0
+    if room_id:
+        return worker_for(room_id)
+    return None
+
+
+def init_app(app):
+    """Redirect room requests that reached the wrong worker."""
+    if WORKER_COUNT <= 1:
+        return
+    from flask import redirect, request
+
+    @app.before_request
+    def _pin_to_owner():
+        room_id = (request.view_args or {}).get('room_id')
+        if room_id is None and request.method == 'POST' and request.path == '/room/join':
+            data = request.get_json(silent=True)
+            room_id = data.get('room_id') if isinstance(data, dict) else None
+        owner = owner_of_request(request.path, room_id if isinstance(room_id, str) else None)
+        if owner is not None and owner != WORKER_ID:
+            # 307 keeps the method and body of POSTs
+            return redirect(redirect_location(owner, request.host, request.path,
+                                              request.query_string.decode()), code=307)